@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+TorCOIN HTTP Benchmark
+Starts coin_server, test_server and torcoin_proxy on local ports, drives them
+with an asyncio load generator and reports requests/sec, latency percentiles
+and server memory. Results are saved as JSON so runs can be compared.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import uvloop  # Optional faster event loop for the load generator
+except ImportError:
+    uvloop = None
+
+try:
+    import psutil  # Optional, for RSS on platforms without /proc
+except ImportError:
+    psutil = None
+
+# Configuration
+BENCH_HOST = "127.0.0.1"
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TARGETS = ("coin_threaded", "coin_asyncio", "test_server", "proxy_threaded", "proxy_asyncio")
+DEFAULT_DURATION = 10.0  # Seconds of measured load per run
+DEFAULT_WARMUP = 1.0  # Seconds of unmeasured load before each run
+DEFAULT_CONCURRENCY = "16"  # Comma-separated connection counts
+DEFAULT_KEEPALIVE = "1.0"  # Comma-separated chances a connection is reused
+STARTUP_TIMEOUT = 10  # Seconds a server may take to accept connections
+REQUEST_TIMEOUT = 10  # Seconds before a request counts as an error
+PERCENTILES = (("p50", 0.50), ("p99", 0.99), ("p999", 0.999))
+DEFAULT_OUTPUT = "bench_results.json"
+
+def free_port():
+    """Return a TCP port that is free right now."""
+    with socket.socket() as sock:
+        sock.bind((BENCH_HOST, 0))
+        return sock.getsockname()[1]
+
+def target_plan(name):
+    """Return (processes, measured, request_target, port) for a benchmark target.
+
+    ``processes`` is a list of (label, argv, port) to start in order and
+    ``measured`` the label of the one whose memory is reported.
+    """
+    python = sys.executable
+    port = free_port()
+    if name in ("coin_threaded", "coin_asyncio"):
+        engine = "socketserver" if name == "coin_threaded" else "asyncio"
+        argv = [python, "coin_server.py", "--host", BENCH_HOST, "--port", str(port),
+                "--engine", engine]
+        return [(name, argv, port)], name, "/", port
+    if name == "test_server":
+        argv = [python, "test_server.py", "--host", BENCH_HOST, "--port", str(port)]
+        return [(name, argv, port)], name, "/", port
+
+    # Proxy targets relay to a coin_server of their own
+    engine = "threaded" if name == "proxy_threaded" else "asyncio"
+    backend = free_port()
+    authority = f"{BENCH_HOST}:{backend}"
+    server_argv = [python, "coin_server.py", "--host", BENCH_HOST, "--port", str(backend),
+                   "--engine", "asyncio"]
+    proxy_argv = [python, "torcoin_proxy.py", "--host", BENCH_HOST, "--port", str(port),
+                  "--engine", engine, "--backend", authority, "--allow", authority,
+                  "--health-interval", "0"]
+    return ([("backend", server_argv, backend), (name, proxy_argv, port)],
+            name, f"http://{authority}/", port)
+
+def wait_for_port(process, port, timeout=STARTUP_TIMEOUT):
+    """Block until ``port`` accepts connections; False if the process died first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            socket.create_connection((BENCH_HOST, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def rss_kb(pid):
+    """Return (current, peak) resident memory of ``pid`` in KiB, or Nones."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError, ValueError):
+        pass
+    if psutil is not None:
+        try:
+            rss = psutil.Process(pid).memory_info().rss // 1024
+            return rss, None
+        except psutil.Error:
+            pass
+    return None, None
+
+async def read_response(reader, method):
+    """Read one response; return (status, server_keeps_connection_open)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    version, status = lines[0].split(None, 2)[:2]
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name:
+            headers[name.strip().lower()] = value.strip().lower()
+    status = int(status)
+    keep_open = headers.get("connection") != "close" and \
+        (version == "HTTP/1.1" or headers.get("connection") == "keep-alive")
+
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        return status, keep_open
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        await reader.read()  # Body ends when the server closes
+        keep_open = False
+    return status, keep_open
+
+async def client(port, request_target, keepalive, warmup_until, deadline, stats):
+    """Send requests until ``deadline``, reusing the connection at random."""
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        keep = random.random() < keepalive
+        request = (f"GET {request_target} HTTP/1.1\r\nHost: {BENCH_HOST}\r\n"
+                   f"Accept-Encoding: gzip\r\n"
+                   f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n").encode("latin-1")
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(BENCH_HOST, port), REQUEST_TIMEOUT)
+            writer.write(request)
+            status, keep_open = await asyncio.wait_for(read_response(reader, "GET"),
+                                                       REQUEST_TIMEOUT)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            if started >= warmup_until:
+                stats["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.001)  # Don't spin on a refusing server
+            continue
+
+        finished = time.perf_counter()
+        if started >= warmup_until:
+            stats["latencies"].append(finished - started)
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+        if not (keep and keep_open):
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+def run_load(port, request_target, concurrency, keepalive, warmup, duration):
+    """Drive one server from this process; return the raw measurements."""
+    if uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    stats = {"latencies": [], "statuses": {}, "errors": 0}
+
+    async def main():
+        now = time.perf_counter()
+        await asyncio.gather(*(client(port, request_target, keepalive, now + warmup,
+                                      now + warmup + duration, stats)
+                               for _ in range(concurrency)))
+    asyncio.run(main())
+    return stats
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(fraction * len(ordered) + 0.5) - 1))]
+
+def summarise(results, duration):
+    """Merge per-process measurements into the reported figures."""
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    statuses = {}
+    for result in results:
+        for status, count in result["statuses"].items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    summary = {
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "statuses": statuses,
+        "rps": round(len(latencies) / duration, 1),
+        "latency_ms": {name: None if percentile(latencies, fraction) is None
+                       else round(percentile(latencies, fraction) * 1000, 3)
+                       for name, fraction in PERCENTILES},
+    }
+    summary["latency_ms"]["max"] = round(latencies[-1] * 1000, 3) if latencies else None
+    return summary
+
+def benchmark(name, concurrencies, keepalives, args):
+    """Start a target, run every load level against it and stop it."""
+    processes, measured, request_target, port = target_plan(name)
+    started = {}
+    logs = []
+    runs = []
+    try:
+        for label, argv, listen_port in processes:
+            log = tempfile.TemporaryFile()
+            logs.append(log)
+            process = subprocess.Popen(argv, cwd=REPO_DIR, stdout=log,
+                                       stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+            started[label] = process
+            if not wait_for_port(process, listen_port):
+                log.seek(0)
+                output = log.read().decode("utf-8", "replace").strip().splitlines()[-5:]
+                raise RuntimeError(f"{label} did not start: " + " | ".join(output))
+
+        for concurrency in concurrencies:
+            for keepalive in keepalives:
+                # Split the connections across client processes
+                shares = [concurrency // args.client_processes +
+                          (index < concurrency % args.client_processes)
+                          for index in range(args.client_processes)]
+                shares = [share for share in shares if share]
+                with concurrent.futures.ProcessPoolExecutor(len(shares)) as pool:
+                    futures = [pool.submit(run_load, port, request_target, share, keepalive,
+                                           args.warmup, args.duration) for share in shares]
+                    results = [future.result() for future in futures]
+
+                run = {"target": name, "concurrency": concurrency, "keepalive": keepalive}
+                run.update(summarise(results, args.duration))
+                rss, peak = rss_kb(started[measured].pid)
+                run["rss_kb"], run["peak_rss_kb"] = rss, peak
+                runs.append(run)
+                print_run(run)
+    finally:
+        for process in reversed(list(started.values())):
+            process.terminate()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        for log in logs:
+            log.close()
+    return runs
+
+def print_run(run):
+    latency = run["latency_ms"]
+    rss = f"{run['rss_kb'] / 1024:.1f} MiB" if run["rss_kb"] else "n/a"
+    print(f"{run['target']:<15} c={run['concurrency']:<5} ka={run['keepalive']:<4} "
+          f"{run['rps']:>10.1f} req/s  p50={latency['p50']}ms p99={latency['p99']}ms "
+          f"p999={latency['p999']}ms  errors={run['errors']}  rss={rss}")
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(runs, baseline_path):
+    """Print the change of each run against a previously saved result file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(run["target"], run["concurrency"], run["keepalive"]): run
+                for run in baseline.get("runs", [])}
+    print()
+    print(f"Compared with {baseline_path} ({baseline.get('revision') or 'unknown revision'}):")
+    for run in runs:
+        old = previous.get((run["target"], run["concurrency"], run["keepalive"]))
+        if old is None or not old["rps"]:
+            continue
+        rps_change = (run["rps"] - old["rps"]) / old["rps"] * 100
+        old_p99, new_p99 = old["latency_ms"]["p99"], run["latency_ms"]["p99"]
+        p99_change = f"{(new_p99 - old_p99) / old_p99 * 100:+.1f}%" \
+            if old_p99 and new_p99 is not None else "n/a"
+        print(f"{run['target']:<15} c={run['concurrency']:<5} ka={run['keepalive']:<4} "
+              f"req/s {rps_change:+.1f}%  p99 {p99_change}")
+
+def number_list(kind):
+    def parse(text):
+        try:
+            return [kind(part) for part in text.split(",") if part.strip()]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected a comma-separated list, got {text!r}")
+    return parse
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="TorCOIN HTTP Benchmark")
+    parser.add_argument("--targets", type=lambda text: text.split(","), default=list(TARGETS),
+                        help=f"comma-separated targets (default: {','.join(TARGETS)})")
+    parser.add_argument("--concurrency", type=number_list(int),
+                        default=number_list(int)(DEFAULT_CONCURRENCY),
+                        help="comma-separated open connections (default: %s)" % DEFAULT_CONCURRENCY)
+    parser.add_argument("--keepalive", type=number_list(float),
+                        default=number_list(float)(DEFAULT_KEEPALIVE),
+                        help="comma-separated chances, 0-1, that a connection is reused "
+                             "for the next request (default: %s)" % DEFAULT_KEEPALIVE)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION,
+                        help="measured seconds per run (default: %(default)s)")
+    parser.add_argument("--warmup", type=float, default=DEFAULT_WARMUP,
+                        help="unmeasured seconds before each run (default: %(default)s)")
+    parser.add_argument("--client-processes", type=int, default=1,
+                        help="load generator processes, so the client is not the "
+                             "bottleneck (default: %(default)s)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="JSON file the results are written to (default: %(default)s)")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="earlier result file to compare against")
+    args = parser.parse_args()
+    unknown = [target for target in args.targets if target not in TARGETS]
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(unknown)}")
+    if args.client_processes < 1:
+        parser.error("--client-processes must be at least 1")
+    return args
+
+def main():
+    """Run the benchmark matrix and save the results."""
+    args = parse_args()
+    print("=" * 60)
+    print("         TORCOIN HTTP BENCHMARK")
+    print("=" * 60)
+    print(f"Targets: {', '.join(args.targets)}")
+    print(f"Concurrency: {args.concurrency}  Keep-alive: {args.keepalive}")
+    print(f"{args.duration}s per run after {args.warmup}s warm-up, "
+          f"{args.client_processes} client process(es)")
+    print("=" * 60)
+
+    runs = []
+    try:
+        for target in args.targets:
+            try:
+                runs += benchmark(target, args.concurrency, args.keepalive, args)
+            except RuntimeError as e:
+                print(f"[!] {e}")
+    except KeyboardInterrupt:
+        print("\n[!] Benchmark interrupted, saving completed runs")
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "client_processes": args.client_processes,
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[+] Results saved to {args.output}")
+
+    if args.compare:
+        compare(runs, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -4,79 +4,1104 @@ TorCOIN Web Server
 Serves the 3D animated coin HTML page at the specified IP address.
 """
 
+import argparse
+import asyncio
+import email.utils
+import errno
+import functools
+import gzip
+import hashlib
 import http.server
 import socketserver
 import os
+import queue
+import select
+import signal
+import socket
+import ssl
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import weakref
+from datetime import timezone
 from urllib.parse import unquote
 
+from torcoin_logging import ACCESS_LOG, add_logging_arguments, configure_logging
+from torcoin_metrics import METRICS, add_metrics_arguments, start_metrics_server
+
+try:
+    import uvloop  # Optional faster event loop for the asyncio engine
+except ImportError:
+    uvloop = None
+
+try:
+    import brotli  # Optional brotli variants of the cached page
+except ImportError:
+    brotli = None
+
 # Configuration
 HOST_IP = "0.0.0.0"  # Bind to all available interfaces
 PORT = 50129  # Custom port
 DISPLAY_URL = "https://www.torcoin.cnet"  # Ultra hardcoded display URL
 HTML_FILE = "torcoin_website.html"
+STAT_INTERVAL = 1.0  # Seconds between freshness checks of the cached page
+
+# Concurrency configuration
+SERVER_MODES = ("single", "threaded", "prefork")
+DEFAULT_MODE = "threaded"
+DEFAULT_THREADS = 32  # Worker threads per process
+DEFAULT_WORKERS = os.cpu_count() or 1  # Processes in prefork mode
+QUEUE_TIMEOUT = 1.0  # Seconds a new connection may wait for a queue slot
+OVERLOAD_RESPONSE = (b"HTTP/1.0 503 Service Unavailable\r\n"
+                     b"Retry-After: 1\r\nContent-Length: 0\r\n\r\n")
+SERVER_ENGINES = ("socketserver", "asyncio")
+DEFAULT_ENGINE = "socketserver"
+KEEPALIVE_TIMEOUT = 15  # Seconds an idle keep-alive connection is kept open
+SYNC_KEEPALIVE_TIMEOUT = 5  # Shorter for socketserver, where idle clients hold a thread
+MAX_HEADERS = 100  # Maximum header lines accepted per request
+MAX_REQUEST_BODY = 64 * 1024  # Largest request body the asyncio engine will discard
+ENCODING_PREFERENCE = ("br", "gzip")  # Preferred when the client accepts several
+METRICS_PORT = 9129  # Localhost port of /metrics; prefork workers use the following ones
+RELOAD_SIGNAL = getattr(signal, "SIGHUP", None)  # Graceful reload (not on Windows)
+LISTEN_FD_ENV = "TORCOIN_LISTEN_FD"  # Listening socket handed to a reloaded process
+READY_FD_ENV = "TORCOIN_READY_FD"  # Pipe a reloaded process reports readiness on
+RELOAD_TIMEOUT = 30.0  # Seconds a new process may take to warm up before the reload is abandoned
+DRAIN_TIMEOUT = 30.0  # Seconds the old process waits for in-flight requests
+DRAINING = threading.Event()  # Set once a replacement process has taken over the socket
+URL_SCHEME = "http"  # "https" when serving TLS
+ALPN_PROTOCOLS = ["http/1.1"]  # The only protocol spoken after the handshake
+TLS_SESSION_TICKETS = 2  # TLS 1.3 resumption tickets issued per full handshake
+TLS_HANDSHAKE_TIMEOUT = 10.0  # Seconds a client may take to complete the handshake
+TLS_CHECK_INTERVAL = 60.0  # Seconds between checks for a renewed certificate
+
+class PageVariant:
+    """One content-coding of a cached page with ready-made response headers.
+
+    The strong ETag and Last-Modified validators are computed once here, so
+    conditional requests are answered without rehashing the body. The body
+    is also snapshotted into an anonymous temporary file so it can be sent
+    with sendfile() and stays consistent with the headers even if the source
+    file changes mid-response.
+    """
+
+    def __init__(self, body, etag, mtime, encoding=None):
+        self.body = body
+        self.etag = etag
+        self.mtime = mtime
+        self.file = self._snapshot(body)
+        # Headers shared by 200 and 304 responses
+        self.validator_headers = [
+            ('ETag', etag),
+            ('Last-Modified', email.utils.formatdate(mtime, usegmt=True)),
+            # Browsers revalidate every time; shared caches such as the
+            # proxy may reuse the page for as long as we throttle stat()
+            ('Cache-Control', f'max-age=0, s-maxage={max(1, int(STAT_INTERVAL))}'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        self.headers = [
+            ('Content-type', 'text/html; charset=utf-8'),
+            ('Content-length', str(len(body))),
+        ]
+        if encoding:
+            self.headers.append(('Content-Encoding', encoding))
+        self.headers += self.validator_headers
+
+    def _snapshot(self, body):
+        """Write the body to an unlinked temp file, or return None if that fails."""
+        try:
+            snapshot = tempfile.TemporaryFile()
+            snapshot.write(body)
+            snapshot.flush()
+        except OSError:
+            return None
+        weakref.finalize(self, snapshot.close)
+        return snapshot
+
+    def is_not_modified(self, if_none_match, if_modified_since):
+        """Return True if a conditional GET can be answered with 304.
+
+        If-None-Match takes precedence over If-Modified-Since (RFC 9110).
+        """
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            # If-None-Match uses the weak comparison function
+            return any(tag == "*" or tag.replace("W/", "", 1) == self.etag for tag in tags)
+
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.mtime <= since.timestamp()
+
+        return False
+
+class CachedPage:
+    """One version of a page, precompressed into every supported coding.
+
+    Compression happens once per file version, never on the request path.
+    """
+
+    def __init__(self, body, mtime):
+        mtime = int(mtime)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {"identity": PageVariant(body, f'"{digest}"', mtime)}
+
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli:
+            compressed["br"] = brotli.compress(body, quality=11)
+
+        for encoding, data in compressed.items():
+            # Each representation needs its own strong ETag
+            if len(data) < len(body):
+                self.variants[encoding] = PageVariant(
+                    data, f'"{digest}-{encoding}"', mtime, encoding)
+
+    def select(self, accept_encoding):
+        """Return the variant best matching Accept-Encoding, or None (406)."""
+        encoding = choose_encoding(accept_encoding, tuple(self.variants))
+        return self.variants[encoding] if encoding else None
+
+@functools.lru_cache(maxsize=256)
+def choose_encoding(accept_encoding, available):
+    """Pick a content-coding from Accept-Encoding, honouring q-values.
+
+    Returns None when the client explicitly refuses every available coding.
+    """
+    if not accept_encoding:
+        return "identity"
+
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+                # Clamp to [0, 1]; NaN counts as "not acceptable"
+                weight = min(max(weight, 0.0), 1.0) if weight == weight else 0.0
+        weights[coding] = weight
+
+    default = weights.get("*", 0.0)
+    best, best_weight = None, 0.0
+    for encoding in ENCODING_PREFERENCE:
+        weight = weights.get(encoding, default)
+        if encoding in available and weight > best_weight:
+            best, best_weight = encoding, weight
+
+    identity_weight = weights.get("identity", weights.get("*"))
+    if identity_weight is None:
+        # Unlisted identity is acceptable, but ranks below any listed coding
+        return best or "identity"
+    if identity_weight > 0 and identity_weight > best_weight:
+        return "identity"
+    return best
+
+class PageCache:
+    """Process-wide cache of a pre-encoded page.
+
+    The file is stat'ed at most once every ``stat_interval`` seconds and only
+    re-read when its mtime or size changes, so steady-state requests are
+    served straight from memory without touching the disk.
+    """
+
+    def __init__(self, path, stat_interval=STAT_INTERVAL):
+        self.path = path
+        self.stat_interval = stat_interval
+        self._lock = threading.Lock()
+        self._page = None
+        self._signature = None
+        self._next_check = 0.0
+
+    def is_stale(self):
+        """Return True if the next get() will stat (and maybe reload) the file."""
+        return time.monotonic() >= self._next_check
+
+    def get(self):
+        """Return the current CachedPage, or None if the file is missing."""
+        if time.monotonic() < self._next_check:
+            return self._page
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if time.monotonic() >= self._next_check:
+                self._refresh()
+                self._next_check = time.monotonic() + self.stat_interval
+            return self._page
+
+    def _refresh(self):
+        """Reload the page if the file changed since the last check."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._page = None
+            self._signature = None
+            return
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        with open(self.path, 'rb') as f:
+            body = f.read()
+
+        self._page = CachedPage(body, stat.st_mtime)
+        self._signature = signature
+
+PAGE_CACHE = PageCache(HTML_FILE)
+
+class TLSContext:
+    """Server SSLContext for --tls-cert/--tls-key that follows certificate renewals.
+
+    The files are stat'ed at most once every ``check_interval`` seconds. A
+    renewed chain is loaded into the same SSLContext, so its session ticket
+    keys and session cache survive and returning clients still resume
+    instead of doing a full handshake. A chain that fails to load (e.g. the
+    key is not written yet) is ignored until the next check.
+    """
+
+    def __init__(self, certfile, keyfile, check_interval=TLS_CHECK_INTERVAL):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.check_interval = check_interval
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.context.set_alpn_protocols(ALPN_PROTOCOLS)
+        self.context.num_tickets = TLS_SESSION_TICKETS
+        self._lock = threading.Lock()
+        self._signature = self._stat()
+        self.context.load_cert_chain(certfile, keyfile)
+        self._next_check = time.monotonic() + check_interval
+
+    def _stat(self):
+        paths = (self.certfile,) if self.keyfile is None else (self.certfile, self.keyfile)
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, paths))
+
+    def refresh(self):
+        """Load the certificate chain again if its files changed."""
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                signature = self._stat()
+                if signature == self._signature:
+                    return
+                # Check the pair on a scratch context: a failed load would leave
+                # the live one with a certificate that does not match its key
+                ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).load_cert_chain(self.certfile,
+                                                                       self.keyfile)
+                self.context.load_cert_chain(self.certfile, self.keyfile)
+                self._signature = signature
+            except (OSError, ssl.SSLError) as e:
+                ACCESS_LOG.message("error", "TLS certificate reload failed: %s", e)
+                return
+        ACCESS_LOG.message("info", "TLS certificate reloaded from %s", self.certfile)
+
+    def wrap(self, sock):
+        """Return ``sock`` wrapped for a server-side handshake that has not run yet."""
+        self.refresh()
+        with self._lock:  # Never create a connection halfway through a reload
+            return self.context.wrap_socket(sock, server_side=True,
+                                            do_handshake_on_connect=False)
+
+TLS = None  # TLSContext when serving HTTPS
+
+# errno values meaning "sendfile() can't be used here", not "the send failed"
+SENDFILE_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+                        getattr(errno, "EOPNOTSUPP", errno.EINVAL)}
+
+def send_variant_body(sock, variant):
+    """Send a variant's body on a blocking socket, zero-copy where possible.
+
+    The body is streamed from the variant's snapshot file with os.sendfile()
+    using explicit offsets, so one descriptor is safely shared by all
+    threads. Falls back to sendall() on platforms without sendfile, for
+    socket wrappers (such as TLS) and when the kernel refuses the call.
+    """
+    count = len(variant.body)
+    offset = 0
+    if (variant.file is not None and hasattr(os, "sendfile")
+            and type(sock) is socket.socket):
+        try:
+            while offset < count:
+                try:
+                    sent = os.sendfile(sock.fileno(), variant.file.fileno(),
+                                       offset, count - offset)
+                except BlockingIOError:
+                    # Sockets with a timeout are non-blocking underneath
+                    if not select.select([], [sock], [], sock.gettimeout())[1]:
+                        raise socket.timeout("timed out sending response")
+                    continue
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if offset or e.errno not in SENDFILE_UNSUPPORTED:
+                raise
+
+    if offset < count:
+        sock.sendall(memoryview(variant.body)[offset:])
+
+async def send_variant_body_async(writer, variant):
+    """Asyncio counterpart of send_variant_body()."""
+    # Only plain socket transports can sendfile(); TLS and in-memory ones get a write
+    if (variant.file is not None and writer.get_extra_info("socket") is not None
+            and writer.get_extra_info("sslcontext") is None):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.sendfile(writer.transport, variant.file, 0,
+                                len(variant.body), fallback=False)
+            return
+        except (asyncio.SendfileNotAvailableError, NotImplementedError):
+            pass
+    writer.write(variant.body)
+PAGE_PATHS = frozenset(("/", "", "/torcoin.html", f"/{HTML_FILE}"))
+
+REQUESTS = METRICS.counter("torcoin_http_requests_total",
+                           "Requests answered, by route and status", ("route", "status"))
+RESPONSE_BYTES = METRICS.counter("torcoin_http_response_bytes_total",
+                                 "Response body bytes sent, by route", ("route",))
+REQUEST_DURATION = METRICS.histogram("torcoin_http_request_duration_seconds",
+                                     "Time from request line to response sent", ("route",))
+TLS_HANDSHAKES = METRICS.counter("torcoin_tls_handshakes_total",
+                                 "TLS handshakes, by result (full, resumed, failed)",
+                                 ("result",))
+SERVERS = weakref.WeakSet()  # Live PooledTCPServers, for the worker pool gauges
+METRICS.gauge("torcoin_http_busy_workers", "Worker threads serving a connection",
+              lambda: sum(sum(server._busy) for server in list(SERVERS)))
+METRICS.gauge("torcoin_http_queued_connections", "Accepted connections waiting for a worker",
+              lambda: sum(server._requests.qsize() for server in list(SERVERS)))
+
+def record_request(path, status, body_bytes, duration):
+    """Count one answered request in the request metrics."""
+    route = "/" if unquote(path) in PAGE_PATHS else "other"
+    REQUESTS.inc(route, status)
+    RESPONSE_BYTES.inc(route, amount=body_bytes)
+    REQUEST_DURATION.observe(duration, route)
 
 class CoinHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Custom HTTP request handler for serving the coin page."""
 
+    # Keep connections open between requests (e.g. for torcoin_proxy's pool)
+    protocol_version = "HTTP/1.1"
+    timeout = SYNC_KEEPALIVE_TIMEOUT
+    # The head and the sendfile() body are separate writes; without
+    # TCP_NODELAY the body waits on the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    status_code = None
+
+    def handle_one_request(self):
+        """Handle one request, then record it once the response has been sent."""
+        self.status_code = None
+        super().handle_one_request()
+        if METRICS.enabled and self.status_code is not None:
+            record_request(getattr(self, 'path', ""), self.status_code, self.body_bytes,
+                           time.perf_counter() - self.started)
+
+    def parse_request(self):
+        self.started = time.perf_counter()
+        self.body_bytes = 0
+        return super().parse_request()
+
+    def send_header(self, keyword, value):
+        """Send a header, noting the body size for the response metrics."""
+        if keyword.lower() == 'content-length' and self.command != 'HEAD':
+            self.body_bytes = int(value)
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if DRAINING.is_set():
+            # A reload is in progress: the new process serves the next request
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
     def do_GET(self):
         """Handle GET requests."""
         # Decode the path to handle special characters
         path = unquote(self.path)
 
-        # Serve the coin page for root requests
-        if path == "/" or path == "":
-            self.serve_coin_page()
-        elif path == "/torcoin.html" or path == f"/{HTML_FILE}":
+        # Serve the coin page for root and page requests
+        if path in PAGE_PATHS:
             self.serve_coin_page()
         else:
             # For any other requests, redirect to the main page
             self.send_response(302)
-            self.send_header('Location', f'http://{HOST_IP}:{PORT}/')
+            self.send_header('Location', f'{URL_SCHEME}://{HOST_IP}:{PORT}/')
+            self.send_header('Content-Length', '0')
             self.end_headers()
 
     def serve_coin_page(self):
         """Serve the TorCOIN HTML page."""
         try:
-            # Check if the HTML file exists
-            if not os.path.exists(HTML_FILE):
+            # Fetch the pre-encoded page (re-read only when the file changes)
+            page = PAGE_CACHE.get()
+            if page is None:
                 self.send_error(404, "Coin file not found")
                 return
 
-            # Read the HTML file
-            with open(HTML_FILE, 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Pick the precompressed variant the client accepts
+            variant = page.select(self.headers.get('Accept-Encoding'))
+            if variant is None:
+                self.send_error(406, "No acceptable content-coding")
+                return
+
+            # Answer revalidations from the cached validators
+            if variant.is_not_modified(self.headers.get('If-None-Match'),
+                                       self.headers.get('If-Modified-Since')):
+                self.send_response(304)
+                for header, value in variant.validator_headers:
+                    self.send_header(header, value)
+                self.end_headers()
+                return
 
             # Send the response
             self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.send_header('Content-length', len(content.encode('utf-8')))
-            self.send_header('Cache-Control', 'no-cache')
+            for header, value in variant.headers:
+                self.send_header(header, value)
             self.end_headers()
 
-            # Write the content
-            self.wfile.write(content.encode('utf-8'))
+            # Stream the content straight from the snapshot file
+            send_variant_body(self.connection, variant)
 
         except Exception as e:
             self.send_error(500, f"Server error: {str(e)}")
 
+    def log_request(self, code='-', size='-'):
+        """Queue a structured access record (sampled for successes)."""
+        self.status_code = int(code) if isinstance(code, int) else None
+        ACCESS_LOG.access(int(code) if isinstance(code, int) else 0,
+                          remote=self.client_address[0], method=self.command, path=self.path)
+
+    def log_error(self, format, *args):
+        ACCESS_LOG.message("error", format, *args, remote=self.client_address[0])
+
     def log_message(self, format, *args):
-        """Override logging to show custom messages."""
-        # Only log important messages, suppress directory listings
-        if "GET /" in format and "200" in format:
-            print(f"[+] Served coin page to {self.address_string()}")
-        elif "404" in format:
-            print(f"[!] File not found: {self.path}")
-        elif "500" in format:
-            print(f"[!] Server error: {self.path}")
+        ACCESS_LOG.message("info", format, *args, remote=self.client_address[0])
+
+class SingleTCPServer(socketserver.TCPServer):
+    """TCPServer that serves one connection at a time on the main thread."""
+
+    # Connections closed by the server leave the port in TIME_WAIT; without
+    # this a restarted server cannot bind it for a minute
+    allow_reuse_address = True
+
+    def finish_request(self, request, client_address):
+        """Serve one connection, doing the TLS handshake first when serving HTTPS.
+
+        This runs on the thread that serves the connection (a pool worker
+        in threaded mode), so slow handshakes never hold up accept().
+        """
+        if TLS is None:
+            super().finish_request(request, client_address)
+            return
+
+        request = TLS.wrap(request)  # Takes over the descriptor of the raw socket
+        try:
+            try:
+                request.settimeout(TLS_HANDSHAKE_TIMEOUT)
+                request.do_handshake()
+            except (ssl.SSLError, OSError):
+                TLS_HANDSHAKES.inc("failed")
+                return
+            TLS_HANDSHAKES.inc("resumed" if request.session_reused else "full")
+            super().finish_request(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+class PooledTCPServer(SingleTCPServer):
+    """TCPServer that hands connections to a bounded pool of worker threads.
+
+    Accepted connections wait in a bounded queue; once it is full the accept
+    loop blocks and further clients queue up in the kernel backlog instead of
+    spawning unbounded threads.
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS,
+                 reuse_port=False, bind_and_activate=True):
+        self.threads = threads
+        self.reuse_port = reuse_port
+        self._requests = queue.Queue(maxsize=threads * 4)
+        self._stopping = threading.Event()
+        self._workers = []
+        self._busy = [False] * threads  # Written only by the worker owning the slot
+        super().__init__(server_address, handler_class, bind_and_activate)
+        SERVERS.add(self)
+
+    def server_bind(self):
+        """Bind the socket, sharing the port with sibling processes if asked."""
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def serve_forever(self, poll_interval=0.5):
+        """Start the worker threads, then run the accept loop."""
+        # Started here rather than in __init__ so pre-forked children that
+        # inherit an already bound server get threads of their own.
+        for index in range(len(self._workers), self.threads):
+            worker = threading.Thread(target=self._work, args=(index,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for the next free worker, or shed it."""
+        try:
+            self._requests.put((request, client_address), timeout=QUEUE_TIMEOUT)
+        except queue.Full:
+            # Every worker is busy and the queue is full: answer fast
+            try:
+                request.sendall(OVERLOAD_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self, index):
+        """Worker loop: serve queued connections until the server closes."""
+        while not self._stopping.is_set():
+            try:
+                request, client_address = self._requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            self._busy[index] = True
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self._busy[index] = False
+                self.shutdown_request(request)
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Wait until queued and in-flight connections are finished.
+
+        Called after the accept loop has stopped; returns False if some were
+        still open after ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while not self._requests.empty() or any(self._busy):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def server_close(self):
+        """Close the socket, stop the workers and drop queued connections."""
+        super().server_close()
+        self._stopping.set()
+        self._workers = []
+        while True:
+            try:
+                request, _ = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            self.shutdown_request(request)
+
+def create_server(mode, threads=DEFAULT_THREADS, reuse_port=False, listen_socket=None):
+    """Create the listening server for the selected concurrency mode.
+
+    ``listen_socket`` is an already listening socket (see inherited_socket())
+    to serve instead of binding a new one.
+    """
+    if mode == "single":
+        httpd = SingleTCPServer((HOST_IP, PORT), CoinHTTPRequestHandler,
+                                bind_and_activate=listen_socket is None)
+    else:
+        httpd = PooledTCPServer((HOST_IP, PORT), CoinHTTPRequestHandler, threads=threads,
+                                reuse_port=reuse_port, bind_and_activate=listen_socket is None)
+    if listen_socket is not None:
+        httpd.socket.close()
+        httpd.socket = listen_socket
+        httpd.server_address = listen_socket.getsockname()
+    return httpd
+
+def inherited_socket():
+    """Return the listening socket handed over by a reloading process, if any."""
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    return socket.socket(fileno=int(fd)) if fd else None
+
+def notify_ready():
+    """Tell the process that started this one for a reload that it is serving."""
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd:
+        try:
+            os.write(int(fd), b"1")
+            os.close(int(fd))
+        except OSError:
+            pass  # The old process gave up waiting
+
+def spawn_replacement(listen_socket=None):
+    """Start a new server process with the same arguments and wait until it is ready.
+
+    ``listen_socket`` is passed down as an inherited file descriptor, so the
+    port is never closed and queued connections are not refused; without it
+    the new process binds its own socket (prefork with SO_REUSEPORT). The new
+    process warms its page cache before it reports ready on a pipe. Returns
+    False, after stopping it, if it fails to do so within RELOAD_TIMEOUT.
+    """
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ, **{READY_FD_ENV: str(write_fd)})
+    fds = [write_fd]
+    if listen_socket is not None:
+        env[LISTEN_FD_ENV] = str(listen_socket.fileno())
+        fds.append(listen_socket.fileno())
+    try:
+        process = subprocess.Popen([sys.executable, *sys.argv], env=env, pass_fds=fds)
+    finally:
+        os.close(write_fd)
+    try:
+        ready, _, _ = select.select([read_fd], [], [], RELOAD_TIMEOUT)
+        # EOF instead of b"1" means the new process exited
+        started = bool(ready) and os.read(read_fd, 1) == b"1"
+    finally:
+        os.close(read_fd)
+    if not started:
+        process.kill()
+        process.wait()
+    return started
+
+def install_reload_handler(listen_socket, stop):
+    """On RELOAD_SIGNAL, hand the port to a new process, then call ``stop``.
+
+    ``stop`` must make the current accept loop return; the caller then drains
+    its open connections and exits. If the new process fails to start this
+    one keeps serving, so a broken deploy never takes the server down.
+    """
+    reloading = threading.Lock()
+
+    def reload():
+        if not reloading.acquire(blocking=False):
+            return  # A reload is already in progress
+        print("[+] Reload requested, starting a new server process")
+        try:
+            started = spawn_replacement(listen_socket)
+        except OSError as e:
+            print(f"[!] Reload failed: {e}")
+            started = False
+        if not started:
+            print("[!] New server process did not start, still serving")
+            reloading.release()
+            return
+        print(f"[+] New server process is serving, draining {os.getpid()}")
+        DRAINING.set()
+        stop()
+
+    # The handler only starts a thread: spawning and waiting must not block
+    # the accept loop running on the main thread
+    signal.signal(RELOAD_SIGNAL, lambda signum, frame: threading.Thread(
+        target=reload, name="reload", daemon=True).start())
+
+def stop_accepting(httpd):
+    """Make ``httpd.serve_forever()`` return so its connections can be drained.
+
+    Safe to call from the serving thread's signal handler.
+    """
+    DRAINING.set()
+    threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+def serve_prefork(workers, threads, reuse_port=False, metrics_port=None, listen_socket=None):
+    """Run ``workers`` processes that share the listening port.
+
+    By default the port is bound once here (or taken over from
+    ``listen_socket``), exclusively, and the children inherit the socket. With
+    ``reuse_port`` each child binds its own socket with SO_REUSEPORT so the
+    kernel spreads connections across them; the port is still checked with an
+    exclusive bind first. Metrics are per process, so worker N serves them on
+    ``metrics_port + N``. On a reload the workers drain and exit once the new
+    process is serving.
+    """
+    if reuse_port:
+        # Fails with "Address already in use" if anything holds the port;
+        # skipped on a reload, where the old workers still do
+        if READY_FD_ENV not in os.environ:
+            create_server("single").server_close()
+        shared = None
+    else:
+        shared = create_server("threaded", threads, listen_socket=listen_socket)
+
+    children = {}  # pid -> worker slot
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid:
+            children[pid] = slot
+            return
+
+        httpd = None
+
+        def drain(signum, frame):
+            DRAINING.set()
+            if httpd is not None:
+                stop_accepting(httpd)
+
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if RELOAD_SIGNAL:
+            signal.signal(RELOAD_SIGNAL, drain)
+        code = 0
+        try:
+            if metrics_port is not None:
+                start_metrics_server(metrics_port + slot)
+            httpd = shared or create_server("threaded", threads, reuse_port=True)
+            with httpd:
+                if not DRAINING.is_set():
+                    httpd.serve_forever()
+                if DRAINING.is_set():
+                    httpd.drain()
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print(f"[!] Worker {os.getpid()} failed to start: {e}")
+            code = 1
+        except Exception as e:
+            print(f"[!] Worker {os.getpid()} crashed: {e}")
+            code = 2
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        raise KeyboardInterrupt if signum == signal.SIGINT else SystemExit(0)
+
+    def hand_over():
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, RELOAD_SIGNAL)
+            except ProcessLookupError:
+                pass
+
+    # Stopping the parent must also stop its workers
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    if RELOAD_SIGNAL:
+        install_reload_handler(shared.socket if shared else None, hand_over)
+
+    for slot in range(workers):
+        spawn(slot)
+    notify_ready()
+
+    print(f"[+] Server started successfully on {HOST_IP}:{PORT}")
+    print(f"[+] Pre-forked {workers} workers x {threads} threads")
+    if metrics_port is not None:
+        print(f"[+] Worker metrics on 127.0.0.1:{metrics_port}-{metrics_port + workers - 1}")
+    if RELOAD_SIGNAL:
+        print(f"[+] kill -HUP {os.getpid()} reloads without dropping connections")
+    print("[+] Ready to serve your 3D coin!")
+    print()
+
+    try:
+        while children:
+            pid, status = os.wait()
+            slot = children.pop(pid, None)
+            code = os.waitstatus_to_exitcode(status)
+            if code == 1:
+                raise OSError(f"Worker {pid} could not bind to port {PORT}")
+
+            # A clean exit means the worker was told to stop (e.g. Ctrl+C)
+            if stopping or code == 0:
+                continue
+
+            # Replace workers that died unexpectedly
+            print(f"[!] Worker {pid} exited, starting a replacement")
+            spawn(slot)
+    finally:
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        if shared:
+            shared.server_close()
+
+async def read_request_head(reader):
+    """Read one request line and its headers from an asyncio stream.
+
+    Returns (method, target, version, headers) with lower-cased header names,
+    or None if the client closed the connection between requests.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError(f"Bad request line: {request_line!r}")
+    method, target, version = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n"):
+            break
+        if not line:
+            raise asyncio.IncompleteReadError(line, None)
+        if len(headers) >= MAX_HEADERS:
+            raise ValueError("Too many headers")
+
+        name, _, value = line.decode('latin-1').partition(":")
+        name = name.strip().lower()
+        # Repeated framing headers are a request smuggling vector
+        if name in headers and name in ("content-length", "transfer-encoding"):
+            raise ValueError(f"Duplicate {name} header")
+        headers[name] = value.strip()
+
+    return method, target, version, headers
+
+class RequestError(Exception):
+    """A request the asyncio engine answers with an error and then closes."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def request_body_length(headers):
+    """Validate the request framing and return the body length to discard."""
+    if "transfer-encoding" in headers:
+        raise RequestError(400, "Transfer-Encoding is not supported")
+
+    value = headers.get("content-length", "0")
+    if not (value.isascii() and value.isdigit()):
+        raise RequestError(400, "Bad Content-Length")
+
+    length = int(value)
+    if length > MAX_REQUEST_BODY:
+        raise RequestError(413, "Request body too large")
+    return length
+
+def encode_response_head(status, headers, keep_alive):
+    """Build the status line and header block for an asyncio response."""
+    lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+             f"Date: {email.utils.formatdate(usegmt=True)}",
+             "Server: TorCOIN-Async"]
+    lines.extend(f"{header}: {value}" for header, value in headers)
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+def build_async_response(method, target, headers, page_cache=None, location=None):
+    """Route a request the same way CoinHTTPRequestHandler.do_GET does.
+
+    Returns (status, headers, body), where the body of a page response is
+    its PageVariant so it can be sent with sendfile(). ``page_cache`` and
+    the redirect ``location`` default to this server's own.
+    """
+    if method not in ("GET", "HEAD"):
+        return error_response(501, f"Unsupported method ({method})")
+
+    if unquote(target) not in PAGE_PATHS:
+        location = location or f'{URL_SCHEME}://{HOST_IP}:{PORT}/'
+        return 302, [('Location', location), ('Content-Length', '0')], b""
+
+    try:
+        page = (page_cache or PAGE_CACHE).get()
+    except Exception as e:
+        return error_response(500, f"Server error: {str(e)}")
+    if page is None:
+        return error_response(404, "Coin file not found")
+
+    variant = page.select(headers.get("accept-encoding"))
+    if variant is None:
+        return error_response(406, "No acceptable content-coding")
+    if variant.is_not_modified(headers.get("if-none-match"), headers.get("if-modified-since")):
+        return 304, variant.validator_headers, b""
+
+    return 200, variant.headers, variant
+
+def error_response(status, message):
+    """Build a small HTML error response for the asyncio engine."""
+    body = f"<html><body><h1>{status} {message}</h1></body></html>".encode('utf-8')
+    headers = [('Content-Type', 'text/html; charset=utf-8'),
+               ('Content-Length', str(len(body)))]
+    return status, headers, body
+
+async def handle_async_connection(reader, writer, page_cache=None, location=None):
+    """Serve HTTP/1.1 requests on one connection, honouring keep-alive.
+
+    Pipelined requests are answered in order because each request is read
+    from the stream only after the previous response has been queued.
+    ``page_cache`` and ``location`` are passed on to build_async_response.
+    """
+    loop = asyncio.get_running_loop()
+    page_cache = page_cache or PAGE_CACHE
+    peer = writer.get_extra_info('peername')
+    remote = peer[0] if peer else None
+    ssl_object = writer.get_extra_info('ssl_object')
+    if ssl_object is not None:
+        TLS_HANDSHAKES.inc("resumed" if ssl_object.session_reused else "full")
+    try:
+        while True:
+            head = None
+            try:
+                head = await asyncio.wait_for(read_request_head(reader), KEEPALIVE_TIMEOUT)
+                if head is None:
+                    break
+                started = time.perf_counter()
+
+                method, target, version, headers = head
+                # Discard any request body so the next request starts cleanly
+                length = request_body_length(headers)
+                if length:
+                    await asyncio.wait_for(reader.readexactly(length), KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            except (ValueError, RequestError) as e:
+                status, message = (e.status, e.message) if isinstance(e, RequestError) \
+                    else (400, "Bad request")
+                status, response_headers, body = error_response(status, message)
+                writer.write(encode_response_head(status, response_headers, False) + body)
+                await writer.drain()
+                ACCESS_LOG.access(status, remote=remote, error=message)
+                if METRICS.enabled:
+                    record_request(head[1] if head else "", status, len(body),
+                                   time.perf_counter() - started if head else 0.0)
+                break
+
+            connection = headers.get("connection", "").lower()
+            if DRAINING.is_set():
+                keep_alive = False  # The new process serves the next request
+            elif version == "HTTP/1.1":
+                keep_alive = connection != "close"
+            else:
+                keep_alive = connection == "keep-alive"
+
+            if page_cache.is_stale():
+                # A reload recompresses the page, so keep it off the event loop
+                try:
+                    await loop.run_in_executor(None, page_cache.get)
+                except Exception:
+                    pass  # build_async_response reports the error
+
+            status, response_headers, body = build_async_response(method, target, headers,
+                                                                  page_cache, location)
+            writer.write(encode_response_head(status, response_headers, keep_alive))
+            if method == "HEAD":
+                body_bytes = 0
+            elif isinstance(body, PageVariant):
+                await send_variant_body_async(writer, body)
+                body_bytes = len(body.body)
+            else:
+                writer.write(body)
+                body_bytes = len(body)
+            await writer.drain()
+            ACCESS_LOG.access(status, remote=remote, method=method, path=target)
+            if METRICS.enabled:
+                record_request(target, status, body_bytes, time.perf_counter() - started)
+
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+async def refresh_tls_periodically():
+    """Pick up renewed certificates; runs on the loop that creates TLS connections."""
+    while True:
+        await asyncio.sleep(TLS.check_interval)
+        TLS.refresh()
+
+async def serve_async(listen_socket=None):
+    """Run the asyncio engine until cancelled, or until a reload has drained it."""
+    options = {"backlog": PooledTCPServer.request_queue_size}
+    if TLS is not None:
+        # Handshakes are non-blocking on the loop; they never stall accepts
+        options.update(ssl=TLS.context, ssl_handshake_timeout=TLS_HANDSHAKE_TIMEOUT)
+    if listen_socket is not None:
+        server = await asyncio.start_server(handle_async_connection, sock=listen_socket,
+                                            **options)
+    else:
+        server = await asyncio.start_server(handle_async_connection, HOST_IP, PORT, **options)
+    loop = asyncio.get_running_loop()
+    if TLS is not None:
+        tls_refresh = loop.create_task(refresh_tls_periodically())
+    stopped = asyncio.Event()
+    if RELOAD_SIGNAL:
+        install_reload_handler(server.sockets[0], lambda: loop.call_soon_threadsafe(stopped.set))
+    print(f"[+] Server started successfully on {HOST_IP}:{PORT}")
+    print(f"[+] asyncio engine running on {'uvloop' if uvloop else 'asyncio'} event loop")
+    if RELOAD_SIGNAL:
+        print(f"[+] kill -HUP {os.getpid()} reloads without dropping connections")
+    print("[+] Ready to serve your 3D coin!")
+    print()
+
+    async with server:
+        notify_ready()
+        await stopped.wait()
+    if TLS is not None:
+        tls_refresh.cancel()
+
+    # Stopped by a reload: let open connections finish their current request
+    connections = asyncio.all_tasks() - {asyncio.current_task()}
+    if connections:
+        await asyncio.wait(connections, timeout=DRAIN_TIMEOUT)
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="TorCOIN Web Server")
+    parser.add_argument("--host", default=HOST_IP,
+                        help="address to bind (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=PORT,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument("--engine", choices=SERVER_ENGINES, default=DEFAULT_ENGINE,
+                        help="HTTP engine (default: %(default)s)")
+    parser.add_argument("--mode", choices=SERVER_MODES, default=DEFAULT_MODE,
+                        help="concurrency model for the socketserver engine (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="worker threads per process (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="processes in prefork mode (default: %(default)s)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="in prefork mode, give each worker its own SO_REUSEPORT socket")
+    parser.add_argument("--tls-cert", metavar="PEM",
+                        help="serve HTTPS with this certificate chain (reloaded when renewed)")
+    parser.add_argument("--tls-key", metavar="PEM",
+                        help="private key for --tls-cert (default: read from the --tls-cert file)")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser, METRICS_PORT)
+    args = parser.parse_args()
+    if args.tls_key and not args.tls_cert:
+        parser.error("--tls-key requires --tls-cert")
+    return args
 
 def main():
     """Main server function."""
+    global HOST_IP, PORT, TLS, URL_SCHEME
+    args = parse_args()
+    HOST_IP, PORT = args.host, args.port
+    configure_logging(args, "coin_server")
+
     print("=" * 50)
     print("        TORCOIN WEB SERVER")
     print("=" * 50)
     print(f"Server bound to: {HOST_IP}:{PORT}")
     print(f"HTML File: {HTML_FILE}")
+    print(f"Engine: {args.engine}" + (f" ({args.mode})" if args.engine == "socketserver" else ""))
     print()
     print("🎯 ULTRA HARDCODED ACCESS LINK:")
     print(DISPLAY_URL)
@@ -86,25 +1111,70 @@ def main():
     print("Press Ctrl+C to stop the server")
     print("=" * 50)
 
-    # Check if HTML file exists
-    if not os.path.exists(HTML_FILE):
+    # Check the HTML file exists, warming the page cache before accepting connections
+    if PAGE_CACHE.get() is None:
         print(f"[!] Error: {HTML_FILE} not found in current directory!")
         print("Make sure torcoin.html is in the same directory as this script.")
         sys.exit(1)
 
+    if args.tls_cert:
+        try:
+            TLS = TLSContext(args.tls_cert, args.tls_key)
+        except (OSError, ssl.SSLError) as e:
+            print(f"[!] Cannot load TLS certificate {args.tls_cert}: {e}")
+            sys.exit(1)
+        URL_SCHEME = "https"
+        print(f"[+] Serving HTTPS (ALPN {', '.join(ALPN_PROTOCOLS)}, session resumption on)")
+
+    if args.mode == "prefork" and not hasattr(os, "fork"):
+        print("[!] Pre-fork mode is not supported on this platform, using threaded mode")
+        args.mode = "threaded"
+
+    # Per-process metrics; pre-forked workers start their own
+    if args.metrics and not (args.engine == "socketserver" and args.mode == "prefork"):
+        try:
+            start_metrics_server(args.metrics_port)
+        except OSError as e:
+            print(f"[!] Cannot serve metrics on port {args.metrics_port}: {e}")
+            sys.exit(1)
+        print(f"[+] Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+
+    # Set when this process was started by a reload of a running server
+    listen_socket = inherited_socket()
+
     # Create server
     try:
-        with socketserver.TCPServer((HOST_IP, PORT), CoinHTTPRequestHandler) as httpd:
+        if args.engine == "asyncio":
+            if uvloop:
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            asyncio.run(serve_async(listen_socket))
+            return
+
+        if args.mode == "prefork":
+            serve_prefork(args.workers, args.threads,
+                          reuse_port=args.reuse_port and hasattr(socket, "SO_REUSEPORT"),
+                          metrics_port=args.metrics_port if args.metrics else None,
+                          listen_socket=listen_socket)
+            return
+
+        with create_server(args.mode, args.threads, listen_socket=listen_socket) as httpd:
+            if RELOAD_SIGNAL:
+                install_reload_handler(httpd.socket, lambda: stop_accepting(httpd))
             print(f"[+] Server started successfully on {HOST_IP}:{PORT}")
+            if RELOAD_SIGNAL:
+                print(f"[+] kill -HUP {os.getpid()} reloads without dropping connections")
             print("[+] Ready to serve your 3D coin!")
             print()
 
             # Start serving
+            notify_ready()
             httpd.serve_forever()
+            if DRAINING.is_set() and isinstance(httpd, PooledTCPServer):
+                httpd.drain()
 
     except PermissionError:
         print(f"[!] Permission denied. Try running with sudo (for port {PORT})")
-        print("Or change PORT to a number above 1024 (e.g., 8080)")
+        print("Or use --port with a number above 1024 (e.g., 8080)")
         sys.exit(1)
     except OSError as e:
         if "Address already in use" in str(e):
@@ -4,16 +4,20 @@ TorCOIN Test Web Server
 Test version that runs on localhost for development/testing.
 """
 
+import argparse
 import http.server
 import socketserver
-import os
 import sys
 from urllib.parse import unquote
 
+from coin_server import PageCache, send_variant_body
+from torcoin_logging import ACCESS_LOG
+
 # Configuration for testing
 HOST_IP = "127.0.0.1"  # Localhost for testing
 PORT = 50129  # Same port as production
 HTML_FILE = "torcoin.html"
+PAGE_CACHE = PageCache(HTML_FILE)  # Precompressed variants, rebuilt on change
 
 class CoinHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Custom HTTP request handler for serving the coin page."""
@@ -34,35 +38,60 @@ class CoinHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def serve_coin_page(self):
         """Serve the TorCOIN HTML page."""
         try:
-            if not os.path.exists(HTML_FILE):
+            page = PAGE_CACHE.get()
+            if page is None:
                 self.send_error(404, "Coin file not found")
                 return
 
-            with open(HTML_FILE, 'r', encoding='utf-8') as f:
-                content = f.read()
+            variant = page.select(self.headers.get('Accept-Encoding'))
+            if variant is None:
+                self.send_error(406, "No acceptable content-coding")
+                return
+
+            if variant.is_not_modified(self.headers.get('If-None-Match'),
+                                       self.headers.get('If-Modified-Since')):
+                self.send_response(304)
+                for header, value in variant.validator_headers:
+                    self.send_header(header, value)
+                self.end_headers()
+                return
 
             self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.send_header('Content-length', len(content.encode('utf-8')))
-            self.send_header('Cache-Control', 'no-cache')
+            for header, value in variant.headers:
+                self.send_header(header, value)
             self.end_headers()
 
-            self.wfile.write(content.encode('utf-8'))
+            send_variant_body(self.connection, variant)
 
         except Exception as e:
             self.send_error(500, f"Server error: {str(e)}")
 
+    def log_request(self, code='-', size='-'):
+        """Queue a structured access record."""
+        ACCESS_LOG.access(int(code) if isinstance(code, int) else 0,
+                          remote=self.client_address[0], method=self.command, path=self.path)
+
+    def log_error(self, format, *args):
+        ACCESS_LOG.message("error", format, *args, remote=self.client_address[0])
+
     def log_message(self, format, *args):
-        """Override logging to show custom messages."""
-        if "GET /" in format and "200" in format:
-            print(f"[+] Served coin page to {self.address_string()}")
-        elif "404" in format:
-            print(f"[!] File not found: {self.path}")
-        elif "500" in format:
-            print(f"[!] Server error: {self.path}")
+        ACCESS_LOG.message("info", format, *args, remote=self.client_address[0])
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="TorCOIN Test Web Server")
+    parser.add_argument("--host", default=HOST_IP,
+                        help="address to bind (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=PORT,
+                        help="port to listen on (default: %(default)s)")
+    return parser.parse_args()
 
 def main():
     """Main server function."""
+    global HOST_IP, PORT
+    args = parse_args()
+    HOST_IP, PORT = args.host, args.port
+    ACCESS_LOG.configure(service="test_server")
     print("=" * 50)
     print("     TORCOIN TEST WEB SERVER")
     print("=" * 50)
@@ -78,7 +107,7 @@ def main():
     print("Press Ctrl+C to stop the test server")
     print("=" * 50)
 
-    if not os.path.exists(HTML_FILE):
+    if PAGE_CACHE.get() is None:
         print(f"[!] Error: {HTML_FILE} not found in current directory!")
         sys.exit(1)
 
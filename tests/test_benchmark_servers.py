@@ -0,0 +1,65 @@
+"""Behaviour checks for the benchmark harness."""
+
+import argparse
+import asyncio
+import unittest
+
+import benchmark_servers
+
+
+class ResponseParsingTest(unittest.TestCase):
+    def read(self, data, method="GET"):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            result = await benchmark_servers.read_response(reader, method)
+            return result, await reader.read()
+        return asyncio.run(run())
+
+    def test_sized_and_chunked_bodies_are_consumed(self):
+        (status, keep_open), rest = self.read(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabcNEXT")
+        self.assertEqual((status, keep_open, rest), (200, True, b"NEXT"))
+        (status, keep_open), rest = self.read(
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\nNEXT")
+        self.assertEqual((status, keep_open, rest), (200, True, b"NEXT"))
+
+    def test_connection_close_and_http10(self):
+        self.assertFalse(self.read(b"HTTP/1.1 302 Found\r\nConnection: close\r\n"
+                                   b"Content-Length: 0\r\n\r\n")[0][1])
+        self.assertFalse(self.read(b"HTTP/1.0 200 OK\r\n\r\nbody until close")[0][1])
+        self.assertEqual(self.read(b"HTTP/1.1 304 Not Modified\r\n\r\nNEXT")[1], b"NEXT")
+
+
+class SummaryTest(unittest.TestCase):
+    def test_percentiles_are_nearest_rank(self):
+        ordered = [i / 1000 for i in range(1, 1001)]
+        self.assertEqual(benchmark_servers.percentile(ordered, 0.5), 0.5)
+        self.assertEqual(benchmark_servers.percentile(ordered, 0.99), 0.99)
+        self.assertEqual(benchmark_servers.percentile(ordered, 0.999), 0.999)
+        self.assertIsNone(benchmark_servers.percentile([], 0.5))
+
+    def test_client_processes_are_merged(self):
+        summary = benchmark_servers.summarise(
+            [{"latencies": [0.001, 0.003], "statuses": {200: 2}, "errors": 1},
+             {"latencies": [0.002], "statuses": {200: 1}, "errors": 0}], duration=2)
+        self.assertEqual((summary["requests"], summary["errors"], summary["rps"]), (3, 1, 1.5))
+        self.assertEqual(summary["statuses"], {"200": 3})
+        self.assertEqual(summary["latency_ms"]["p50"], 2.0)
+        self.assertEqual(summary["latency_ms"]["max"], 3.0)
+
+
+class BenchmarkRunTest(unittest.TestCase):
+    def test_short_run_against_the_asyncio_engine(self):
+        args = argparse.Namespace(client_processes=1, warmup=0.1, duration=0.3)
+        runs = benchmark_servers.benchmark("coin_asyncio", [2], [0.5], args)
+        self.assertEqual(len(runs), 1)
+        run = runs[0]
+        self.assertGreater(run["requests"], 0)
+        self.assertEqual(run["errors"], 0)
+        self.assertEqual(set(run["statuses"]), {"200"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,473 @@
+"""Behaviour checks for the coin page server."""
+
+import asyncio
+import gzip
+import os
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import coin_server
+import torcoin_metrics
+
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "page.html")
+        self.write(b"<html>one</html>", mtime=1_000_000)
+        self.cache = coin_server.PageCache(self.path, stat_interval=0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, body, mtime):
+        with open(self.path, "wb") as f:
+            f.write(body)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_serves_file_contents(self):
+        page = self.cache.get()
+        self.assertEqual(page.select(None).body, b"<html>one</html>")
+
+    def test_reuses_page_while_file_is_unchanged(self):
+        self.assertIs(self.cache.get(), self.cache.get())
+
+    def test_reloads_when_mtime_changes(self):
+        first = self.cache.get()
+        self.write(b"<html>two</html>", mtime=1_000_100)
+        second = self.cache.get()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.select(None).body, b"<html>two</html>")
+
+    def test_reloads_when_size_changes(self):
+        self.cache.get()
+        self.write(b"<html>longer</html>", mtime=1_000_000)
+        self.assertEqual(self.cache.get().select(None).body, b"<html>longer</html>")
+
+    def test_stat_throttle_hides_changes_until_interval_passes(self):
+        cache = coin_server.PageCache(self.path, stat_interval=3600)
+        first = cache.get()
+        self.write(b"<html>two</html>", mtime=1_000_100)
+        self.assertIs(cache.get(), first)
+
+    def test_missing_file_returns_none(self):
+        self.cache.get()
+        os.remove(self.path)
+        self.assertIsNone(self.cache.get())
+
+
+class ConditionalGetTest(unittest.TestCase):
+    MTIME = 1_000_000_000  # Sun, 09 Sep 2001 01:46:40 GMT
+
+    def setUp(self):
+        self.variant = coin_server.PageVariant(b"body", '"abc"', self.MTIME)
+
+    def test_matching_etag_is_not_modified(self):
+        self.assertTrue(self.variant.is_not_modified('"abc"', None))
+
+    def test_weak_comparison_and_lists(self):
+        self.assertTrue(self.variant.is_not_modified('W/"abc"', None))
+        self.assertTrue(self.variant.is_not_modified('"x", "abc"', None))
+        self.assertTrue(self.variant.is_not_modified('*', None))
+
+    def test_other_etag_is_modified(self):
+        self.assertFalse(self.variant.is_not_modified('"other"', None))
+
+    def test_if_none_match_takes_precedence(self):
+        self.assertFalse(self.variant.is_not_modified(
+            '"other"', "Sun, 09 Sep 2001 01:46:40 GMT"))
+
+    def test_if_modified_since(self):
+        self.assertTrue(self.variant.is_not_modified(None, "Sun, 09 Sep 2001 01:46:40 GMT"))
+        self.assertTrue(self.variant.is_not_modified(None, "Mon, 10 Sep 2001 00:00:00 GMT"))
+        self.assertFalse(self.variant.is_not_modified(None, "Sat, 08 Sep 2001 00:00:00 GMT"))
+
+    def test_bad_dates_are_ignored(self):
+        for value in ("yesterday", "", "Sun, 99 Foo 2001 99:99:99 GMT"):
+            self.assertFalse(self.variant.is_not_modified(None, value), value)
+
+    def test_validator_headers(self):
+        headers = dict(self.variant.validator_headers)
+        self.assertEqual(headers["ETag"], '"abc"')
+        self.assertEqual(headers["Last-Modified"], "Sun, 09 Sep 2001 01:46:40 GMT")
+
+
+class ContentNegotiationTest(unittest.TestCase):
+    ALL = ("identity", "gzip", "br")
+
+    def choose(self, header, available=ALL):
+        return coin_server.choose_encoding(header, available)
+
+    def test_no_header_means_identity(self):
+        self.assertEqual(self.choose(None), "identity")
+        self.assertEqual(self.choose(""), "identity")
+
+    def test_prefers_brotli_then_gzip(self):
+        self.assertEqual(self.choose("gzip, deflate, br"), "br")
+        self.assertEqual(self.choose("gzip, deflate, br", ("identity", "gzip")), "gzip")
+
+    def test_q_values_pick_the_highest_weight(self):
+        self.assertEqual(self.choose("br;q=0.5, gzip"), "gzip")
+        self.assertEqual(self.choose("br;q=0.5, gzip;q=0.9"), "gzip")
+
+    def test_unlisted_identity_ranks_below_listed_codings(self):
+        self.assertEqual(self.choose("gzip;q=0.5"), "gzip")
+        self.assertEqual(self.choose("deflate"), "identity")
+        self.assertEqual(self.choose("gzip;q=0"), "identity")
+
+    def test_explicit_identity_weight_is_respected(self):
+        self.assertEqual(self.choose("gzip;q=0.5, identity"), "identity")
+        self.assertEqual(self.choose("gzip, identity"), "gzip")
+
+    def test_extra_parameters_are_ignored(self):
+        self.assertEqual(self.choose("gzip;q=0.8;level=1"), "gzip")
+        self.assertEqual(self.choose("gzip;level=1;q=0.8, identity;q=0.5"), "gzip")
+
+    def test_wildcard(self):
+        self.assertEqual(self.choose("identity;q=0, *"), "br")
+        self.assertEqual(self.choose("*;q=0"), None)
+        self.assertEqual(self.choose("identity;q=0, *;q=0"), None)
+
+    def test_q_values_are_clamped(self):
+        self.assertEqual(self.choose("gzip;q=nan"), "identity")
+        self.assertEqual(self.choose("gzip;q=inf, identity;q=0.9"), "gzip")
+        self.assertEqual(self.choose("gzip;q=-1"), "identity")
+        self.assertEqual(self.choose("gzip;q=abc"), "identity")
+
+    def test_page_variants(self):
+        body = b"<html>" + b"coin " * 200 + b"</html>"
+        page = coin_server.CachedPage(body, 1_000_000)
+        variant = page.select("gzip")
+        self.assertEqual(gzip.decompress(variant.body), body)
+        headers = dict(variant.headers)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertNotEqual(variant.etag, page.select(None).etag)
+        self.assertIsNone(page.select("identity;q=0, *;q=0"))
+
+
+class SendVariantBodyTest(unittest.TestCase):
+    BODY = b"<html>" + bytes(range(256)) * 400 + b"</html>"
+
+    def setUp(self):
+        self.variant = coin_server.PageVariant(self.BODY, '"x"', 0)
+
+    def receive_all(self, sock, size):
+        data = b""
+        while len(data) < size:
+            data += sock.recv(size - len(data))
+        return data
+
+    def test_sends_whole_body_over_a_socket(self):
+        server, client = socket.socketpair()
+        with server, client:
+            client.setblocking(True)
+            thread_result = []
+            reader = threading.Thread(
+                target=lambda: thread_result.append(self.receive_all(client, len(self.BODY))))
+            reader.start()
+            coin_server.send_variant_body(server, self.variant)
+            reader.join(5)
+        self.assertEqual(thread_result, [self.BODY])
+
+    def test_falls_back_to_sendall_for_socket_wrappers(self):
+        sock = mock.Mock()
+        coin_server.send_variant_body(sock, self.variant)
+        sock.sendall.assert_called_once()
+        self.assertEqual(bytes(sock.sendall.call_args[0][0]), self.BODY)
+
+    def test_falls_back_when_sendfile_is_unsupported(self):
+        server, client = socket.socketpair()
+        with server, client, mock.patch.object(
+                coin_server.os, "sendfile", side_effect=OSError(coin_server.errno.EINVAL, "no")):
+            coin_server.send_variant_body(server, coin_server.PageVariant(b"small", '"y"', 0))
+            self.assertEqual(client.recv(100), b"small")
+
+
+class PooledTCPServerTest(unittest.TestCase):
+    def setUp(self):
+        # Bound to an ephemeral port; serve_forever is never started, so no
+        # worker drains the queue.
+        self.server = coin_server.PooledTCPServer(
+            ("127.0.0.1", 0), coin_server.CoinHTTPRequestHandler, threads=1)
+        self.addCleanup(self.server.server_close)
+        self.pairs = []
+
+    def tearDown(self):
+        for a, b in self.pairs:
+            a.close()
+            b.close()
+
+    def connection(self):
+        pair = socket.socketpair()
+        self.pairs.append(pair)
+        return pair
+
+    def fill_queue(self):
+        for _ in range(self.server._requests.maxsize):
+            server_side, _ = self.connection()
+            self.server.process_request(server_side, ("127.0.0.1", 1))
+
+    def test_sheds_connections_with_503_when_queue_is_full(self):
+        self.fill_queue()
+        server_side, client_side = self.connection()
+        with mock.patch.object(coin_server, "QUEUE_TIMEOUT", 0.01):
+            self.server.process_request(server_side, ("127.0.0.1", 1))
+        self.assertTrue(client_side.recv(100).startswith(b"HTTP/1.0 503"))
+
+    def test_server_close_does_not_block_on_full_queue(self):
+        self.fill_queue()
+        self.server.server_close()
+        self.assertTrue(self.server._requests.empty())
+
+
+class AsyncEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        path = os.path.join(self.tmp.name, "page.html")
+        with open(path, "wb") as f:
+            f.write(b"<html>coin</html>")
+        patcher = mock.patch.object(coin_server, "PAGE_CACHE",
+                                    coin_server.PageCache(path, stat_interval=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exchange(self, raw):
+        """Send raw bytes to a fresh asyncio engine and return everything read back."""
+        async def run():
+            server = await asyncio.start_server(
+                coin_server.handle_async_connection, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(raw)
+                await writer.drain()
+                data = await asyncio.wait_for(reader.read(), 5)
+                writer.close()
+                return data
+        return asyncio.run(run())
+
+    def statuses(self, data):
+        return [int(status) for status in re.findall(rb"HTTP/1\.1 (\d{3}) ", data)]
+
+    def test_read_request_head_parses_line_and_headers(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"GET /x HTTP/1.1\r\nHost: a\r\nAccept-Encoding: gzip\r\n\r\n")
+            return await coin_server.read_request_head(reader)
+        method, target, version, headers = asyncio.run(run())
+        self.assertEqual((method, target, version), ("GET", "/x", "HTTP/1.1"))
+        self.assertEqual(headers, {"host": "a", "accept-encoding": "gzip"})
+
+    def test_read_request_head_returns_none_on_eof(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_eof()
+            return await coin_server.read_request_head(reader)
+        self.assertIsNone(asyncio.run(run()))
+
+    def test_read_request_head_rejects_duplicate_content_length(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"GET / HTTP/1.1\r\nContent-Length: 1\r\nContent-Length: 2\r\n\r\n")
+            return await coin_server.read_request_head(reader)
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+
+    def test_build_async_response_routes_like_do_get(self):
+        for path in ("/", "/torcoin.html", f"/{coin_server.HTML_FILE}"):
+            self.assertEqual(coin_server.build_async_response("GET", path, {})[0], 200)
+        status, headers, _ = coin_server.build_async_response("GET", "/elsewhere", {})
+        self.assertEqual(status, 302)
+        self.assertIn("Location", dict(headers))
+        self.assertEqual(coin_server.build_async_response("POST", "/", {})[0], 501)
+
+    def test_pipelined_requests_are_answered_in_order(self):
+        data = self.exchange(b"GET / HTTP/1.1\r\n\r\n"
+                             b"GET /nope HTTP/1.1\r\n\r\n"
+                             b"HEAD / HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual(self.statuses(data), [200, 302, 200])
+        self.assertEqual(data.count(b"<html>coin</html>"), 1)
+
+    def test_request_body_is_discarded_before_next_request(self):
+        data = self.exchange(b"GET /x HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+                             b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual(self.statuses(data), [302, 200])
+
+    def test_requests_are_counted_per_route(self):
+        requests = torcoin_metrics.Counter("requests_total", "", ("route", "status"))
+        response_bytes = torcoin_metrics.Counter("bytes_total", "", ("route",))
+        with mock.patch.object(torcoin_metrics.METRICS, "enabled", True), \
+                mock.patch.object(coin_server, "REQUESTS", requests), \
+                mock.patch.object(coin_server, "RESPONSE_BYTES", response_bytes):
+            self.exchange(b"GET / HTTP/1.1\r\n\r\nGET /nope HTTP/1.1\r\n\r\n"
+                          b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual(requests.values(), {("/", 200): 2, ("other", 302): 1})
+        self.assertEqual(response_bytes.values(),
+                         {("/",): 2 * len(b"<html>coin</html>"), ("other",): 0})
+
+    def test_bad_content_length_gets_400(self):
+        for value in (b"abc", b"-5", b""):
+            data = self.exchange(b"GET / HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n")
+            self.assertEqual(self.statuses(data), [400], value)
+
+    def test_oversized_body_gets_413(self):
+        length = str(coin_server.MAX_REQUEST_BODY + 1).encode()
+        data = self.exchange(b"POST / HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n")
+        self.assertEqual(self.statuses(data), [413])
+
+    def test_chunked_request_is_rejected_and_connection_closed(self):
+        data = self.exchange(b"GET /x HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                             b"5\r\nhello\r\n0\r\n\r\n"
+                             b"GET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(self.statuses(data), [400])
+
+    def test_draining_closes_keep_alive_connections(self):
+        with mock.patch.object(coin_server, "DRAINING", threading.Event()):
+            coin_server.DRAINING.set()
+            data = self.exchange(b"GET / HTTP/1.1\r\n\r\nGET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(self.statuses(data), [200])
+        self.assertIn(b"Connection: close", data)
+
+
+class ReloadTest(unittest.TestCase):
+    REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def setUp(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(self.listener.close)
+
+    def replace_with(self, code):
+        """Run spawn_replacement() with ``code`` standing in for the server script."""
+        code = f"import sys; sys.path.insert(0, {self.REPO!r}); import coin_server; {code}"
+        with mock.patch.object(sys, "argv", ["-c", code]), \
+                mock.patch.object(coin_server, "RELOAD_TIMEOUT", 10):
+            return coin_server.spawn_replacement(self.listener)
+
+    def test_listening_socket_is_handed_to_the_new_process(self):
+        started = self.replace_with(
+            "sock = coin_server.inherited_socket(); coin_server.notify_ready(); "
+            "conn, _ = sock.accept(); conn.sendall(b'new process'); conn.close()")
+        self.assertTrue(started)
+        with socket.create_connection(self.listener.getsockname(), timeout=5) as client:
+            self.listener.close()  # The new process holds its own copy
+            self.assertEqual(client.recv(100), b"new process")
+
+    def test_failed_replacement_is_reported(self):
+        self.assertFalse(self.replace_with("raise SystemExit(3)"))
+
+    def test_server_can_take_over_a_listening_socket(self):
+        httpd = coin_server.create_server("threaded", threads=1,
+                                          listen_socket=self.listener)
+        self.addCleanup(httpd.server_close)
+        self.assertIs(httpd.socket, self.listener)
+        self.assertEqual(httpd.server_address, self.listener.getsockname())
+        self.assertTrue(httpd.drain(timeout=0.1))
+
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs the openssl command to make certificates")
+class TLSTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cert = os.path.join(self.tmp.name, "cert.pem")
+        self.key = os.path.join(self.tmp.name, "key.pem")
+        self.make_certificate("first.test")
+        page = os.path.join(self.tmp.name, "page.html")
+        with open(page, "wb") as f:
+            f.write(b"<html>coin</html>")
+        self.tls = coin_server.TLSContext(self.cert, self.key, check_interval=0)
+        for name, value in (("TLS", self.tls),
+                            ("PAGE_CACHE", coin_server.PageCache(page, stat_interval=0))):
+            patcher = mock.patch.object(coin_server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.client.check_hostname = False
+        self.client.verify_mode = ssl.CERT_NONE
+        self.client.set_alpn_protocols(["h2", "http/1.1"])
+
+    def make_certificate(self, name, key=None):
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt",
+                        "ec_paramgen_curve:prime256v1", "-nodes", "-days", "1",
+                        "-subj", f"/CN={name}", "-keyout", key or self.key, "-out", self.cert],
+                       check=True, capture_output=True)
+
+    def start_threaded(self):
+        httpd = coin_server.create_server("threaded", threads=2)
+        httpd.server_address = httpd.socket.getsockname()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd.server_address
+
+    def get(self, address, session=None):
+        """GET / over TLS; return (response, ALPN protocol, reused, session, cert)."""
+        with socket.create_connection(address, timeout=5) as raw, \
+                self.client.wrap_socket(raw, session=session) as tls:
+            protocol, reused = tls.selected_alpn_protocol(), tls.session_reused
+            certificate = tls.getpeercert(binary_form=True)
+            tls.sendall(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n")
+            data = b""
+            while chunk := tls.recv(65536):
+                data += chunk
+            return data, protocol, reused, tls.session, certificate
+
+    def test_threaded_engine_serves_https_and_resumes_sessions(self):
+        with mock.patch.object(coin_server, "HOST_IP", "127.0.0.1"), \
+                mock.patch.object(coin_server, "PORT", 0):
+            address = self.start_threaded()
+        before = coin_server.TLS_HANDSHAKES.values()
+        data, protocol, reused, session, _ = self.get(address)
+        self.assertEqual((protocol, reused), ("http/1.1", False))
+        self.assertTrue(data.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(data.endswith(b"\r\n\r\n<html>coin</html>"))
+        self.assertTrue(self.get(address, session)[2])
+
+        after = coin_server.TLS_HANDSHAKES.values()
+        for result in ("full", "resumed"):
+            self.assertEqual(after.get((result,), 0) - before.get((result,), 0), 1)
+
+    def test_renewed_certificate_keeps_sessions_resumable(self):
+        with mock.patch.object(coin_server, "HOST_IP", "127.0.0.1"), \
+                mock.patch.object(coin_server, "PORT", 0):
+            address = self.start_threaded()
+        *_, session, first = self.get(address)
+        self.make_certificate("second.test")
+        self.assertTrue(self.get(address, session)[2])
+        self.assertNotEqual(self.get(address)[4], first)
+
+    def test_mismatched_key_is_not_loaded(self):
+        self.make_certificate("second.test", key=os.path.join(self.tmp.name, "other.pem"))
+        self.tls.refresh()
+        # The new certificate does not match key.pem: the old pair stays in use
+        with mock.patch.object(coin_server, "HOST_IP", "127.0.0.1"), \
+                mock.patch.object(coin_server, "PORT", 0):
+            address = self.start_threaded()
+        self.assertTrue(self.get(address)[0].startswith(b"HTTP/1.1 200 OK\r\n"))
+
+    def test_asyncio_engine_serves_https(self):
+        async def run():
+            server = await asyncio.start_server(coin_server.handle_async_connection,
+                                                "127.0.0.1", 0, ssl=self.tls.context)
+            async with server:
+                address = server.sockets[0].getsockname()
+                return await asyncio.get_running_loop().run_in_executor(None, self.get, address)
+        data, protocol, *_ = asyncio.run(run())
+        self.assertEqual(protocol, "http/1.1")
+        self.assertTrue(data.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(data.endswith(b"\r\n\r\n<html>coin</html>"))
+
+
+if __name__ == "__main__":
+    unittest.main()
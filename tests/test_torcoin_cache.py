@@ -0,0 +1,126 @@
+"""Behaviour checks for the proxy response cache."""
+
+import time
+import unittest
+
+from torcoin_cache import CachedResponse, ResponseCache, is_storable, request_cache_mode
+
+
+def response(body=b"page", cache_control="max-age=60", vary=None, etag='"v1"',
+             request_headers=()):
+    headers = [("Content-Length", str(len(body))), ("Cache-Control", cache_control)]
+    if etag:
+        headers.append(("ETag", etag))
+    if vary:
+        headers.append(("Vary", vary))
+    return CachedResponse(200, "OK", headers, body, list(request_headers))
+
+
+class CachedResponseTest(unittest.TestCase):
+    def test_freshness_follows_cache_control(self):
+        self.assertTrue(response(cache_control="max-age=60").is_fresh())
+        self.assertTrue(response(cache_control="max-age=0, s-maxage=60").is_fresh())
+        self.assertFalse(response(cache_control="no-cache, max-age=60").is_fresh())
+
+    def test_stale_while_revalidate_window(self):
+        entry = response(cache_control="max-age=1, stale-while-revalidate=30")
+        later = entry.stored_at + 5
+        self.assertFalse(entry.is_fresh(later))
+        self.assertTrue(entry.is_usable_stale(later))
+        self.assertFalse(entry.is_usable_stale(entry.stored_at + 40))
+        must = response(cache_control="max-age=1, must-revalidate, stale-while-revalidate=30")
+        self.assertFalse(must.is_usable_stale(later))
+
+    def test_revalidation_merges_headers_and_restarts_lifetime(self):
+        entry = response(cache_control="max-age=0")
+        entry.stored_at -= 100
+        entry.revalidated([("Cache-Control", "max-age=60"), ("Content-Length", "0")])
+        self.assertTrue(entry.is_fresh())
+        self.assertIn(("Content-Length", "4"), entry.headers)
+        self.assertIn(("Cache-Control", "max-age=60"), entry.headers)
+
+    def test_client_conditionals(self):
+        entry = response(etag='"v1"')
+        self.assertTrue(entry.is_not_modified([("If-None-Match", '"v0", W/"v1"')]))
+        self.assertFalse(entry.is_not_modified([("If-None-Match", '"v2"')]))
+        self.assertFalse(entry.is_not_modified([]))
+        headers = dict(entry.response_headers(not_modified=True))
+        self.assertNotIn("Content-Length", headers)
+        self.assertEqual(headers["ETag"], '"v1"')
+        self.assertIn("Age", headers)
+
+    def test_storability(self):
+        self.assertTrue(is_storable(200, [("Cache-Control", "max-age=5")]))
+        self.assertTrue(is_storable(200, [("ETag", '"x"')]))
+        self.assertFalse(is_storable(200, []))
+        self.assertFalse(is_storable(200, [("Cache-Control", "private, max-age=5")]))
+        self.assertFalse(is_storable(200, [("Cache-Control", "no-store")]))
+        self.assertFalse(is_storable(200, [("ETag", '"x"'), ("Vary", "*")]))
+        self.assertFalse(is_storable(500, [("Cache-Control", "max-age=5")]))
+
+    def test_request_cache_mode(self):
+        self.assertEqual(request_cache_mode([]), "normal")
+        self.assertEqual(request_cache_mode([("Cache-Control", "no-cache")]), "revalidate")
+        self.assertEqual(request_cache_mode([("Pragma", "no-cache")]), "revalidate")
+        self.assertEqual(request_cache_mode([("Cache-Control", "no-store")]), "bypass")
+        self.assertEqual(request_cache_mode([("Authorization", "Basic eA==")]), "bypass")
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_entries_are_keyed_on_vary_headers(self):
+        cache = ResponseCache()
+        gzip_headers = [("Accept-Encoding", "gzip")]
+        cache.store("/", response(b"zipped", vary="Accept-Encoding", request_headers=gzip_headers))
+        self.assertEqual(cache.lookup("/", gzip_headers)[1].body, b"zipped")
+        self.assertIsNone(cache.lookup("/", [("Accept-Encoding", "br")])[1])
+        self.assertIsNone(cache.lookup("/", [])[1])
+
+    def test_lru_eviction_keeps_the_byte_budget(self):
+        first, second, third = (response(bytes(100)) for _ in range(3))
+        cache = ResponseCache(max_bytes=first.size * 2)
+        cache.store("/a", first)
+        cache.store("/b", second)
+        cache.lookup("/a", [])  # /a becomes most recently used
+        cache.store("/c", third)
+        self.assertIsNotNone(cache.lookup("/a", [])[1])
+        self.assertIsNone(cache.lookup("/b", [])[1])
+        self.assertEqual(cache.size, first.size * 2)
+
+    def test_oversized_objects_are_not_stored(self):
+        cache = ResponseCache(max_object_size=10)
+        cache.store("/", response(bytes(100)))
+        self.assertIsNone(cache.lookup("/", [])[1])
+        self.assertEqual(cache.size, 0)
+
+    def test_restoring_an_entry_is_not_double_counted(self):
+        cache = ResponseCache()
+        entry = response()
+        cache.store("/", entry)
+        entry.revalidated([("Cache-Control", "max-age=120, stale-while-revalidate=5")])
+        cache.store("/", entry)
+        self.assertEqual(cache.size, entry.size)
+
+    def test_flights_collapse_to_one_leader(self):
+        cache = ResponseCache()
+        key = cache.key("/", [])
+        leader, flight = cache.begin(key)
+        follower, same = cache.begin(key)
+        self.assertTrue(leader)
+        self.assertFalse(follower)
+        self.assertIs(flight, same)
+        entry = response()
+        cache.finish(key, entry)
+        self.assertTrue(flight.done.is_set())
+        self.assertIs(flight.result, entry)
+        self.assertTrue(cache.begin(key)[0])
+
+    def test_pass_expires(self):
+        cache = ResponseCache()
+        cache.mark_pass("/", ttl=0.01)
+        self.assertTrue(cache.is_pass("/"))
+        time.sleep(0.02)
+        self.assertFalse(cache.is_pass("/"))
+
+
+if __name__ == "__main__":
+    unittest.main()
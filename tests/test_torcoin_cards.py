@@ -0,0 +1,260 @@
+"""Behaviour checks for virtual card number generation."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import torcoin_cards
+from torcoin_cards import (CardAllocator, CardPool, card_middle, format_card_number,
+                           generate_card_numbers, permute_middle)
+
+
+class GenerationTest(unittest.TestCase):
+    def test_cards_have_the_fixed_format(self):
+        self.assertEqual(format_card_number(42), "8948000000422241")
+        for card in generate_card_numbers(1000):
+            self.assertEqual(len(card), 16)
+            self.assertTrue(card.startswith("8948") and card.endswith("2241"))
+            self.assertTrue(card[4:12].isdigit())
+
+    def test_requested_count_excludes_taken_cards(self):
+        taken = generate_card_numbers(5000)
+        issued = {format_card_number(1)}
+        cards = generate_card_numbers(20000, taken, issued)
+        self.assertEqual(len(cards), 20000)
+        self.assertFalse(cards & taken)
+        self.assertFalse(cards & issued)
+
+    def test_draws_above_the_limit_are_rejected(self):
+        words = (torcoin_cards.DRAW_LIMIT.to_bytes(4, "little")
+                 + (torcoin_cards.DRAW_LIMIT - 1).to_bytes(4, "little"))
+        with mock.patch.object(torcoin_cards.secrets, "token_bytes", return_value=words):
+            self.assertEqual(torcoin_cards.random_middles(2),
+                             [(torcoin_cards.DRAW_LIMIT - 1) % torcoin_cards.CARD_MIDDLE_RANGE])
+
+    def test_nearly_exhausted_space_still_fills(self):
+        # Only 10 of the 20 smallest middles are free: passes repeat until found
+        with mock.patch.object(torcoin_cards, "CARD_MIDDLE_RANGE", 20):
+            taken = {format_card_number(middle) for middle in range(0, 20, 2)}
+            cards = generate_card_numbers(10, taken)
+        self.assertEqual(cards, {format_card_number(middle) for middle in range(1, 20, 2)})
+
+
+class CardPoolTest(unittest.TestCase):
+    def test_fill_and_take_hand_out_unique_cards(self):
+        pool = CardPool()
+        self.assertEqual(pool.fill(10000), 10000)
+        cards = [pool.take() for _ in range(10000)]
+        self.assertEqual(len(set(cards)), 10000)
+        self.assertTrue(all(card_middle(card) is not None for card in cards))
+        self.assertIsNone(pool.take())
+        self.assertEqual(len(pool), 0)
+
+    def test_issued_cards_are_never_pooled_again(self):
+        with mock.patch.object(torcoin_cards, "CARD_MIDDLE_RANGE", 16):
+            pool = CardPool()
+            pool.mark_issued(format_card_number(3))
+            self.assertEqual(pool.fill(15), 15)
+            self.assertNotIn(format_card_number(3), [pool.take() for _ in range(15)])
+
+    def test_clear_keeps_issued_cards_marked(self):
+        pool = CardPool()
+        pool.load([5, 6, 7])
+        issued = pool.take()
+        pool.clear()
+        self.assertTrue(pool.is_taken(issued))
+        self.assertEqual([pool.is_taken(format_card_number(middle)) for middle in (5, 6, 7)],
+                         [middle == card_middle(issued) for middle in (5, 6, 7)])
+
+    def test_load_skips_duplicates_and_out_of_range_middles(self):
+        pool = CardPool()
+        pool.load([1, 1, -1, torcoin_cards.CARD_MIDDLE_RANGE, 2])
+        self.assertEqual(pool.middles().tolist(), [1, 2])
+
+    def test_card_middle_rejects_other_formats(self):
+        self.assertEqual(card_middle("8948123456782241"), 12345678)
+        for card in ("1234123456782241", "8948123456780000", "89481234567a2241", None):
+            self.assertIsNone(card_middle(card))
+
+
+class CardPoolFileTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "card_pool.bin")
+
+    def test_opened_pool_resumes_at_the_cursor(self):
+        pool = CardPool()
+        pool.mark_issued(format_card_number(9))
+        pool.load([5, 6, 7, 8])
+        pool.save(self.path, "2026-01-02")
+        first = pool.take()
+
+        reopened = CardPool()
+        self.assertEqual(reopened.open(self.path), "2026-01-02")
+        self.assertEqual(len(reopened), 3)
+        self.assertTrue(reopened.is_taken(first))
+        self.assertTrue(reopened.is_taken(format_card_number(9)))
+        self.assertEqual(reopened.middles().tolist(), [6, 7, 8])
+        self.assertEqual([reopened.take() for _ in range(4)],
+                         [format_card_number(middle) for middle in (6, 7, 8)] + [None])
+
+    def test_file_size_is_fixed_by_the_pool_size(self):
+        pool = CardPool()
+        pool.fill(1000)
+        pool.save(self.path, "2026-01-02")
+        self.assertEqual(os.path.getsize(self.path),
+                         torcoin_cards.POOL_HEADER.size
+                         + torcoin_cards.CARD_MIDDLE_RANGE // 8 + 4 * 1000)
+
+    def test_mapped_pool_can_grow_and_be_saved_again(self):
+        pool = CardPool()
+        pool.load([1, 2])
+        pool.save(self.path, "2026-01-02")
+        pool.take()
+        self.assertEqual(pool.fill(10), 10)
+        self.assertEqual(len(pool), 11)
+        pool.save(self.path, "2026-01-03")
+
+        reopened = CardPool()
+        self.assertEqual(reopened.open(self.path), "2026-01-03")
+        self.assertEqual(reopened.middles().tolist()[0], 2)
+        self.assertEqual(len(reopened), 11)
+        self.assertTrue(reopened.is_taken(format_card_number(1)))
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"{\"middles\": []}")
+        pool = CardPool()
+        pool.load([3])
+        with self.assertRaises(ValueError):
+            pool.open(self.path)
+        self.assertEqual(pool.middles().tolist(), [3])
+
+
+class CardPoolJournalTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "card_pool.bin")
+        self.journal = self.path + torcoin_cards.POOL_JOURNAL_SUFFIX
+        self.pool = CardPool()
+        self.addCleanup(self.pool.close)
+        self.pool.load(range(10))
+        self.pool.save(self.path, "2026-01-02")
+
+    def header_cursor(self):
+        with open(self.path, "rb") as f:
+            return torcoin_cards.POOL_HEADER.unpack(f.read(torcoin_cards.POOL_HEADER.size))[4]
+
+    def lose_header_cursor(self):
+        """Reset the header cursor on disk, as if the mapped page was never written back."""
+        with open(self.path, "r+b") as f:
+            f.seek(torcoin_cards.POOL_CURSOR_OFFSET)
+            f.write(torcoin_cards.POOL_CURSOR.pack(0))
+
+    def test_each_card_appends_one_record(self):
+        for _ in range(3):
+            self.pool.take()
+        self.assertEqual(os.path.getsize(self.journal), 3 * torcoin_cards.POOL_JOURNAL_RECORD.size)
+
+    def test_journal_restores_a_lost_cursor(self):
+        taken = [self.pool.take() for _ in range(3)]
+        self.lose_header_cursor()
+        with open(self.journal, "ab") as f:
+            f.write(bytes(torcoin_cards.POOL_JOURNAL_RECORD.size) + b"torn")
+
+        reopened = CardPool()
+        self.addCleanup(reopened.close)
+        reopened.open(self.path)
+        self.assertEqual(len(reopened), 7)
+        self.assertNotIn(reopened.take(), taken)
+        self.assertEqual(self.header_cursor(), 4)
+
+    def test_journal_is_compacted_into_the_header(self):
+        with mock.patch.object(torcoin_cards, "POOL_COMPACT_RECORDS", 2):
+            for _ in range(3):
+                self.pool.take()
+        self.assertEqual(os.path.getsize(self.journal), torcoin_cards.POOL_JOURNAL_RECORD.size)
+        self.pool.close()
+        self.assertEqual(self.header_cursor(), 3)
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def test_saving_a_new_pool_empties_the_journal(self):
+        self.pool.take()
+        self.pool.fill(5)
+        self.pool.take()  # Still journalled against the file while in memory
+        self.lose_header_cursor()
+        reopened = CardPool()
+        self.addCleanup(reopened.close)
+        reopened.open(self.path)
+        self.assertEqual(len(reopened), 8)
+
+        self.pool.save(self.path, "2026-01-03")
+        self.assertEqual(os.path.getsize(self.journal), 0)
+        self.assertEqual(len(self.pool), 13)
+
+
+class PermutationTest(unittest.TestCase):
+    def test_every_middle_is_hit_exactly_once(self):
+        key = bytes(32)
+        outputs = [permute_middle(key, value, radix=100) for value in range(10000)]
+        self.assertEqual(sorted(outputs), list(range(10000)))
+        self.assertNotEqual(outputs[:20], list(range(20)))
+
+    def test_the_key_changes_the_order(self):
+        self.assertNotEqual([permute_middle(bytes(32), value) for value in range(10)],
+                            [permute_middle(b"\x01" * 32, value) for value in range(10)])
+
+
+class CardAllocatorTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "card_allocator.bin")
+
+    def open(self):
+        allocator = CardAllocator(self.path)
+        self.addCleanup(allocator.close)
+        return allocator
+
+    def test_reopened_allocator_continues_the_sequence(self):
+        allocator = self.open()
+        first = [allocator.take() for _ in range(100)]
+        allocator.close()
+        second = [self.open().take() for _ in range(1)]
+        self.assertEqual(len(set(first + second)), 101)
+        self.assertTrue(all(card_middle(card) is not None for card in first + second))
+
+    def test_journal_restores_a_lost_counter(self):
+        allocator = self.open()
+        taken = {allocator.take() for _ in range(5)}
+        with open(self.path, "r+b") as f:  # As if the process died before compacting
+            f.seek(torcoin_cards.ALLOCATOR_COUNTER_OFFSET)
+            f.write(torcoin_cards.POOL_CURSOR.pack(0))
+        reopened = CardAllocator(self.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(len(reopened), torcoin_cards.CARD_MIDDLE_RANGE - 5)
+        self.assertNotIn(reopened.take(), taken)
+
+    def test_excluded_cards_are_skipped_until_exhausted(self):
+        with mock.patch.multiple(torcoin_cards, CARD_MIDDLE_RANGE=100, FEISTEL_RADIX=10):
+            allocator = self.open()
+            issued = {allocator.take() for _ in range(10)}
+            pool = CardPool()
+            pool.load(range(50))
+            cards = list(iter(lambda: allocator.take(issued, pool), None))
+            self.assertIsNone(allocator.take())
+        self.assertEqual(sorted(card_middle(card) for card in cards),
+                         sorted(set(range(50, 100)) - {card_middle(card) for card in issued}))
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not an allocator")
+        with self.assertRaises(ValueError):
+            CardAllocator(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Behaviour checks for the single-process launcher."""
+
+import asyncio
+import functools
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+import coin_server
+import torcoin_cache
+import torcoin_launcher
+import torcoin_proxy
+
+
+class MemoryStreamTest(unittest.TestCase):
+    def test_bytes_and_eof_cross_the_pair(self):
+        async def run():
+            (client_reader, client_writer), (server_reader, server_writer) = \
+                torcoin_launcher.memory_stream_pair()
+            client_writer.write(b"ping")
+            await client_writer.drain()
+            self.assertEqual(await server_reader.readexactly(4), b"ping")
+            server_writer.write(b"pong")
+            server_writer.close()
+            await server_writer.wait_closed()
+            self.assertEqual(await client_reader.read(), b"pong")
+            self.assertEqual(client_writer.get_extra_info("peername"),
+                             torcoin_launcher.IN_PROCESS_PEER)
+        asyncio.run(run())
+
+    def test_full_reader_pauses_the_writer(self):
+        async def run():
+            (_, client_writer), (server_reader, _) = torcoin_launcher.memory_stream_pair()
+            client_writer.write(b"x" * (1 << 20))
+            drain = asyncio.ensure_future(client_writer.drain())
+            await asyncio.sleep(0)
+            self.assertFalse(drain.done())
+            await server_reader.readexactly(1 << 20)
+            await asyncio.wait_for(drain, 5)
+        asyncio.run(run())
+
+
+class InProcessProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        path = os.path.join(self.tmp.name, "page.html")
+        with open(path, "wb") as f:
+            f.write(b"<html>coin</html>")
+        # Nothing listens on port 1: every response must come from in-process
+        for target, name, value in (
+                (coin_server, "PAGE_CACHE", coin_server.PageCache(path, stat_interval=0)),
+                (torcoin_proxy, "TARGET_FILTER", torcoin_proxy.TargetFilter(
+                    ["127.0.0.1:1"], "http://127.0.0.1:1")),
+                (torcoin_proxy, "BACKENDS", torcoin_proxy.BackendPool([("127.0.0.1", 1)])),
+                (torcoin_proxy, "RESPONSE_CACHE", torcoin_cache.ResponseCache(max_bytes=0)),
+                (torcoin_proxy, "log_message", lambda *args, **fields: None)):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def exchange(self, raw):
+        async def run():
+            in_process = torcoin_launcher.InProcessServer(
+                asyncio.get_running_loop(), coin_server.handle_async_connection)
+            self.assertEqual(torcoin_launcher.attach_in_process_backend(in_process, 1), 1)
+            server = await asyncio.start_server(
+                torcoin_proxy.handle_proxy_connection, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(raw)
+                await writer.drain()
+                data = await asyncio.wait_for(reader.read(), 5)
+                writer.close()
+                torcoin_proxy.BACKENDS.close()
+                return data
+        return asyncio.run(run())
+
+    def statuses(self, data):
+        return [int(status) for status in re.findall(rb"HTTP/1\.1 (\d{3}) ", data)]
+
+    def test_requests_reach_the_server_without_tcp(self):
+        data = self.exchange(b"GET http://127.0.0.1:1/ HTTP/1.1\r\n\r\n"
+                             b"GET http://127.0.0.1:1/ HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual(self.statuses(data), [200, 200])
+        self.assertEqual(data.count(b"<html>coin</html>"), 2)
+
+    def test_cache_fills_from_worker_threads_use_a_socketpair(self):
+        with mock.patch.object(torcoin_proxy, "RESPONSE_CACHE", torcoin_cache.ResponseCache()):
+            data = self.exchange(b"GET http://127.0.0.1:1/ HTTP/1.1\r\n"
+                                 b"Connection: close\r\n\r\n")
+        self.assertEqual(self.statuses(data), [200])
+        self.assertIn(b"<html>coin</html>", data)
+
+
+class TestRoleTest(unittest.TestCase):
+    def test_page_cache_and_location_are_per_role(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "test.html")
+        with open(path, "wb") as f:
+            f.write(b"<html>test</html>")
+        handler = functools.partial(coin_server.handle_async_connection,
+                                    page_cache=coin_server.PageCache(path, stat_interval=0),
+                                    location="http://127.0.0.1:9/")
+
+        async def run():
+            (reader, writer), server = torcoin_launcher.memory_stream_pair()
+            task = asyncio.ensure_future(handler(*server))
+            writer.write(b"GET / HTTP/1.1\r\n\r\nGET /other HTTP/1.1\r\n"
+                         b"Connection: close\r\n\r\n")
+            data = await asyncio.wait_for(reader.read(), 5)
+            await task
+            return data
+        data = asyncio.run(run())
+        self.assertIn(b"<html>test</html>", data)
+        self.assertIn(b"Location: http://127.0.0.1:9/", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Behaviour checks for the shared access log."""
+
+import json
+import os
+import tempfile
+import unittest
+
+from torcoin_logging import AccessLog
+
+
+class AccessLogTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "access.log")
+
+    def records(self, path=None):
+        with open(path or self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_are_json_lines(self):
+        log = AccessLog("coin_server", path=self.path)
+        log.access(200, method="GET", path="/")
+        log.message("error", "code %d, message %s", 404, "Not found", remote="10.0.0.1")
+        log.close()
+
+        access, message = self.records()
+        self.assertEqual(access["kind"], "access")
+        self.assertEqual((access["status"], access["path"], access["service"]),
+                         (200, "/", "coin_server"))
+        self.assertEqual(message["msg"], "code 404, message Not found")
+        self.assertEqual((message["level"], message["remote"]), ("error", "10.0.0.1"))
+        self.assertRegex(access["ts"], r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}$")
+
+    def test_sampling_only_drops_successes(self):
+        log = AccessLog(path=self.path, sample_rate=0.0)
+        for status in (200, 304, 404, 503):
+            log.access(status)
+        log.message("info", "per-request line", sampled=True)
+        log.message("warning", "always kept")
+        log.close()
+
+        self.assertEqual([r.get("status") for r in self.records()], [404, 503, None])
+        self.assertEqual(log.sampled_out, 3)
+
+    def test_size_rotation_keeps_backups(self):
+        log = AccessLog(path=self.path, max_bytes=1, backups=2)
+        for index in range(4):
+            log.access(200, n=index)
+            log.close()  # One write, hence one rotation check, per record
+
+        self.assertEqual([r["n"] for r in self.records()], [3])
+        self.assertEqual([r["n"] for r in self.records(self.path + ".1")], [2])
+        self.assertEqual([r["n"] for r in self.records(self.path + ".2")], [1])
+        self.assertFalse(os.path.exists(self.path + ".3"))
+
+    def test_time_rotation(self):
+        log = AccessLog(path=self.path, rotate_interval=0)
+        log.access(200, n=1)
+        log.close()
+        log.access(200, n=2)
+        log.close()
+        self.assertEqual([r["n"] for r in self.records(self.path + ".1")], [1])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        log = AccessLog(path=self.path, queue_size=1)
+        log._writer = object()  # Pretend the writer is running but stalled
+        log.access(500)
+        log.access(500)
+        self.assertEqual(log.dropped, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Behaviour checks for the shared metrics registry and endpoint."""
+
+import http.client
+import threading
+import unittest
+from unittest import mock
+
+import torcoin_metrics
+from torcoin_metrics import HISTOGRAM_BOUNDS, Registry, bucket_index
+
+
+class BucketTest(unittest.TestCase):
+    def test_values_land_in_the_bucket_bounding_them(self):
+        for value in (0.0001, 0.0013, 0.02, 0.25, 0.3, 1.0, 7.5, 40.0):
+            index = bucket_index(value)
+            self.assertLessEqual(value, HISTOGRAM_BOUNDS[index])
+            if index:
+                self.assertGreaterEqual(value, HISTOGRAM_BOUNDS[index - 1])
+
+    def test_out_of_range_values_are_clamped(self):
+        self.assertEqual(bucket_index(0), 0)
+        self.assertEqual(bucket_index(1e-9), 0)
+        self.assertEqual(bucket_index(1e6), len(HISTOGRAM_BOUNDS))
+
+    def test_relative_error_is_bounded(self):
+        # Four sub-buckets per power of two: a bound is within 25% of its values
+        for index in range(1, len(HISTOGRAM_BOUNDS)):
+            self.assertLessEqual(HISTOGRAM_BOUNDS[index] / HISTOGRAM_BOUNDS[index - 1], 1.25)
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_shards_are_summed(self):
+        counter = self.registry.counter("requests_total", "Requests", ("route",))
+
+        def record():
+            for _ in range(1000):
+                counter.inc("/")
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc("other", amount=5)
+
+        self.assertEqual(counter.values(), {("/",): 4000, ("other",): 5})
+        self.assertEqual(len(counter._shards), 5)
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency", ("route",))
+        for value in (0.001, 0.002, 0.5):
+            histogram.observe(value, "/")
+        text = self.registry.render().decode()
+
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{route="/",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{route="/"} 3', text)
+        self.assertIn('latency_seconds_sum{route="/"} 0.503', text)
+        below_half = [line for line in text.splitlines()
+                      if line.startswith('latency_seconds_bucket{route="/",le="0.4375"}')]
+        self.assertEqual(below_half, ['latency_seconds_bucket{route="/",le="0.4375"} 2'])
+
+    def test_gauges_are_read_at_scrape_time(self):
+        depth = [3]
+        self.registry.gauge("queue_depth", "Queued", lambda: depth[0])
+        self.registry.gauge("healthy", "Health", lambda: [(("a:1",), 1), (("b\"2",), 0)],
+                            ("backend",))
+        depth[0] = 7
+        text = self.registry.render().decode()
+        self.assertIn("queue_depth 7\n", text)
+        self.assertIn('healthy{backend="a:1"} 1\n', text)
+        self.assertIn('healthy{backend="b\\"2"} 0\n', text)
+
+    def test_duplicate_names_are_rejected(self):
+        self.registry.counter("x_total", "X")
+        with self.assertRaises(ValueError):
+            self.registry.counter("x_total", "X again")
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    def test_endpoint_is_local_and_serves_only_metrics(self):
+        with mock.patch.object(torcoin_metrics.METRICS, "enabled", False):
+            server = torcoin_metrics.start_metrics_server(0)
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            self.assertTrue(torcoin_metrics.METRICS.enabled)
+        host, port = server.server_address
+        self.assertEqual(host, "127.0.0.1")
+
+        responses = []
+        for path in ("/metrics", "/"):
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request("GET", path)
+            response = conn.getresponse()
+            responses.append((response.status, response.getheader("Content-Type"),
+                              response.read()))
+            conn.close()
+        self.assertEqual(responses[0][:2], (200, torcoin_metrics.METRICS_CONTENT_TYPE))
+        self.assertEqual(responses[1][0], 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+TorCOIN Proxy Response Cache
+In-memory HTTP cache used by torcoin_proxy: LRU byte budget, keys that follow
+the upstream's Vary header, Cache-Control/ETag revalidation,
+stale-while-revalidate and collapsing of concurrent identical fetches.
+"""
+
+import collections
+import email.utils
+import threading
+import time
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # Total bytes of cached responses
+CACHE_MAX_OBJECT_SIZE = 4 * 1024 * 1024  # Largest single response kept
+CACHE_PASS_TTL = 60  # Seconds a URL with an uncacheable body bypasses the cache
+CACHEABLE_STATUSES = frozenset([200, 203, 301, 404, 410])
+# Headers repeated on a 304 answered from the cache
+NOT_MODIFIED_HEADERS = frozenset([
+    'cache-control', 'content-location', 'date', 'etag', 'expires',
+    'last-modified', 'vary',
+])
+
+def header_value(headers, name):
+    """Return the first value of ``name`` in a (header, value) list, or None."""
+    name = name.lower()
+    for header, value in headers:
+        if header.lower() == name:
+            return value
+    return None
+
+def parse_cache_control(value):
+    """Return Cache-Control directives as a {name: argument} dict."""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.strip().lower()] = argument.strip().strip('"')
+    return directives
+
+def directive_seconds(directives, name):
+    """Return a delta-seconds directive as an int, or None if absent/invalid."""
+    value = directives.get(name, "")
+    return int(value) if value.isascii() and value.isdigit() else None
+
+def vary_names(headers):
+    """Return the lower-cased request header names a response varies on."""
+    value = ",".join(v for h, v in headers if h.lower() == 'vary')
+    return tuple(sorted({name.strip().lower() for name in value.split(",") if name.strip()}))
+
+def vary_values(request_headers, names):
+    """Return the request's (normalised) values for the Vary header names."""
+    values = []
+    for name in names:
+        value = ",".join(v for h, v in request_headers if h.lower() == name)
+        values.append(" ".join(value.split()))
+    return tuple(values)
+
+def request_cache_mode(request_headers):
+    """Classify a request: "bypass", "revalidate" or "normal"."""
+    if header_value(request_headers, 'Authorization') is not None:
+        return "bypass"
+    directives = parse_cache_control(header_value(request_headers, 'Cache-Control'))
+    if 'no-store' in directives:
+        return "bypass"
+    if 'no-cache' in directives or directive_seconds(directives, 'max-age') == 0 or \
+            (header_value(request_headers, 'Pragma') or "").strip().lower() == 'no-cache':
+        return "revalidate"
+    return "normal"
+
+def is_storable(status, headers):
+    """Whether a GET response may be stored by a shared cache."""
+    if status not in CACHEABLE_STATUSES:
+        return False
+    directives = parse_cache_control(header_value(headers, 'Cache-Control'))
+    if 'no-store' in directives or 'private' in directives:
+        return False
+    if '*' in vary_names(headers) or header_value(headers, 'Set-Cookie') is not None:
+        return False
+    # Without freshness or a validator the entry could never be reused
+    return 's-maxage' in directives or 'max-age' in directives or \
+        header_value(headers, 'ETag') is not None or \
+        header_value(headers, 'Last-Modified') is not None
+
+class CachedResponse:
+    """A buffered upstream response and its freshness information."""
+
+    def __init__(self, status, reason, headers, body, request_headers):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.vary = vary_names(headers)
+        self.vary_values = vary_values(request_headers, self.vary)
+        self.refresh(headers)
+
+    def refresh(self, headers):
+        """(Re)compute headers and freshness, e.g. after a 304 revalidation."""
+        self.headers = list(headers)
+        self.size = len(self.body) + sum(len(h) + len(v) for h, v in self.headers)
+        self.stored_at = time.monotonic()
+        self.etag = header_value(headers, 'ETag')
+        self.last_modified = header_value(headers, 'Last-Modified')
+
+        directives = parse_cache_control(header_value(headers, 'Cache-Control'))
+        max_age = directive_seconds(directives, 's-maxage')
+        if max_age is None:
+            max_age = directive_seconds(directives, 'max-age')
+        must_revalidate = 'no-cache' in directives or 'must-revalidate' in directives \
+            or 'proxy-revalidate' in directives
+        self.max_age = 0 if max_age is None or 'no-cache' in directives else max_age
+        self.stale_while_revalidate = 0 if must_revalidate else \
+            directive_seconds(directives, 'stale-while-revalidate') or 0
+
+    def revalidated(self, not_modified_headers):
+        """Merge the headers of a 304 into the entry and restart its lifetime."""
+        updated = {h.lower() for h, _ in not_modified_headers} - {'content-length'}
+        headers = [(h, v) for h, v in self.headers if h.lower() not in updated]
+        headers += [(h, v) for h, v in not_modified_headers if h.lower() in updated]
+        self.refresh(headers)
+
+    def matches(self, request_headers):
+        """Whether this response was negotiated for the same Vary values."""
+        return vary_values(request_headers, self.vary) == self.vary_values
+
+    def age(self, now=None):
+        return (time.monotonic() if now is None else now) - self.stored_at
+
+    def is_fresh(self, now=None):
+        return self.age(now) < self.max_age
+
+    def is_usable_stale(self, now=None):
+        """Stale, but within its stale-while-revalidate window."""
+        return self.age(now) < self.max_age + self.stale_while_revalidate
+
+    def validators(self):
+        """Conditional request headers that revalidate this entry."""
+        headers = []
+        if self.etag:
+            headers.append(('If-None-Match', self.etag))
+        if self.last_modified:
+            headers.append(('If-Modified-Since', self.last_modified))
+        return headers
+
+    def is_not_modified(self, request_headers):
+        """Whether the client's own conditional headers match this entry."""
+        if self.status != 200:
+            return False
+        if_none_match = header_value(request_headers, 'If-None-Match')
+        if if_none_match is not None:
+            if not self.etag:
+                return False
+            etag = self.etag.removeprefix("W/")
+            return any(tag.strip() == "*" or tag.strip().removeprefix("W/") == etag
+                       for tag in if_none_match.split(","))
+
+        if_modified_since = header_value(request_headers, 'If-Modified-Since')
+        if if_modified_since and self.last_modified:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+                modified = email.utils.parsedate_to_datetime(self.last_modified)
+                return modified <= since
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def response_headers(self, not_modified=False):
+        """Headers to send for this entry, including its current Age."""
+        headers = self.headers
+        if not_modified:
+            headers = [(h, v) for h, v in headers if h.lower() in NOT_MODIFIED_HEADERS]
+        return headers + [('Age', str(int(self.age())))]
+
+class Flight:
+    """One upstream fetch that concurrent identical requests wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class ResponseCache:
+    """Thread-safe LRU cache of CachedResponse objects bounded by total bytes.
+
+    Entries are keyed on (method, URL, values of the Vary headers); the Vary
+    names of the most recent response for a URL decide which request headers
+    take part in its key.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_object_size=CACHE_MAX_OBJECT_SIZE):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.size = 0
+        self._entries = collections.OrderedDict()  # key -> (CachedResponse, size)
+        self._vary = {}  # url -> Vary header names
+        self._flights = {}  # key -> Flight
+        self._passes = {}  # url -> time until which the cache is bypassed
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, url, request_headers, method="GET"):
+        """Return the cache key a request maps to."""
+        names = self._vary.get(url, ())
+        return (method, url, names, vary_values(request_headers, names))
+
+    def lookup(self, url, request_headers, method="GET"):
+        """Return (key, entry); entry is None on a miss."""
+        with self._lock:
+            key = self.key(url, request_headers, method)
+            stored = self._entries.get(key)
+            if stored is None:
+                return key, None
+            self._entries.move_to_end(key)
+            return key, stored[0]
+
+    def store(self, url, entry, method="GET"):
+        """Insert (or re-account) an entry, evicting least recently used ones."""
+        if entry.size > min(self.max_object_size, self.max_bytes):
+            return
+        with self._lock:
+            self._vary[url] = entry.vary
+            key = (method, url, entry.vary, entry.vary_values)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (entry, entry.size)
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.size -= size
+
+    def begin(self, key):
+        """Start or join the fetch for ``key``; return (is_leader, flight)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return False, flight
+            flight = self._flights[key] = Flight()
+            return True, flight
+
+    def finish(self, key, result=None):
+        """Publish the leader's result and wake everyone waiting on ``key``."""
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight.result = result
+            flight.done.set()
+
+    def mark_pass(self, url, ttl=CACHE_PASS_TTL):
+        """Bypass the cache for ``url`` for a while (e.g. its body is too big)."""
+        with self._lock:
+            self._passes[url] = time.monotonic() + ttl
+
+    def is_pass(self, url):
+        until = self._passes.get(url)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        with self._lock:
+            self._passes.pop(url, None)
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vary.clear()
+            self._passes.clear()
+            self.size = 0
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+TorCOIN Virtual Card Numbers
+Bulk generation of unique 8948XXXXXXXX2241 card numbers for the wallet's
+VirtualCardAI. The wallet issues cards from a CardAllocator, which runs a
+persisted counter through a keyed Feistel permutation of the middles. Older
+wallets kept a CardPool of random middles drawn in bulk from the secrets
+module, in a memory-mapped binary file; it is still read so that cards it
+issued are never issued again. Both files record progress in a small
+append-only journal beside them.
+"""
+
+import hashlib
+import itertools
+import mmap
+import os
+import secrets
+import struct
+import threading
+import zlib
+from array import array
+
+# Card number format: CARD_PREFIX + 8 random digits + CARD_SUFFIX
+CARD_PREFIX = "8948"
+CARD_SUFFIX = "2241"
+CARD_MIDDLE_DIGITS = 8
+CARD_MIDDLE_RANGE = 10 ** CARD_MIDDLE_DIGITS
+# Largest multiple of CARD_MIDDLE_RANGE below 2**32: 32-bit draws at or above
+# it are rejected so that every middle is equally likely
+DRAW_LIMIT = (2 ** 32 // CARD_MIDDLE_RANGE) * CARD_MIDDLE_RANGE
+
+# Pool file layout: header, taken bitmap, then the pooled middles as native
+# unsigned 32-bit words. The header holds the magic, format version, the
+# generation date (YYYY-MM-DD), the number of middles and the cursor, the
+# count of middles already handed out.
+POOL_MAGIC = b"TORCPOOL"
+POOL_VERSION = 1
+POOL_HEADER = struct.Struct("<8sH10sII4x")  # Padded so the body stays 4-byte aligned
+POOL_CURSOR = struct.Struct("<I")
+POOL_CURSOR_OFFSET = POOL_HEADER.size - 8
+# Journal beside the pool file: one record per card taken, holding the new
+# cursor and its CRC-32 so that torn or zero-filled records are ignored
+POOL_JOURNAL_SUFFIX = ".journal"
+POOL_JOURNAL_RECORD = struct.Struct("<II")
+POOL_COMPACT_RECORDS = 1024  # Fold the journal into the pool header this often
+
+# Allocator file: magic, format version, permutation key and counter
+ALLOCATOR_MAGIC = b"TORCALLC"
+ALLOCATOR_VERSION = 1
+ALLOCATOR_HEADER = struct.Struct("<8sH32sI2x")
+ALLOCATOR_COUNTER_OFFSET = ALLOCATOR_HEADER.size - 6
+# The Feistel network works on the two halves of the middle's digits
+FEISTEL_RADIX = 10 ** (CARD_MIDDLE_DIGITS // 2)
+FEISTEL_ROUNDS = 10
+
+def format_card_number(middle):
+    """Return the full card number for an integer middle section."""
+    return f"{CARD_PREFIX}{middle:0{CARD_MIDDLE_DIGITS}d}{CARD_SUFFIX}"
+
+def card_middle(card_number):
+    """Return the integer middle of a well-formed card number, else None."""
+    if (isinstance(card_number, str) and len(card_number) == 16
+            and card_number.startswith(CARD_PREFIX) and card_number.endswith(CARD_SUFFIX)):
+        middle = card_number[len(CARD_PREFIX):-len(CARD_SUFFIX)]
+        if middle.isdigit():
+            return int(middle)
+    return None
+
+def random_middles(count):
+    """Return about ``count`` uniformly random middles from one secrets block."""
+    draws = array('I', secrets.token_bytes(4 * count))  # Unsigned 32-bit words
+    return [draw % CARD_MIDDLE_RANGE for draw in draws if draw < DRAW_LIMIT]
+
+def permute_middle(key, value, radix=FEISTEL_RADIX, rounds=FEISTEL_ROUNDS):
+    """Map ``value`` in [0, radix ** 2) to a middle in the same range, unique per value.
+
+    A balanced Feistel network over the two base-``radix`` halves: each round
+    adds a keyed BLAKE2b hash of one half to the other modulo ``radix``, which
+    can be undone, so the whole network is a permutation. Without the key the
+    order of the outputs cannot be predicted.
+    """
+    left, right = divmod(value, radix)
+    for round_index in range(rounds):
+        digest = hashlib.blake2b(bytes((round_index,)) + right.to_bytes(4, "little"),
+                                 key=key, digest_size=8).digest()
+        left, right = right, (left + int.from_bytes(digest, "little")) % radix
+    return left * radix + right
+
+def _append_journal(journal, cursor):
+    """Append ``cursor`` to a journal file and make it durable."""
+    journal.write(POOL_JOURNAL_RECORD.pack(cursor, zlib.crc32(POOL_CURSOR.pack(cursor))))
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def _replay_journal(journal, cursor, limit):
+    """Return ``cursor`` advanced past every valid record in ``journal``, up to ``limit``."""
+    journal.seek(0)
+    records = journal.read()
+    for offset in range(0, len(records) - POOL_JOURNAL_RECORD.size + 1,
+                        POOL_JOURNAL_RECORD.size):
+        logged, check = POOL_JOURNAL_RECORD.unpack_from(records, offset)
+        if check == zlib.crc32(POOL_CURSOR.pack(logged)):
+            cursor = max(cursor, min(logged, limit))
+    return cursor
+
+def generate_card_numbers(count, *exclude):
+    """Return a set of ``count`` new card numbers, none of them in the ``exclude`` sets.
+
+    Each pass draws enough middles for the cards still missing (plus a small
+    margin for rejected draws and duplicates), formats them and drops the
+    ones already taken with set differences, so a million cards take a few
+    passes rather than a million Python-level iterations.
+    """
+    cards = set()
+    while len(cards) < count:
+        missing = count - len(cards)
+        batch = {format_card_number(middle)
+                 for middle in random_middles(missing + missing // 16 + 16)}
+        batch.difference_update(cards, *exclude)
+        cards.update(itertools.islice(batch, missing))
+    return cards
+
+class CardPool:
+    """Unissued card numbers, stored as 32-bit middles instead of strings.
+
+    The pooled middles sit in an array in random order behind a cursor, so
+    taking a card just advances the cursor and only that card is formatted
+    as a string. A bitmap with one bit per possible middle (12.5 MB) marks
+    every number that is pooled or has been issued, for O(1) uniqueness
+    checks. Issued bits are kept when the pool is cleared, so a number is
+    never handed out twice.
+
+    save() writes the pool to a fixed-width binary file and open() serves
+    it from there through mmap: the array and bitmap become views of the
+    file, opening reads only the header, and take() stores the new cursor
+    in the mapped header instead of rewriting the file. Growing the pool
+    (fill, load, clear) copies it back into memory until the next save().
+
+    The mapped header is only written back by the OS, so each take() also
+    appends an fsynced 8-byte record to a journal beside the pool file.
+    Every POOL_COMPACT_RECORDS cards (and on open or close) the header is
+    flushed and the journal truncated, so issuing N cards costs O(N) bytes
+    of I/O and a crash never hands out a recorded card again.
+    """
+
+    def __init__(self):
+        self._middles = array('I')
+        self._taken = bytearray((CARD_MIDDLE_RANGE + 7) // 8)
+        self._cursor = 0  # Middles before the cursor have been handed out
+        self._map = None  # mmap of the pool file while serving from it
+        self._views = []
+        self._journal = None  # Append-only file of cursors since the last compaction
+        self._journal_records = 0
+        self._lock = threading.Lock()  # The wallet refills from a background thread
+
+    def __len__(self):
+        return len(self._middles) - self._cursor
+
+    def _claim(self, middle):
+        """Mark ``middle`` taken; return False if it already was."""
+        index, bit = middle >> 3, 1 << (middle & 7)
+        if self._taken[index] & bit:
+            return False
+        self._taken[index] |= bit
+        return True
+
+    def _unmap(self):
+        """Release the pool file's mapping; callers must replace the buffers."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _detach(self):
+        """Copy a mapped pool into memory so that it can change size.
+
+        The cursor is kept, so journal records still match the pool file.
+        """
+        if self._map is not None:
+            taken = bytearray(self._taken)
+            middles = array('I', self._middles.tobytes())
+            self._unmap()
+            self._taken, self._middles = taken, middles
+
+    def _log(self):
+        """Append the cursor to the journal and make it durable."""
+        _append_journal(self._journal, self._cursor)
+        self._journal_records += 1
+        if self._map is not None and self._journal_records >= POOL_COMPACT_RECORDS:
+            self._compact()
+
+    def _compact(self):
+        """Flush the mapped header cursor to disk and empty the journal."""
+        POOL_CURSOR.pack_into(self._map, POOL_CURSOR_OFFSET, self._cursor)
+        self._map.flush()
+        self._journal.truncate(0)
+        os.fsync(self._journal.fileno())
+        self._journal_records = 0
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            self._journal_records = 0
+
+    def is_taken(self, card_number):
+        """Return True if the card is pooled or has been issued."""
+        middle = card_middle(card_number)
+        return middle is not None and bool(self._taken[middle >> 3] & (1 << (middle & 7)))
+
+    __contains__ = is_taken  # Lets a pool be passed as an exclude set
+
+    def mark_issued(self, card_number):
+        """Record a card issued outside the pool so it is never pooled."""
+        middle = card_middle(card_number)
+        if middle is not None:
+            with self._lock:
+                self._claim(middle)
+
+    def fill(self, count):
+        """Add ``count`` new random cards; return how many were added."""
+        added = 0
+        with self._lock:
+            self._detach()
+            while added < count:
+                missing = count - added
+                for middle in random_middles(missing + missing // 16 + 16):
+                    if self._claim(middle):
+                        self._middles.append(middle)
+                        added += 1
+                        if added == count:
+                            break
+        return added
+
+    def load(self, middles):
+        """Replace the pooled cards with ``middles`` (e.g. a legacy JSON pool)."""
+        self.clear()
+        with self._lock:
+            for middle in middles:
+                if 0 <= middle < CARD_MIDDLE_RANGE and self._claim(middle):
+                    self._middles.append(middle)
+
+    def take(self):
+        """Remove and return one pooled card number, or None if the pool is empty."""
+        with self._lock:
+            if self._cursor >= len(self._middles):
+                return None
+            middle = self._middles[self._cursor]
+            self._cursor += 1
+            if self._map is not None:
+                POOL_CURSOR.pack_into(self._map, POOL_CURSOR_OFFSET, self._cursor)
+            if self._journal is not None:
+                self._log()
+            return format_card_number(middle)
+
+    def clear(self):
+        """Drop every pooled card; issued cards stay marked."""
+        with self._lock:
+            self._detach()
+            self._close_journal()  # Its cursors no longer describe the pool
+            taken = self._taken
+            for middle in self._middles[self._cursor:]:
+                taken[middle >> 3] &= ~(1 << (middle & 7))
+            self._middles = array('I')
+            self._cursor = 0
+
+    def middles(self):
+        """Return a copy of the pooled middles, in pool order."""
+        with self._lock:
+            return array('I', self._middles[self._cursor:].tobytes())
+
+    def save(self, path, generation):
+        """Write the pool to ``path``, stamped with ``generation``, and serve it from there.
+
+        The file is written beside ``path`` and renamed over it, so a crash
+        leaves either the old pool or the new one.
+        """
+        with self._lock:
+            self._detach()
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(POOL_HEADER.pack(POOL_MAGIC, POOL_VERSION, generation.encode("ascii"),
+                                         len(self._middles) - self._cursor, 0))
+                f.write(self._taken)
+                f.write(self._middles[self._cursor:].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            # A crash before the truncation replays old cursors over the new
+            # pool, which only skips cards
+            self._close_journal()
+            with open(path + POOL_JOURNAL_SUFFIX, "wb") as f:
+                os.fsync(f.fileno())
+            self._open(path)
+
+    def close(self):
+        """Compact the journal and release the pool file; the pool is empty afterwards."""
+        with self._lock:
+            if self._map is not None and self._journal is not None:
+                self._compact()
+            self._close_journal()
+            self._unmap()
+            self._taken = bytearray((CARD_MIDDLE_RANGE + 7) // 8)
+            self._middles, self._cursor = array('I'), 0
+
+    def open(self, path):
+        """Serve the pool from a file written by save(); return its generation date.
+
+        Only the header and the journal are read: the bitmap and middles are
+        paged in from the mapping as they are used. Raises ValueError if
+        ``path`` is not a pool file, leaving the pool unchanged.
+        """
+        with self._lock:
+            return self._open(path)
+
+    def _open(self, path):
+        with open(path, "r+b") as f:
+            mapped = mmap.mmap(f.fileno(), 0)  # The mapping outlives the file object
+        bitmap_end = POOL_HEADER.size + (CARD_MIDDLE_RANGE + 7) // 8
+        try:
+            magic, version, generation, count, cursor = POOL_HEADER.unpack_from(mapped)
+        except struct.error:  # Shorter than a header
+            magic = None
+        if (magic != POOL_MAGIC or version != POOL_VERSION
+                or len(mapped) != bitmap_end + 4 * count or cursor > count):
+            mapped.close()
+            raise ValueError(f"{path} is not a card pool file")
+        journal = open(path + POOL_JOURNAL_SUFFIX, "a+b")
+        cursor = _replay_journal(journal, cursor, count)
+        self._close_journal()
+        self._unmap()
+        data = memoryview(mapped)
+        taken, body = data[POOL_HEADER.size:bitmap_end], data[bitmap_end:]
+        middles = body.cast('I')
+        self._views = [data, taken, body, middles]
+        self._map, self._taken, self._middles, self._cursor = mapped, taken, middles, cursor
+        self._journal = journal
+        if journal.tell():
+            self._compact()
+        return generation.decode("ascii")
+
+class CardAllocator:
+    """Card numbers from a keyed permutation of a persisted counter.
+
+    The n-th card is ``permute_middle(key, n)``: unique because the Feistel
+    network is a permutation of the middles, unpredictable without the key,
+    and computed in O(1) time and memory, so nothing is generated ahead of
+    time. The key and counter live in a small file at ``path``, created with
+    a fresh random key on first use. Like CardPool's cursor, the counter is
+    appended to a journal beside the file on every take() and folded into
+    the file every POOL_COMPACT_RECORDS cards and on close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(ALLOCATOR_HEADER.pack(ALLOCATOR_MAGIC, ALLOCATOR_VERSION,
+                                              secrets.token_bytes(32), 0))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        self._file = open(path, "r+b")
+        header = self._file.read()
+        try:
+            magic, version, self._key, counter = ALLOCATOR_HEADER.unpack(header)
+        except struct.error:  # Wrong size
+            magic = None
+        if magic != ALLOCATOR_MAGIC or version != ALLOCATOR_VERSION:
+            self._file.close()
+            raise ValueError(f"{path} is not a card allocator file")
+        self._journal = open(path + POOL_JOURNAL_SUFFIX, "a+b")
+        self._counter = _replay_journal(self._journal, counter, CARD_MIDDLE_RANGE)
+        self._journal_records = 0
+        self._lock = threading.Lock()  # Cards can be issued from several threads
+        if self._journal.tell():
+            self._compact()
+
+    def __len__(self):
+        return CARD_MIDDLE_RANGE - self._counter
+
+    def _compact(self):
+        """Write the counter into the allocator file and empty the journal."""
+        self._file.seek(ALLOCATOR_COUNTER_OFFSET)
+        self._file.write(POOL_CURSOR.pack(self._counter))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._journal.truncate(0)
+        os.fsync(self._journal.fileno())
+        self._journal_records = 0
+
+    def take(self, *exclude):
+        """Return the next card number not in any ``exclude`` set, or None when all are used."""
+        with self._lock:
+            start = self._counter
+            card_number = None
+            while self._counter < CARD_MIDDLE_RANGE:
+                candidate = format_card_number(
+                    permute_middle(self._key, self._counter, FEISTEL_RADIX))
+                self._counter += 1
+                if not any(candidate in taken for taken in exclude):
+                    card_number = candidate
+                    break
+            if self._counter != start:
+                _append_journal(self._journal, self._counter)
+                self._journal_records += 1
+                if self._journal_records >= POOL_COMPACT_RECORDS:
+                    self._compact()
+            return card_number
+
+    def close(self):
+        """Fold the journal into the allocator file and close both."""
+        with self._lock:
+            if not self._file.closed:
+                self._compact()
+                self._journal.close()
+                self._file.close()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+TorCOIN Launcher
+Runs the coin server, the proxy and the test server in one process: one
+asyncio event loop, one shared worker pool and one set of logs and metrics.
+The proxy hands requests to the in-process coin server over in-memory
+streams instead of a loopback TCP connection.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import http.client
+import socket
+import sys
+
+import coin_server
+import test_server
+import torcoin_proxy
+from torcoin_logging import add_logging_arguments, configure_logging
+from torcoin_metrics import add_metrics_arguments, start_metrics_server
+
+try:
+    import uvloop  # Optional faster event loop
+except ImportError:
+    uvloop = None
+
+# Configuration
+ROLES = ("server", "proxy", "test")
+DEFAULT_ROLES = "server,proxy"
+DEFAULT_THREADS = 32  # Shared worker pool: page reloads and proxy cache fills
+TEST_PORT = coin_server.PORT + 1  # The test server's own port (50129) is the coin server's
+LOCAL_HOSTS = frozenset(("127.0.0.1", "localhost", "::1", "0.0.0.0", ""))
+IN_PROCESS_PEER = ("in-process", 0)  # peername reported on in-memory streams
+
+class MemoryTransport(asyncio.Transport):
+    """One end of an in-memory byte stream between two asyncio protocols.
+
+    Writes go straight to the peer's protocol. When the peer's StreamReader
+    buffer fills up it pauses reading, which pauses this end's writer, so
+    drain() applies back-pressure exactly as on a socket.
+    """
+
+    def __init__(self, loop, protocol):
+        super().__init__({'peername': IN_PROCESS_PEER, 'sockname': IN_PROCESS_PEER})
+        self._loop = loop
+        self._protocol = protocol
+        self._peer = None
+        self._closing = False
+
+    def write(self, data):
+        if not self._closing and not self._peer._closing:
+            self._peer._protocol.data_received(data)
+
+    def write_eof(self):
+        if not self._closing and not self._peer._closing:
+            self._peer._protocol.eof_received()
+
+    def can_write_eof(self):
+        return True
+
+    def close(self):
+        """Close this end; the peer reads EOF, as after a TCP FIN."""
+        if self._closing:
+            return
+        self._closing = True
+        if not self._peer._closing:
+            self._peer._protocol.eof_received()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def is_closing(self):
+        return self._closing
+
+    def pause_reading(self):
+        if not self._peer._closing:
+            self._peer._protocol.pause_writing()
+
+    def resume_reading(self):
+        if not self._peer._closing:
+            self._peer._protocol.resume_writing()
+
+    def is_reading(self):
+        return not self._closing
+
+    def get_write_buffer_size(self):
+        return 0  # Nothing is buffered on the writing side
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+def memory_stream_pair():
+    """Return two connected (reader, writer) pairs on the running loop."""
+    loop = asyncio.get_running_loop()
+    ends = []
+    for _ in range(2):
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        ends.append((reader, protocol, MemoryTransport(loop, protocol)))
+    (reader_a, protocol_a, transport_a), (reader_b, protocol_b, transport_b) = ends
+    transport_a._peer, transport_b._peer = transport_b, transport_a
+    protocol_a.connection_made(transport_a)
+    protocol_b.connection_made(transport_b)
+    return ((reader_a, asyncio.StreamWriter(transport_a, protocol_a, reader_a, loop)),
+            (reader_b, asyncio.StreamWriter(transport_b, protocol_b, reader_b, loop)))
+
+class InProcessServer:
+    """Accepts in-process connections for an asyncio connection handler.
+
+    Event loop callers get in-memory streams. Worker threads (the proxy's
+    cache fills use blocking http.client) get one end of a socketpair whose
+    other end is served on the loop, which still avoids the TCP stack.
+    """
+
+    def __init__(self, loop, handler):
+        self.loop = loop
+        self.handler = handler
+        self._tasks = set()  # Strong references to running handler tasks
+
+    def _serve(self, reader, writer):
+        task = self.loop.create_task(self.handler(reader, writer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def open_connection(self, host=None, port=None):
+        """AsyncUpstreamPool.connection_factory: return (reader, writer)."""
+        client, server = memory_stream_pair()
+        self._serve(*server)
+        return client
+
+    async def _serve_socket(self, sock):
+        self._serve(*await asyncio.open_connection(sock=sock))
+
+    def http_connection(self, host, port, timeout=None):
+        """UpstreamConnectionPool.connection_factory: return an HTTPConnection."""
+        return InProcessHTTPConnection(self, host, port, timeout=timeout)
+
+class InProcessHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to an InProcessServer, for use from worker threads."""
+
+    def __init__(self, server, host, port, timeout=None):
+        super().__init__(host, port, timeout=timeout)
+        self.server = server
+
+    def connect(self):
+        self.sock, served = socket.socketpair()
+        self.sock.settimeout(self.timeout)
+        asyncio.run_coroutine_threadsafe(self.server._serve_socket(served), self.server.loop)
+
+def attach_in_process_backend(server, port):
+    """Route the proxy's connections to ``port`` on this host to ``server``."""
+    attached = 0
+    for backend in torcoin_proxy.BACKENDS.backends:
+        if backend.port == port and backend.host in LOCAL_HOSTS:
+            backend.pool.connection_factory = server.http_connection
+            backend.async_pool.connection_factory = server.open_connection
+            attached += 1
+    return attached
+
+async def serve(args):
+    """Start every requested role on the running loop and serve until cancelled."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+        args.threads, thread_name_prefix="torcoin-worker"))
+    servers = []
+    try:
+        if "server" in args.roles:
+            servers.append(await asyncio.start_server(
+                coin_server.handle_async_connection, coin_server.HOST_IP, coin_server.PORT,
+                backlog=coin_server.PooledTCPServer.request_queue_size))
+            print(f"[+] Coin server on {coin_server.HOST_IP}:{coin_server.PORT}")
+
+        if "test" in args.roles:
+            handler = functools.partial(
+                coin_server.handle_async_connection, page_cache=test_server.PAGE_CACHE,
+                location=f"http://{test_server.HOST_IP}:{args.test_port}/")
+            servers.append(await asyncio.start_server(handler, test_server.HOST_IP,
+                                                      args.test_port))
+            print(f"[+] Test server on {test_server.HOST_IP}:{args.test_port}")
+
+        if "proxy" in args.roles:
+            if "server" in args.roles:
+                in_process = InProcessServer(loop, coin_server.handle_async_connection)
+                if attach_in_process_backend(in_process, coin_server.PORT):
+                    print("[+] Proxy hands requests to the coin server in-process")
+            servers.append(await asyncio.start_server(
+                torcoin_proxy.handle_proxy_connection, torcoin_proxy.PROXY_HOST or None,
+                torcoin_proxy.PROXY_PORT, backlog=1024))
+            print(f"[+] Proxy on port {torcoin_proxy.PROXY_PORT} "
+                  f"(only {coin_server.PORT} is reachable through it)")
+
+        print(f"[+] {len(servers)} role(s) on one "
+              f"{'uvloop' if uvloop else 'asyncio'} event loop, {args.threads} worker threads")
+        print()
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        torcoin_proxy.BACKENDS.close()
+        for server in servers:
+            server.close()
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="TorCOIN Launcher")
+    parser.add_argument("--roles", type=lambda text: text.split(","),
+                        default=DEFAULT_ROLES.split(","),
+                        help=f"comma-separated roles to run: {', '.join(ROLES)} "
+                             f"(default: {DEFAULT_ROLES})")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="shared worker threads (default: %(default)s)")
+    parser.add_argument("--server-host", default=coin_server.HOST_IP,
+                        help="coin server address (default: %(default)s)")
+    parser.add_argument("--server-port", type=int, default=coin_server.PORT,
+                        help="coin server port (default: %(default)s)")
+    parser.add_argument("--proxy-port", type=int, default=torcoin_proxy.PROXY_PORT,
+                        help="proxy port (default: %(default)s)")
+    parser.add_argument("--test-port", type=int, default=TEST_PORT,
+                        help="test server port (default: %(default)s)")
+    parser.add_argument("--cache-size", type=int, default=torcoin_proxy.RESPONSE_CACHE.max_bytes,
+                        help="proxy response cache budget in bytes, 0 disables it "
+                             "(default: %(default)s)")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser, coin_server.METRICS_PORT)
+    args = parser.parse_args()
+    unknown = [role for role in args.roles if role not in ROLES]
+    if unknown:
+        parser.error(f"unknown roles: {', '.join(unknown)}")
+    return args
+
+def main():
+    """Main launcher function."""
+    args = parse_args()
+    configure_logging(args, "torcoin_launcher")
+
+    coin_server.HOST_IP, coin_server.PORT = args.server_host, args.server_port
+    torcoin_proxy.PROXY_PORT = args.proxy_port
+    torcoin_proxy.RESPONSE_CACHE.max_bytes = args.cache_size
+    if args.server_port != torcoin_proxy.ALLOWED_PORT:
+        # The proxy only ever forwards to the coin server hosted here
+        authority = f"127.0.0.1:{args.server_port}"
+        torcoin_proxy.TARGET_FILTER = torcoin_proxy.TargetFilter([authority],
+                                                                 f"http://{authority}")
+        torcoin_proxy.BACKENDS = torcoin_proxy.BackendPool([("127.0.0.1", args.server_port)])
+
+    print("=" * 50)
+    print("        TORCOIN LAUNCHER")
+    print("=" * 50)
+    print(f"Roles: {', '.join(args.roles)}")
+    print("Press Ctrl+C to stop")
+    print("=" * 50)
+
+    for role, cache, html_file in (("server", coin_server.PAGE_CACHE, coin_server.HTML_FILE),
+                                   ("test", test_server.PAGE_CACHE, test_server.HTML_FILE)):
+        if role in args.roles and cache.get() is None:
+            print(f"[!] Error: {html_file} not found in current directory!")
+            sys.exit(1)
+
+    if args.metrics:
+        try:
+            start_metrics_server(args.metrics_port)
+        except OSError as e:
+            print(f"[!] Cannot serve metrics on port {args.metrics_port}: {e}")
+            sys.exit(1)
+        print(f"[+] Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+
+    try:
+        if uvloop:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.run(serve(args))
+    except PermissionError:
+        print("[!] Permission denied binding a port. Use ports above 1024.")
+        sys.exit(1)
+    except OSError as e:
+        print(f"[!] Error starting launcher: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[!] Launcher stopped by user")
+
+if __name__ == "__main__":
+    main()
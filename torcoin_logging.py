@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+TorCOIN Access Logging
+Non-blocking JSON-lines logging shared by coin_server, test_server and
+torcoin_proxy. Request threads only build a dict and queue it; a writer thread
+serialises, batches and writes records, rotating log files by size and age.
+"""
+
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer; more are dropped
+LOG_BATCH_SIZE = 500  # Records written per flush
+LOG_SAMPLE_RATE = 1.0  # Fraction of successful (< 400) access records kept
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotate a log file at this size
+LOG_ROTATE_INTERVAL = 24 * 60 * 60  # ... or after this many seconds
+LOG_BACKUPS = 5  # Rotated files kept as PATH.1 .. PATH.N
+
+class AccessLog:
+    """Queue-backed structured logger.
+
+    Records are dicts; ``access`` records of successful requests are sampled
+    at ``sample_rate``, everything else is always kept. When the queue is full
+    records are dropped (and counted) rather than blocking the caller. With no
+    ``path`` records go to stdout.
+    """
+
+    def __init__(self, service="torcoin", path=None, sample_rate=LOG_SAMPLE_RATE,
+                 max_bytes=LOG_MAX_BYTES, rotate_interval=LOG_ROTATE_INTERVAL,
+                 backups=LOG_BACKUPS, queue_size=LOG_QUEUE_SIZE):
+        self.service = service
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.dropped = 0
+        self.sampled_out = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._file_size = 0
+        self._opened_at = 0.0
+        if hasattr(os, "register_at_fork"):
+            # Pre-forked workers need a writer thread of their own
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._writer = None
+        self._file = None
+        self._start_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+
+    def configure(self, **settings):
+        """Change settings such as path or sample_rate before the first record."""
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith("_"):
+                raise AttributeError(f"Unknown log setting: {name}")
+            setattr(self, name, value)
+
+    def access(self, status, **fields):
+        """Log one served request."""
+        if status < 400 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        fields["status"] = status
+        self._put("access", fields)
+
+    def message(self, level, format, *args, sampled=False, **fields):
+        """Log a free-form event; ``format % args`` is applied by the writer."""
+        if sampled and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        fields["level"] = level
+        fields["msg"] = (format, args)
+        self._put("message", fields)
+
+    def _put(self, kind, fields):
+        fields["ts"] = time.time()
+        fields["kind"] = kind
+        if self._writer is None:
+            self._start()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="access-log", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def close(self, timeout=2.0):
+        """Write out queued records and stop the writer thread."""
+        writer = self._writer
+        if writer is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        writer.join(timeout)
+        self._writer = None
+
+    def _run(self):
+        """Writer thread: serialise and write records in batches."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            lines = [self.format(record) for record in batch if record is not None]
+            if lines:
+                try:
+                    self._write("".join(lines))
+                except OSError:
+                    self.dropped += len(lines)
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def format(self, record):
+        """Turn a queued record into one JSON line."""
+        record["ts"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record["ts"])) + \
+            f".{int(record['ts'] % 1 * 1000):03d}"
+        record["service"] = self.service
+        if "msg" in record:
+            format, args = record["msg"]
+            try:
+                record["msg"] = format % args if args else format
+            except (TypeError, ValueError):
+                record["msg"] = f"{format} {args!r}"
+        return json.dumps(record, default=str) + "\n"
+
+    def _write(self, text):
+        if self.path is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            return
+
+        if self._file is None:
+            self._open()
+        if self._file_size and (self._file_size >= self.max_bytes or
+                                time.monotonic() - self._opened_at >= self.rotate_interval):
+            self._rotate()
+        self._file.write(text)
+        self._file.flush()
+        self._file_size += len(text)  # json.dumps output is ASCII
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._file_size = self._file.tell()
+        self._opened_at = time.monotonic()
+
+    def _rotate(self):
+        """Shift PATH.N-1 .. PATH to PATH.N .. PATH.1 and start a new file."""
+        self._file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+ACCESS_LOG = AccessLog()
+
+def add_logging_arguments(parser):
+    """Add the shared --access-log/--log-* options to an argument parser."""
+    parser.add_argument("--access-log", metavar="PATH",
+                        help="write JSON-lines logs to PATH instead of stdout")
+    parser.add_argument("--log-sample", type=float, default=LOG_SAMPLE_RATE,
+                        help="fraction of successful requests logged (default: %(default)s)")
+    parser.add_argument("--log-max-bytes", type=int, default=LOG_MAX_BYTES,
+                        help="rotate the log file at this size (default: %(default)s)")
+    parser.add_argument("--log-rotate-interval", type=float, default=LOG_ROTATE_INTERVAL,
+                        help="rotate the log file after this many seconds (default: %(default)s)")
+
+def configure_logging(args, service):
+    """Apply the options added by add_logging_arguments to ACCESS_LOG."""
+    ACCESS_LOG.configure(service=service, path=args.access_log, sample_rate=args.log_sample,
+                         max_bytes=args.log_max_bytes, rotate_interval=args.log_rotate_interval)
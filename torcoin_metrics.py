@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+TorCOIN Metrics
+Prometheus-format counters, gauges and latency histograms shared by
+coin_server and torcoin_proxy. Request threads only update a shard of their
+own, so recording takes no lock; shards are summed when /metrics is scraped.
+"""
+
+import http.server
+import math
+import threading
+
+METRICS_HOST = "127.0.0.1"  # The endpoint is never exposed beyond localhost
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Histograms use log-linear (HDR-style) buckets: each power of two between
+# 2**HISTOGRAM_MIN_EXPONENT and 2**HISTOGRAM_MAX_EXPONENT seconds (~61us to
+# 64s) is split into HISTOGRAM_SUB_BUCKETS equal steps.
+HISTOGRAM_MIN_EXPONENT = -14
+HISTOGRAM_MAX_EXPONENT = 6
+HISTOGRAM_SUB_BUCKETS = 4
+HISTOGRAM_BOUNDS = tuple(
+    2.0 ** exponent * (1 + (step + 1) / HISTOGRAM_SUB_BUCKETS)
+    for exponent in range(HISTOGRAM_MIN_EXPONENT, HISTOGRAM_MAX_EXPONENT)
+    for step in range(HISTOGRAM_SUB_BUCKETS))
+
+def bucket_index(value):
+    """Return the histogram bucket for ``value``; len(HISTOGRAM_BOUNDS) is +Inf."""
+    if value <= 0:
+        return 0
+    mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+    exponent -= 1
+    if exponent < HISTOGRAM_MIN_EXPONENT:
+        return 0
+    if exponent >= HISTOGRAM_MAX_EXPONENT:
+        return len(HISTOGRAM_BOUNDS)
+    step = int((mantissa * 2 - 1) * HISTOGRAM_SUB_BUCKETS)
+    return (exponent - HISTOGRAM_MIN_EXPONENT) * HISTOGRAM_SUB_BUCKETS + step
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class ShardedMetric:
+    """Base for metrics whose samples live in one dict per recording thread.
+
+    Only the owning thread writes a shard; the scraper copies each shard
+    (a single C-level operation under the GIL) and merges the copies.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def shard(self):
+        """Return the calling thread's shard, creating it on first use."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:  # Once per thread, not per sample
+                self._shards.append(shard)
+            return shard
+
+    def snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+class Counter(ShardedMetric):
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        """Return {labels: total} summed over every thread."""
+        totals = {}
+        for shard in self.snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+                for labels, value in sorted(self.values().items())]
+
+class Histogram(ShardedMetric):
+    """Distribution of durations in seconds over HISTOGRAM_BOUNDS."""
+
+    kind = "histogram"
+
+    def observe(self, value, *labels):
+        shard = self.shard()
+        cell = shard.get(labels)
+        if cell is None:
+            # One slot per bound, one for +Inf, then the running sum
+            cell = shard[labels] = [0] * (len(HISTOGRAM_BOUNDS) + 2)
+        cell[bucket_index(value)] += 1
+        cell[-1] += value
+
+    def values(self):
+        """Return {labels: (bucket counts, sum)} summed over every thread."""
+        totals = {}
+        for shard in self.snapshots():
+            for labels, cell in shard.items():
+                cell = list(cell)
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = cell
+                else:
+                    for index, value in enumerate(cell):
+                        total[index] += value
+        return {labels: (cell[:-1], cell[-1]) for labels, cell in totals.items()}
+
+    def render(self):
+        lines = []
+        for labels, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip((*HISTOGRAM_BOUNDS, "+Inf"), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:.6g}"
+                lines.append(f"{self.name}_bucket"
+                             f"{format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total!r}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Value read at scrape time from ``callback``.
+
+    The callback returns a number, or an iterable of (labels, value) pairs
+    when the gauge has label names; nothing is recorded between scrapes.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self):
+        samples = self.callback()
+        if not self.labelnames:
+            samples = [((), samples)]
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+                for labels, value in samples]
+
+class Registry:
+    """The metrics exposed by one process."""
+
+    def __init__(self):
+        self.enabled = False  # Recording is skipped until the endpoint is started
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=()):
+        return self.register(Histogram(name, help, labelnames))
+
+    def gauge(self, name, help, callback, labelnames=()):
+        return self.register(Gauge(name, help, callback, labelnames))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+METRICS = Registry()
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves METRICS at /metrics and nothing else."""
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404, "Not found")
+            return
+        body = METRICS.render()
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are periodic and would only flood the access log
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # A reloaded coin_server binds the endpoint while the old process drains
+    allow_reuse_port = True
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """Serve /metrics on ``host:port`` from a daemon thread and start recording."""
+    server = MetricsServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    METRICS.enabled = True
+    return server
+
+def add_metrics_arguments(parser, default_port):
+    """Add the shared --metrics/--metrics-port options to an argument parser."""
+    parser.add_argument("--metrics", action="store_true",
+                        help=f"serve Prometheus metrics at http://{METRICS_HOST}:PORT/metrics")
+    parser.add_argument("--metrics-port", type=int, default=default_port,
+                        help="port of the metrics endpoint (default: %(default)s)")
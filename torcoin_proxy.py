@@ -5,175 +5,1561 @@ A strict proxy that ONLY allows access to www.torcoin.cnet:50129
 Blocks all other traffic for maximum security.
 """
 
+import argparse
+import asyncio
+import bisect
+import collections
+import errno
+import functools
+import hashlib
+import http.client
 import http.server
+import itertools
+import os
+import queue
+import re
+import select
 import socketserver
-import urllib.request
-import urllib.error
 import socket
-from urllib.parse import urlparse, urljoin
+import threading
+import weakref
+from string import hexdigits
+from urllib.parse import urlparse
 import time
 
+from torcoin_cache import ResponseCache, CachedResponse, is_storable, request_cache_mode
+from torcoin_logging import ACCESS_LOG, add_logging_arguments, configure_logging
+from torcoin_metrics import METRICS, add_metrics_arguments, start_metrics_server
+
+try:
+    import uvloop  # Optional faster event loop for the asyncio engine
+except ImportError:
+    uvloop = None
+
 # Hardcoded allowed destination
 ALLOWED_HOST = "127.0.0.1"
 ALLOWED_PORT = 50129
 ALLOWED_URL = f"http://{ALLOWED_HOST}:{ALLOWED_PORT}"
 
+# Upstream connection pool
+UPSTREAM_TIMEOUT = 10  # Seconds to wait on the TorCOIN server
+UPSTREAM_POOL_SIZE = 16  # Idle keep-alive connections kept to the upstream
+UPSTREAM_IDLE_TIMEOUT = 30  # Seconds before an idle upstream connection is dropped
+PROXY_USER_AGENT = 'TorCOIN-Proxy/1.0'
+
+# Load balancing across coin_server backends
+BALANCE_STRATEGIES = ("round_robin", "least_conn", "consistent_hash")
+DEFAULT_BALANCE = "round_robin"
+HASH_REPLICAS = 100  # Points per backend on the consistent-hash ring
+HEALTH_CHECK_INTERVAL = 5  # Seconds between active health checks, 0 disables them
+HEALTH_CHECK_TIMEOUT = 2  # Seconds a health check may take
+HEALTH_CHECK_PATH = "/"
+HEALTH_FALL = 3  # Consecutive failures before a backend is ejected
+HEALTH_RISE = 2  # Consecutive successes before it is readmitted
+
+# Proxy listener
+PROXY_HOST = ""  # All interfaces
+PROXY_PORT = 8080  # Standard proxy port
+PROXY_ENGINES = ("threaded", "asyncio")
+DEFAULT_ENGINE = "threaded"
+KEEPALIVE_TIMEOUT = 15  # Seconds an idle client connection is kept open (asyncio)
+RELAY_CHUNK_SIZE = 64 * 1024  # Largest read per relay step (asyncio)
+MAX_HEADERS = 100  # Maximum header lines accepted per message (asyncio)
+MAX_BODY_SIZE = 10 * 1024 * 1024  # Largest request body forwarded upstream
+STREAM_CHUNK_SIZE = 64 * 1024  # Request body bytes forwarded per step
+MAX_CHUNK_LINE = 1024  # Longest chunk-size line accepted in a chunked body
+
+# Admission control for the threaded engine
+MAX_INFLIGHT = 64  # Worker threads, i.e. requests handled at once
+ADMISSION_QUEUE_SIZE = 256  # Accepted connections waiting for a worker
+QUEUE_DEADLINE = 2.0  # Seconds a connection may wait before it is shed
+PER_CLIENT_LIMIT = 16  # Queued plus in-flight connections per client IP
+RETRY_AFTER = 1  # Seconds suggested to shed clients
+OVERLOAD_RESPONSE = (b"HTTP/1.0 503 Service Unavailable\r\n"
+                     b"Content-Type: text/plain\r\nContent-Length: 19\r\n"
+                     b"Retry-After: %d\r\nConnection: close\r\n\r\n"
+                     b"Proxy overloaded.\r\n" % RETRY_AFTER)
+
+# Threaded relay: per-thread reusable buffer, growing while reads fill it
+RELAY_MIN_CHUNK = 16 * 1024
+RELAY_MAX_CHUNK = 1024 * 1024
+RELAY_SPLICE_THRESHOLD = 256 * 1024  # Bodies at least this big are spliced on Linux
+PIPE_CHUNK = 64 * 1024  # Default pipe capacity, the most one splice() moves
+SPLICE_SUPPORTED = hasattr(os, "splice")
+METRICS_PORT = 9180  # Localhost port of /metrics when enabled with --metrics
+
+# Headers that only apply to a single connection and are never forwarded
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'proxy-connection', 'te', 'trailers', 'transfer-encoding', 'upgrade',
+])
+# Request headers the proxy sets itself
+REQUEST_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {'host', 'content-length'}
+
+class UpstreamConnectionPool:
+    """Thread-safe pool of HTTP/1.1 keep-alive connections to one upstream.
+
+    Idle connections are reused most-recently-used first. A connection is
+    evicted when it has been idle longer than ``idle_timeout``, when the
+    upstream has closed it (its socket turns readable while idle), or when a
+    request on it fails. New connections come from ``connection_factory``.
+    """
+
+    def __init__(self, host, port, size=UPSTREAM_POOL_SIZE,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT, timeout=UPSTREAM_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connection_factory = http.client.HTTPConnection
+        self._idle = collections.deque()  # (connection, last_used)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Return (connection, reused) with a healthy idle or a new connection."""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout and self._is_healthy(conn):
+                    return conn, True
+                conn.close()
+
+        return self.connection_factory(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, conn, reusable=True):
+        """Return a connection to the pool, or close it if it can't be reused."""
+        if reusable and conn.sock is not None:
+            now = time.monotonic()
+            with self._lock:
+                # Drop connections that expired while sitting at the cold end
+                while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                    self._idle.popleft()[0].close()
+                if len(self._idle) < self.size:
+                    self._idle.append((conn, now))
+                    return
+        conn.close()
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+    @staticmethod
+    def _is_healthy(conn):
+        """An idle connection must have nothing to read; EOF means it was closed."""
+        if conn.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+RESPONSE_CACHE = ResponseCache()
+# Client conditionals are answered from the cache, never forwarded on a fill
+CACHE_FILL_SKIP_HEADERS = frozenset([
+    'if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range',
+    'cache-control', 'pragma',
+])
+
+class ProxyRequestError(Exception):
+    """A client request answered with an error status before reaching upstream."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+BLOCKED_NOT_ALLOWED = "Only TorCOIN server allowed"
+BLOCKED_INVALID = "Invalid destination"
+
+class TargetFilter:
+    """Allow-list of request targets, compiled once at startup.
+
+    ``authorities`` are the "host:port" names clients may ask the proxy for;
+    all of them are forwarded to ``upstream_url``. A check is one regex match
+    plus a frozenset lookup, so it can run on the request line alone.
+    """
+
+    ABSOLUTE_URI = re.compile(r"http://([^/?#]*)([^#]*)", re.IGNORECASE)
+
+    def __init__(self, authorities, upstream_url):
+        self.authorities = frozenset(self.normalize(authority) for authority in authorities)
+        self.upstream_url = upstream_url.rstrip("/")
+
+    @staticmethod
+    def normalize(authority):
+        """Lower-case an authority and add the default HTTP port if missing."""
+        authority = authority.lower()
+        _, sep, port = authority.rpartition(":")
+        if not sep or "]" in port:
+            authority += ":80"
+        return authority
+
+    def check(self, method, target):
+        """Return (target_url, None) if allowed, else (target, reason)."""
+        if method == "CONNECT":
+            if "@" in target or self.normalize(target) not in self.authorities:
+                return target, BLOCKED_NOT_ALLOWED
+            return target, None
+
+        match = self.ABSOLUTE_URI.fullmatch(target)
+        if match is None:
+            return target, BLOCKED_NOT_ALLOWED
+        authority, rest = match.groups()
+        if not authority or "@" in authority or "\\" in authority:
+            return target, BLOCKED_INVALID
+        if self.normalize(authority) not in self.authorities:
+            return target, BLOCKED_NOT_ALLOWED
+        if not rest.startswith("/"):
+            rest = "/" + rest
+        return self.upstream_url + rest, None
+
+def blocked_response(reason):
+    """Pre-encoded 403 sent to blocked clients before their headers are read."""
+    body = f"<html><body><h1>403 Access Denied: {reason}</h1></body></html>".encode('utf-8')
+    return (b"HTTP/1.1 403 Forbidden\r\nContent-Type: text/html; charset=utf-8\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body)) + body
+
+BLOCKED_RESPONSES = {reason: blocked_response(reason)
+                     for reason in (BLOCKED_NOT_ALLOWED, BLOCKED_INVALID)}
+BLOCKED_BODY_SIZES = {reason: len(response) - response.index(b"\r\n\r\n") - 4
+                      for reason, response in BLOCKED_RESPONSES.items()}
+TARGET_FILTER = TargetFilter([f"{ALLOWED_HOST}:{ALLOWED_PORT}"], ALLOWED_URL)
+
+def upstream_request(method, target_url, headers, body=None, chunked=False, key=None):
+    """Send a request to a backend; return (backend, conn, response).
+
+    ``key`` feeds the consistent-hash strategy. A reused connection the
+    backend closed in the meantime fails on first use, and a backend may
+    refuse a fresh one; idempotent requests are then retried, on another
+    backend in the second case. The caller releases ``conn`` to ``backend``.
+    """
+    path = upstream_path(target_url)
+    # A streamed body has been consumed and cannot be resent
+    retryable = body is None and method in ("GET", "HEAD")
+    tried = []
+
+    while True:
+        backend = BACKENDS.choose(key, exclude=tried)
+        conn, reused = backend.acquire()
+        started = time.perf_counter()
+        try:
+            conn.putrequest(method, path, skip_accept_encoding=True)
+            for header, value in headers:
+                conn.putheader(header, value)
+            conn.endheaders(body, encode_chunked=chunked)
+            response = conn.getresponse()
+        except (ConnectionError, http.client.BadStatusLine):
+            backend.release(conn, reusable=False)
+            if not reused:
+                backend.record(False)
+                tried.append(backend)
+                if BACKENDS.choose(key, exclude=tried) is None:
+                    raise
+            if not retryable:
+                raise
+            continue
+        except Exception:
+            backend.release(conn, reusable=False)
+            raise
+        backend.record(True)
+        if METRICS.enabled:
+            UPSTREAM_DURATION.observe(time.perf_counter() - started, backend.authority)
+        return backend, conn, response
+
+def upstream_path(target_url):
+    """Return the origin-form path sent upstream for a filtered target URL."""
+    parsed = urlparse(target_url)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    return path
+
+def fetch_for_cache(target_url, request_headers, entry=None):
+    """GET ``target_url`` upstream, revalidating ``entry`` if given.
+
+    Returns the CachedResponse to answer with (stored in RESPONSE_CACHE when
+    the response allows it), or None when the body is too large or of
+    unknown length; the URL then bypasses the cache for a while.
+    """
+    headers = [(header, value) for header, value in request_headers
+               if header.lower() not in CACHE_FILL_SKIP_HEADERS]
+    if entry is not None:
+        headers += entry.validators()
+
+    # Fills hash on the URL, so each page tends to be fetched from one backend
+    backend, conn, response = upstream_request("GET", target_url, headers, key=target_url)
+    try:
+        if entry is not None and response.status == 304:
+            response.read()
+            entry.revalidated(response.getheaders())
+            RESPONSE_CACHE.store(target_url, entry)
+            backend.release(conn, reusable=not response.will_close)
+            conn = None
+            return entry
+
+        if response.length is None or response.length > RESPONSE_CACHE.max_object_size:
+            RESPONSE_CACHE.mark_pass(target_url)
+            return None
+        response_headers = [(header, value) for header, value in response.getheaders()
+                            if header.lower() not in HOP_BY_HOP_HEADERS]
+        fetched = CachedResponse(response.status, response.reason, response_headers,
+                                 response.read(), request_headers)
+        if is_storable(response.status, response_headers):
+            RESPONSE_CACHE.store(target_url, fetched)
+        backend.release(conn, reusable=not response.will_close)
+        conn = None
+        return fetched
+    finally:
+        if conn is not None:
+            backend.release(conn, reusable=False)
+
+def cached_get(target_url, request_headers, revalidate=False):
+    """Return a CachedResponse for a GET, or None if it must be relayed.
+
+    Fresh entries are served as-is and entries inside their
+    stale-while-revalidate window are served while a background thread
+    refreshes them. Otherwise one request per key fetches upstream and
+    concurrent identical requests wait for its result.
+    """
+    key, entry = RESPONSE_CACHE.lookup(target_url, request_headers)
+    if entry is not None and not revalidate:
+        now = time.monotonic()
+        if entry.is_fresh(now):
+            count_cache_lookup("hit")
+            return entry
+        if entry.is_usable_stale(now):
+            count_cache_lookup("stale")
+            leader, _ = RESPONSE_CACHE.begin(key)
+            if leader:
+                threading.Thread(target=refresh_cached, args=(key, target_url, request_headers, entry),
+                                 daemon=True).start()
+            return entry
+
+    leader, flight = RESPONSE_CACHE.begin(key)
+    count_cache_lookup("collapsed" if not leader else "miss" if entry is None else "revalidate")
+    if not leader:
+        flight.done.wait(UPSTREAM_TIMEOUT)
+        if flight.result is not None and flight.result.matches(request_headers):
+            return flight.result
+        return fetch_for_cache(target_url, request_headers)
+
+    result = None
+    try:
+        result = fetch_for_cache(target_url, request_headers, entry)
+        return result
+    finally:
+        RESPONSE_CACHE.finish(key, result)
+
+def refresh_cached(key, target_url, request_headers, entry):
+    """Revalidate a stale entry in the background (stale-while-revalidate)."""
+    result = None
+    try:
+        result = fetch_for_cache(target_url, request_headers, entry)
+    except (OSError, http.client.HTTPException) as e:
+        log_message("❌ CACHE REFRESH FAILED: %s", e, level="error")
+    finally:
+        RESPONSE_CACHE.finish(key, result)
+
+_relay_local = threading.local()
+
+def relay_buffer():
+    """Return this thread's reusable relay buffer as a memoryview."""
+    view = getattr(_relay_local, 'view', None)
+    if view is None:
+        view = _relay_local.view = memoryview(bytearray(RELAY_MAX_CHUNK))
+    return view
+
+def wait_ready(sock, for_write):
+    """Block until a non-blocking socket is ready, honouring its timeout."""
+    timeout = sock.gettimeout()
+    waiting = ([], [sock], []) if for_write else ([sock], [], [])
+    if not any(select.select(*waiting, timeout)):
+        raise socket.timeout("timed out")
+
+def splice_socket(src, dst, length):
+    """Move ``length`` bytes from ``src`` to ``dst`` through a pipe.
+
+    The data never enters user space. Returns False, having moved nothing,
+    if the kernel can't splice these sockets.
+    """
+    read_end, write_end = os.pipe()
+    taken = 0
+    try:
+        while taken < length:
+            try:
+                pending = os.splice(src.fileno(), write_end, min(length - taken, PIPE_CHUNK))
+            except BlockingIOError:
+                wait_ready(src, for_write=False)
+                continue
+            except OSError as e:
+                if taken == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    return False
+                raise
+            if pending == 0:
+                raise ConnectionResetError("Upstream closed the connection mid-body")
+            taken += pending
+
+            while pending:
+                try:
+                    pending -= os.splice(read_end, dst.fileno(), pending)
+                except BlockingIOError:
+                    wait_ready(dst, for_write=True)
+        return True
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+
+def relay_response_body(conn, response, client_sock, wfile):
+    """Copy an upstream response body to the client; return its size.
+
+    Large Content-Length bodies between plain sockets are spliced kernel
+    side; everything else is read with readinto() into the thread's relay
+    buffer, whose chunk size doubles while reads keep filling it.
+    """
+    buffered = 0
+    if (SPLICE_SUPPORTED and not response.chunked and response.length is not None
+            and response.length >= RELAY_SPLICE_THRESHOLD
+            and type(conn.sock) is socket.socket and type(client_sock) is socket.socket):
+        # Hand over what http.client has already buffered, then splice the rest
+        buffered = len(response.fp.peek()[:response.length])
+        if buffered:
+            wfile.write(response.read(buffered))
+        remaining = response.length
+        if splice_socket(conn.sock, client_sock, remaining):
+            response.length = 0
+            response.read()  # Marks the response as complete
+            return buffered + remaining
+
+    view = relay_buffer()
+    size = RELAY_MIN_CHUNK
+    total = buffered
+    while True:
+        count = response.readinto(view[:size])
+        if not count:
+            return total
+        wfile.write(view[:count])
+        total += count
+        if count == size and size < len(view):
+            size *= 2
+
+def log_message(format, *args, level="info", **fields):
+    """Queue a proxy log record; formatting happens on the log writer thread."""
+    ACCESS_LOG.message(level, format, *args, **fields)
+
+def log_success(format, *args, **fields):
+    """Queue a per-request success record, subject to --log-sample."""
+    ACCESS_LOG.message("info", format, *args, sampled=True, **fields)
+
 class TorCOINProxyHandler(http.server.BaseHTTPRequestHandler):
     """Strict proxy handler that only allows TorCOIN access."""
 
+    # The head and the relayed body are separate writes; without
+    # TCP_NODELAY the body waits on the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    target_url = None
+    status_code = None
+
+    def handle_one_request(self):
+        """Handle one request, then record it once the response has been sent."""
+        self.status_code = None
+        self.route = "upstream"
+        super().handle_one_request()
+        if METRICS.enabled and self.status_code is not None:
+            record_request(self.route, self.status_code, self.body_bytes, self.started)
+
+    def parse_request(self):
+        """Filter the request target before any header is read.
+
+        Blocked requests get a pre-encoded 403 and the connection is closed,
+        so a flood of them costs one readline and one write each.
+        """
+        self.started = time.perf_counter()
+        self.body_bytes = 0
+        words = self.raw_requestline.split()
+        if len(words) == 3:
+            method, target = words[0].decode('latin-1'), words[1].decode('latin-1')
+            self.target_url, blocked = TARGET_FILTER.check(method, target)
+            if blocked:
+                self.wfile.write(BLOCKED_RESPONSES[blocked])
+                self.close_connection = True
+                self.route, self.status_code = "blocked", 403
+                self.body_bytes = BLOCKED_BODY_SIZES[blocked]
+                self.log_message("🚫 BLOCKED%s %s: %s",
+                                 " INVALID" if blocked == BLOCKED_INVALID else "", method, target,
+                                 level="warning")
+                return False
+        return super().parse_request()
+
     def do_GET(self):
         """Handle GET requests with strict filtering."""
-        try:
-            # Parse the requested URL
-            parsed_url = urlparse(self.path)
-
-            # Strict filtering: ONLY allow requests to our TorCOIN server
-            if parsed_url.netloc != f"{ALLOWED_HOST}:{ALLOWED_PORT}" and \
-               not self.path.startswith(f"http://{ALLOWED_HOST}:{ALLOWED_PORT}"):
-                self.send_error(403, "Access Denied: Only TorCOIN server allowed")
-                self.log_message("🚫 BLOCKED: %s", self.path)
-                return
+        target_url = self.target_url
 
-            # Reconstruct the target URL
-            if self.path.startswith("http"):
-                target_url = self.path
-            else:
-                target_url = urljoin(ALLOWED_URL, self.path)
+        # Answer from the response cache, else forward to TorCOIN server
+        if self.serve_cached(target_url):
+            return
+        log_success("✅ PROXYING: %s", target_url, remote=self.client_address[0])
+        self.proxy_request("GET", target_url)
 
-            # Verify it's still pointing to our server
-            target_parsed = urlparse(target_url)
-            if target_parsed.hostname != ALLOWED_HOST or target_parsed.port != ALLOWED_PORT:
-                self.send_error(403, "Access Denied: Invalid destination")
-                self.log_message("🚫 BLOCKED INVALID: %s", target_url)
+    def do_POST(self):
+        """Handle POST requests (same strict filtering), streaming the body."""
+        target_url = self.target_url
+
+        # Work out how the body is framed before contacting upstream
+        transfer_encoding = self.headers.get('Transfer-Encoding')
+        content_length = self.headers.get('Content-Length')
+        if transfer_encoding is not None:
+            if transfer_encoding.strip().lower() != 'chunked' or content_length is not None:
+                self.send_error(400, "Unsupported Transfer-Encoding")
+                return
+            body, body_headers = self.iter_chunked_body(), [('Transfer-Encoding', 'chunked')]
+        else:
+            content_length = (content_length or '0').strip()
+            if not (content_length.isascii() and content_length.isdigit()):
+                self.send_error(400, "Bad Content-Length")
                 return
+            length = int(content_length)
+            if length > MAX_BODY_SIZE:
+                self.send_error(413, "Request body too large")
+                self.log_message("🚫 BODY TOO LARGE: %s bytes", length, level="warning")
+                return
+            body, body_headers = self.iter_sized_body(length), [('Content-Length', str(length))]
+
+        log_success("✅ PROXYING POST: %s", target_url, remote=self.client_address[0])
+        self.proxy_request("POST", target_url, body, body_headers)
+
+    def iter_sized_body(self, length):
+        """Yield a Content-Length body from the client in bounded chunks.
 
-            # Forward the request to TorCOIN server
-            self.log_message("✅ PROXYING: %s", target_url)
-
-            # Add timeout and headers
-            req = urllib.request.Request(target_url)
-            req.add_header('User-Agent', 'TorCOIN-Proxy/1.0')
-
-            # Copy original headers (except host)
-            for header, value in self.headers.items():
-                if header.lower() not in ['host', 'connection', 'keep-alive', 'proxy-authenticate',
-                                        'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
-                                        'upgrade']:
-                    req.add_header(header, value)
-
-            # Make the request with timeout
-            with urllib.request.urlopen(req, timeout=10) as response:
-                # Send response back to client
-                self.send_response(response.status)
-
-                # Copy response headers
-                for header, value in response.headers.items():
-                    if header.lower() not in ['connection', 'keep-alive', 'proxy-authenticate',
-                                            'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
-                                            'upgrade', 'content-encoding']:
-                        self.send_header(header, value)
-
-                self.end_headers()
-
-                # Stream the response body
-                while True:
-                    data = response.read(8192)
-                    if not data:
-                        break
-                    self.wfile.write(data)
-
-        except urllib.error.HTTPError as e:
-            self.send_error(e.code, f"Upstream error: {e.reason}")
-            self.log_message("❌ UPSTREAM ERROR: %s", e)
-        except urllib.error.URLError as e:
-            self.send_error(502, f"Connection error: {e.reason}")
-            self.log_message("❌ CONNECTION ERROR: %s", e)
+        Chunks are views of the thread's relay buffer, valid until the next
+        one is requested, which is how http.client consumes them.
+        """
+        view = relay_buffer()
+        while length:
+            count = self.rfile.readinto(view[:min(length, STREAM_CHUNK_SIZE)])
+            if not count:
+                raise ConnectionResetError("Client closed the connection mid-body")
+            length -= count
+            yield view[:count]
+
+    def iter_chunked_body(self):
+        """Decode a chunked body from the client, yielding bounded chunks.
+
+        http.client re-chunks what is yielded when forwarding upstream.
+        """
+        total = 0
+        while True:
+            line = self.rfile.readline(MAX_CHUNK_LINE)
+            size_text = line.split(b";", 1)[0].strip().decode('latin-1')
+            if not line.endswith(b"\n") or not size_text or \
+                    any(c not in hexdigits for c in size_text):
+                raise ProxyRequestError(400, "Bad chunked body")
+            size = int(size_text, 16)
+            if size == 0:
+                break
+
+            total += size
+            if total > MAX_BODY_SIZE:
+                raise ProxyRequestError(413, "Request body too large")
+            yield from self.iter_sized_body(size)
+            if self.rfile.readline(MAX_CHUNK_LINE) not in (b"\r\n", b"\n"):
+                raise ProxyRequestError(400, "Bad chunked body")
+
+        # Skip trailers up to the terminating empty line
+        while self.rfile.readline(MAX_CHUNK_LINE) not in (b"\r\n", b"\n", b""):
+            pass
+
+    def upstream_headers(self, body_headers):
+        """Build the headers forwarded to the upstream server."""
+        # Headers named in Connection are hop-by-hop as well
+        connection_tokens = {token.strip().lower()
+                             for token in self.headers.get('Connection', '').split(',')}
+        headers = [(header, value) for header, value in self.headers.items()
+                   if header.lower() not in REQUEST_SKIP_HEADERS
+                   and header.lower() not in connection_tokens]
+
+        if not any(header.lower() == 'user-agent' for header, _ in headers):
+            headers.append(('User-Agent', PROXY_USER_AGENT))
+        return headers + list(body_headers)
+
+    def send_upstream(self, method, target_url, body, body_headers):
+        """Send the request to a backend; return (backend, conn, response)."""
+        headers = self.upstream_headers(body_headers)
+        chunked = any(header == 'Transfer-Encoding' for header, _ in body_headers)
+        return upstream_request(method, target_url, headers, body, chunked,
+                                key=self.client_address[0])
+
+    def serve_cached(self, target_url):
+        """Answer a GET from RESPONSE_CACHE; return False if it must be relayed."""
+        request_headers = list(self.headers.items())
+        mode = request_cache_mode(request_headers)
+        if not RESPONSE_CACHE.enabled:
+            return False
+        if mode == "bypass" or RESPONSE_CACHE.is_pass(target_url):
+            count_cache_lookup("bypass")
+            return False
+
+        try:
+            entry = cached_get(target_url, self.upstream_headers(()),
+                               revalidate=mode == "revalidate")
         except socket.timeout:
             self.send_error(504, "Gateway timeout")
-            self.log_message("⏰ TIMEOUT: Request timed out")
-        except Exception as e:
-            self.send_error(500, f"Proxy error: {str(e)}")
-            self.log_message("💥 PROXY ERROR: %s", e)
+            self.log_message("⏰ TIMEOUT: Request timed out", level="error")
+            return True
+        except (OSError, http.client.HTTPException) as e:
+            self.send_error(502, f"Connection error: {e}")
+            self.log_message("❌ CONNECTION ERROR: %s", e, level="error")
+            return True
+        if entry is None:
+            return False
 
-    def do_POST(self):
-        """Handle POST requests (same strict filtering)."""
-        # For simplicity, treat POST like GET with body forwarding
+        not_modified = entry.is_not_modified(request_headers)
+        self.send_response(304 if not_modified else entry.status,
+                           None if not_modified else entry.reason)
+        for header, value in entry.response_headers(not_modified):
+            self.send_header(header, value)
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(entry.body)
+        self.route = "cache"
+        self.body_bytes = 0 if not_modified else len(entry.body)
+        log_success("✅ CACHED: %s", target_url, remote=self.client_address[0])
+        return True
+
+    def proxy_request(self, method, target_url, body=None, body_headers=()):
+        """Forward a filtered request upstream and relay the response.
+
+        ``body`` is an iterable of byte chunks streamed upstream as it is read.
+        """
+        backend = conn = None
+        headers_sent = False
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length) if content_length > 0 else b''
+            backend, conn, response = self.send_upstream(method, target_url, body, body_headers)
+
+            # Send response back to client
+            self.send_response(response.status)
+
+            # Copy response headers
+            for header, value in response.getheaders():
+                if header.lower() not in HOP_BY_HOP_HEADERS:
+                    self.send_header(header, value)
+
+            self.end_headers()
+            headers_sent = True
+
+            # Stream the response body
+            self.body_bytes = relay_response_body(conn, response, self.connection, self.wfile)
+
+            backend.release(conn, reusable=not response.will_close)
+            conn = None
+
+        except ProxyRequestError as e:
+            self.send_error(e.status, e.message)
+            self.close_connection = True
+            self.log_message("🚫 BAD REQUEST BODY: %s", e.message, level="warning")
+        except socket.timeout:
+            if not headers_sent:
+                self.send_error(504, "Gateway timeout")
+            self.log_message("⏰ TIMEOUT: Request timed out", level="error")
+        except (OSError, http.client.HTTPException) as e:
+            if not headers_sent:
+                self.send_error(502, f"Connection error: {e}")
+            self.log_message("❌ CONNECTION ERROR: %s", e, level="error")
+        except Exception as e:
+            if not headers_sent:
+                self.send_error(500, f"Proxy error: {str(e)}")
+            self.log_message("💥 PROXY ERROR: %s", e, level="error")
+        finally:
+            if conn is not None:
+                backend.release(conn, reusable=False)
+
+    def send_header(self, keyword, value):
+        """Send a header, noting the body size for the response metrics."""
+        if keyword.lower() == 'content-length' and self.command != 'HEAD' \
+                and str(value).isdigit():
+            self.body_bytes = int(value)
+        super().send_header(keyword, value)
+
+    def log_request(self, code='-', size='-'):
+        """Queue a structured access record (sampled for successes)."""
+        self.status_code = int(code) if isinstance(code, int) else None
+        ACCESS_LOG.access(int(code) if isinstance(code, int) else 0,
+                          remote=self.client_address[0], method=self.command, path=self.path)
 
-            # Use the same filtering logic as GET
-            parsed_url = urlparse(self.path)
+    def log_error(self, format, *args):
+        log_message(format, *args, level="error", remote=self.client_address[0])
 
-            if parsed_url.netloc != f"{ALLOWED_HOST}:{ALLOWED_PORT}" and \
-               not self.path.startswith(f"http://{ALLOWED_HOST}:{ALLOWED_PORT}"):
-                self.send_error(403, "Access Denied: Only TorCOIN server allowed")
-                self.log_message("🚫 BLOCKED POST: %s", self.path)
+    def log_message(self, format, *args, level="info"):
+        """Route handler messages to the shared log with the client address."""
+        log_message(format, *args, level=level, remote=self.client_address[0])
+
+class AdmissionTCPServer(socketserver.TCPServer):
+    """TCPServer that admits connections to a fixed pool of worker threads.
+
+    At most ``max_inflight`` requests are handled at once. Others wait in a
+    bounded queue; a connection is shed with a fast 503 when the queue is
+    full, when its client already has ``per_client`` connections queued or
+    in flight, or when it waited longer than ``deadline`` for a worker (by
+    then the client has likely given up and the work would be wasted).
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_inflight=MAX_INFLIGHT,
+                 queue_size=ADMISSION_QUEUE_SIZE, deadline=QUEUE_DEADLINE,
+                 per_client=PER_CLIENT_LIMIT, bind_and_activate=True):
+        self.max_inflight = max_inflight
+        self.deadline = deadline
+        self.per_client = per_client
+        self.shed = 0
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._clients = collections.Counter()  # ip -> queued + in-flight connections
+        self._clients_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._workers = []
+        self._busy = [False] * max_inflight  # Written only by the worker owning the slot
+        super().__init__(server_address, handler_class, bind_and_activate)
+        ADMISSION_SERVERS.add(self)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Start the worker threads, then run the accept loop."""
+        for index in range(len(self._workers), self.max_inflight):
+            worker = threading.Thread(target=self._work, args=(index,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker, or shed it right away."""
+        ip = client_address[0]
+        with self._clients_lock:
+            admitted = self._clients[ip] < self.per_client
+            if admitted:
+                self._clients[ip] += 1
+        if admitted:
+            try:
+                self._requests.put_nowait((request, client_address, time.monotonic()))
                 return
+            except queue.Full:
+                self._leave(ip)
+        self._shed(request)
+
+    def _work(self, index):
+        """Worker loop: serve queued connections until the server closes."""
+        while not self._stopping.is_set():
+            try:
+                request, client_address, queued_at = self._requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            self._busy[index] = True
+            try:
+                if time.monotonic() - queued_at > self.deadline:
+                    self._shed(request)
+                    continue
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self._busy[index] = False
+                self._leave(client_address[0])
+                self.shutdown_request(request)
+
+    def _leave(self, ip):
+        with self._clients_lock:
+            self._clients[ip] -= 1
+            if self._clients[ip] <= 0:
+                del self._clients[ip]
+
+    def _shed(self, request):
+        """Answer 503 without reading the request and close the connection."""
+        self.shed += 1
+        if METRICS.enabled:
+            SHED.inc()
+        try:
+            request.sendall(OVERLOAD_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        """Close the socket, stop the workers and drop queued connections."""
+        super().server_close()
+        self._stopping.set()
+        self._workers = []
+        while True:
+            try:
+                request, client_address, _ = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            self._leave(client_address[0])
+            self.shutdown_request(request)
+
+class AsyncUpstreamPool:
+    """Keep-alive upstream connections for the asyncio engine.
+
+    Same policy as UpstreamConnectionPool, but for asyncio streams; it is only
+    touched from the event loop thread, so it needs no lock. New connections
+    come from the ``connection_factory`` coroutine function.
+    """
+
+    def __init__(self, host, port, size=UPSTREAM_POOL_SIZE,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT, timeout=UPSTREAM_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connection_factory = asyncio.open_connection
+        self._idle = collections.deque()  # (reader, writer, last_used)
+
+    async def acquire(self):
+        """Return (reader, writer, reused) for a healthy idle or new connection."""
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if (now - last_used <= self.idle_timeout and not reader.at_eof()
+                    and not writer.is_closing()):
+                return reader, writer, True
+            writer.close()
+
+        reader, writer = await asyncio.wait_for(
+            self.connection_factory(self.host, self.port), self.timeout)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable=True):
+        """Return a connection to the pool, or close it."""
+        if reusable and not writer.is_closing() and len(self._idle) < self.size:
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def close(self):
+        """Close every idle connection."""
+        while self._idle:
+            self._idle.pop()[1].close()
+
+class Backend:
+    """One coin_server instance with its connection pools and health state."""
+
+    def __init__(self, host, port, pool_size=UPSTREAM_POOL_SIZE,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.authority = f"{host}:{port}"
+        self.pool = UpstreamConnectionPool(host, port, pool_size, idle_timeout)
+        self.async_pool = AsyncUpstreamPool(host, port, pool_size, idle_timeout)
+        self.healthy = True
+        self.active = 0  # Requests in flight, for least_conn
+        self.failures = 0
+        self.successes = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Return (connection, reused) from the threaded engine's pool."""
+        with self._lock:
+            self.active += 1
+        return self.pool.acquire()
+
+    def release(self, conn, reusable=True):
+        with self._lock:
+            self.active -= 1
+        self.pool.release(conn, reusable)
+
+    async def acquire_async(self):
+        """Return (reader, writer, reused) from the asyncio engine's pool."""
+        reader, writer, reused = await self.async_pool.acquire()
+        with self._lock:
+            self.active += 1
+        return reader, writer, reused
 
-            if self.path.startswith("http"):
-                target_url = self.path
+    def release_async(self, reader, writer, reusable=True):
+        with self._lock:
+            self.active -= 1
+        self.async_pool.release(reader, writer, reusable)
+
+    def record(self, ok):
+        """Count a health check or request outcome; eject or readmit on streaks."""
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.successes += 1
+                changed = not self.healthy and self.successes >= HEALTH_RISE
             else:
-                target_url = urljoin(ALLOWED_URL, self.path)
+                self.successes = 0
+                self.failures += 1
+                changed = self.healthy and self.failures >= HEALTH_FALL
+            if changed:
+                self.healthy = ok
+        if changed:
+            log_message("%s BACKEND %s: %s", "💚" if ok else "💔",
+                        "READMITTED" if ok else "EJECTED", self.authority, level="warning")
+            if not ok:
+                self.pool.close()
 
-            target_parsed = urlparse(target_url)
-            if target_parsed.hostname != ALLOWED_HOST or target_parsed.port != ALLOWED_PORT:
-                self.send_error(403, "Access Denied: Invalid destination")
-                self.log_message("🚫 BLOCKED INVALID POST: %s", target_url)
-                return
+    def check(self):
+        """Run one active health check: a GET that must not answer 5xx."""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=HEALTH_CHECK_TIMEOUT)
+        try:
+            conn.request("GET", HEALTH_CHECK_PATH, headers={'User-Agent': PROXY_USER_AGENT})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 500
+        except (OSError, http.client.HTTPException):
+            ok = False
+        finally:
+            conn.close()
+        self.record(ok)
+        return ok
 
-            self.log_message("✅ PROXYING POST: %s", target_url)
+class BackendPool:
+    """Spreads requests over backends and keeps their health up to date.
 
-            req = urllib.request.Request(target_url, data=post_data, method='POST')
-            req.add_header('User-Agent', 'TorCOIN-Proxy/1.0')
+    Ejected backends are skipped; if every backend is ejected the pool fails
+    open and uses them all, since the checks may be what is wrong.
+    """
 
-            for header, value in self.headers.items():
-                if header.lower() not in ['host', 'connection', 'keep-alive', 'proxy-authenticate',
-                                        'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
-                                        'upgrade', 'content-length']:
-                    req.add_header(header, value)
+    def __init__(self, addresses, strategy=DEFAULT_BALANCE, pool_size=UPSTREAM_POOL_SIZE,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT):
+        if strategy not in BALANCE_STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+        self.backends = [Backend(host, port, pool_size, idle_timeout) for host, port in addresses]
+        self.strategy = strategy
+        self._next = itertools.count()
+        self._stop = threading.Event()
 
-            with urllib.request.urlopen(req, timeout=10) as response:
-                self.send_response(response.status)
+        # Consistent-hash ring of (point, backend), HASH_REPLICAS points per backend
+        ring = sorted((self.hash(f"{backend.authority}#{replica}"), index)
+                      for index, backend in enumerate(self.backends)
+                      for replica in range(HASH_REPLICAS))
+        self._ring_points = [point for point, _ in ring]
+        self._ring_backends = [self.backends[index] for _, index in ring]
 
-                for header, value in response.headers.items():
-                    if header.lower() not in ['connection', 'keep-alive', 'proxy-authenticate',
-                                            'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
-                                            'upgrade', 'content-encoding']:
-                        self.send_header(header, value)
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
 
-                self.end_headers()
+    def choose(self, key=None, exclude=()):
+        """Pick a backend for a request, or None if all are excluded."""
+        candidates = [b for b in self.backends if b.healthy and b not in exclude] or \
+            [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
 
-                while True:
-                    data = response.read(8192)
-                    if not data:
-                        break
-                    self.wfile.write(data)
+        if self.strategy == "consistent_hash" and key is not None:
+            start = bisect.bisect(self._ring_points, self.hash(key))
+            for offset in range(len(self._ring_backends)):
+                backend = self._ring_backends[(start + offset) % len(self._ring_backends)]
+                if backend in candidates:
+                    return backend
 
-        except Exception as e:
-            self.send_error(500, f"Proxy error: {str(e)}")
-            self.log_message("💥 PROXY POST ERROR: %s", e)
+        # Rotate the start so least_conn ties are spread as well
+        start = next(self._next) % len(candidates)
+        candidates = candidates[start:] + candidates[:start]
+        if self.strategy == "least_conn":
+            return min(candidates, key=lambda backend: backend.active)
+        return candidates[0]
+
+    def start_health_checks(self, interval=HEALTH_CHECK_INTERVAL):
+        """Check every backend each ``interval`` seconds in a daemon thread."""
+        def run():
+            while not self._stop.wait(interval):
+                for backend in self.backends:
+                    backend.check()
+        threading.Thread(target=run, name="health-checks", daemon=True).start()
+
+    def close(self):
+        """Stop health checks and close every idle connection."""
+        self._stop.set()
+        for backend in self.backends:
+            backend.pool.close()
+            backend.async_pool.close()
+
+BACKENDS = BackendPool([(ALLOWED_HOST, ALLOWED_PORT)])
+
+REQUESTS = METRICS.counter("torcoin_proxy_requests_total",
+                           "Client requests answered, by route (upstream, cache, blocked) "
+                           "and status", ("route", "status"))
+RESPONSE_BYTES = METRICS.counter("torcoin_proxy_response_bytes_total",
+                                 "Response body bytes sent to clients, by route", ("route",))
+REQUEST_DURATION = METRICS.histogram("torcoin_proxy_request_duration_seconds",
+                                     "Time from request line to response sent", ("route",))
+UPSTREAM_DURATION = METRICS.histogram("torcoin_proxy_upstream_duration_seconds",
+                                      "Time from sending a request upstream to its response head",
+                                      ("backend",))
+CACHE_LOOKUPS = METRICS.counter("torcoin_proxy_cache_lookups_total",
+                                "Response cache lookups by result (hit, stale, miss, revalidate, "
+                                "collapsed, bypass)", ("result",))
+SHED = METRICS.counter("torcoin_proxy_shed_connections_total",
+                       "Connections answered 503 by admission control")
+ADMISSION_SERVERS = weakref.WeakSet()  # Live AdmissionTCPServers, for the worker gauges
+METRICS.gauge("torcoin_proxy_busy_workers", "Worker threads serving a connection",
+              lambda: sum(sum(server._busy) for server in list(ADMISSION_SERVERS)))
+METRICS.gauge("torcoin_proxy_queued_connections", "Accepted connections waiting for a worker",
+              lambda: sum(server._requests.qsize() for server in list(ADMISSION_SERVERS)))
+METRICS.gauge("torcoin_proxy_backend_active_requests", "Requests in flight per backend",
+              lambda: [((b.authority,), b.active) for b in BACKENDS.backends], ("backend",))
+METRICS.gauge("torcoin_proxy_backend_idle_connections",
+              "Idle keep-alive connections pooled per backend",
+              lambda: [((b.authority,), len(b.pool._idle) + len(b.async_pool._idle))
+                       for b in BACKENDS.backends], ("backend",))
+METRICS.gauge("torcoin_proxy_backend_pool_size", "Idle connections a backend pool may keep",
+              lambda: [((b.authority,), b.pool.size) for b in BACKENDS.backends], ("backend",))
+METRICS.gauge("torcoin_proxy_backend_healthy", "1 while health checks admit the backend",
+              lambda: [((b.authority,), int(b.healthy)) for b in BACKENDS.backends], ("backend",))
+METRICS.gauge("torcoin_proxy_cache_bytes", "Bytes held by the response cache",
+              lambda: RESPONSE_CACHE.size)
+
+def record_request(route, status, body_bytes, started):
+    """Count one answered client request in the request metrics."""
+    REQUESTS.inc(route, status)
+    RESPONSE_BYTES.inc(route, amount=body_bytes)
+    REQUEST_DURATION.observe(time.perf_counter() - started, route)
+
+def count_cache_lookup(result):
+    if METRICS.enabled:
+        CACHE_LOOKUPS.inc(result)
+
+class RelayAborted(Exception):
+    """The response broke off after its head had been sent to the client."""
+
+async def read_http_head(reader):
+    """Read a start line and headers from an asyncio stream.
+
+    Returns (start_line, headers) with headers as a list of (name, value)
+    pairs, or None if the peer closed the connection before sending anything.
+    """
+    start_line = await read_start_line(reader)
+    if start_line is None:
+        return None
+    return start_line, await read_headers(reader)
+
+async def read_start_line(reader):
+    """Read the first line of a message, or None at a clean EOF."""
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    if not start_line.endswith(b"\n"):
+        raise asyncio.IncompleteReadError(start_line, None)
+    return start_line.decode('latin-1').strip()
+
+async def read_headers(reader):
+    """Read header lines up to the empty line as (name, value) pairs."""
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n"):
+            break
+        if not line.endswith(b"\n"):
+            raise asyncio.IncompleteReadError(line, None)
+        if len(headers) >= MAX_HEADERS:
+            raise ValueError("Too many headers")
+
+        name, sep, value = line.decode('latin-1').partition(":")
+        if not sep or not name.strip():
+            raise ValueError(f"Bad header line: {line!r}")
+        headers.append((name.strip(), value.strip()))
+
+    return headers
+
+def get_header(headers, name):
+    """Return the first value of a header from a (name, value) list."""
+    for header, value in headers:
+        if header.lower() == name:
+            return value
+    return None
+
+def connection_tokens(headers):
+    """Return the lower-cased tokens of every Connection header."""
+    return {token.strip().lower()
+            for header, value in headers if header.lower() == 'connection'
+            for token in value.split(',')}
+
+def body_framing(headers):
+    """Return ("chunked", None), ("length", n) or (None, 0) for a message.
+
+    Raises ValueError for framing that cannot be trusted.
+    """
+    lengths = [value for header, value in headers if header.lower() == 'content-length']
+    encodings = [value for header, value in headers if header.lower() == 'transfer-encoding']
+
+    if encodings:
+        if lengths or [value.strip().lower() for value in encodings] != ["chunked"]:
+            raise ValueError("Unsupported Transfer-Encoding")
+        return "chunked", None
+
+    if not lengths:
+        return None, 0
+    if len(set(lengths)) != 1 or not (lengths[0].isascii() and lengths[0].isdigit()):
+        raise ValueError("Bad Content-Length")
+    return "length", int(lengths[0])
+
+async def relay_exact(reader, writer, length, timeout=UPSTREAM_TIMEOUT):
+    """Copy exactly ``length`` bytes, waiting for the writer to drain each step."""
+    while length:
+        data = await asyncio.wait_for(reader.read(min(length, RELAY_CHUNK_SIZE)), timeout)
+        if not data:
+            raise asyncio.IncompleteReadError(b"", length)
+        writer.write(data)
+        await writer.drain()
+        length -= len(data)
 
-    def log_message(self, format, *args):
-        """Override logging with custom format."""
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] TorCOIN-Proxy: {format % args}")
+async def relay_until_eof(reader, writer, timeout=UPSTREAM_TIMEOUT):
+    """Copy everything until the reader hits EOF; return the byte count."""
+    total = 0
+    while True:
+        data = await asyncio.wait_for(reader.read(RELAY_CHUNK_SIZE), timeout)
+        if not data:
+            return total
+        writer.write(data)
+        total += len(data)
+        await writer.drain()
+
+async def relay_chunked(reader, writer, decode=False, timeout=UPSTREAM_TIMEOUT, limit=None):
+    """Copy a chunked body up to and including its trailers.
+
+    With ``decode`` only the chunk data is written (for HTTP/1.0 clients);
+    otherwise the chunked framing is passed through verbatim. Bodies larger
+    than ``limit`` raise ProxyRequestError(413). Returns the size of the
+    chunk data.
+    """
+    total = 0
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line.endswith(b"\n"):
+            raise asyncio.IncompleteReadError(line, None)
+        size_text = line.split(b";", 1)[0].strip().decode('latin-1')
+        if not size_text or any(c not in hexdigits for c in size_text):
+            raise ValueError(f"Bad chunk size: {line!r}")
+        size = int(size_text, 16)
+        total += size
+        if limit is not None and total > limit:
+            raise ProxyRequestError(413, "Request body too large")
+
+        if not decode:
+            writer.write(line)
+        if size == 0:
+            break
+
+        if decode:
+            await relay_exact(reader, writer, size, timeout)
+            if await asyncio.wait_for(reader.readline(), timeout) not in (b"\r\n", b"\n"):
+                raise ValueError("Missing chunk terminator")
+        else:
+            await relay_exact(reader, writer, size + 2, timeout)
+
+    # Trailers end with an empty line
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line.endswith(b"\n"):
+            raise asyncio.IncompleteReadError(line, None)
+        if not decode:
+            writer.write(line)
+        if line in (b"\r\n", b"\n"):
+            break
+    await writer.drain()
+    return total
+
+def encode_head(start_line, headers):
+    """Serialise a start line and headers."""
+    lines = [start_line] + [f"{header}: {value}" for header, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+async def send_async_error(writer, status, message):
+    """Send a small error response and make the connection close.
+
+    Returns the size of the body sent.
+    """
+    body = f"<html><body><h1>{status} {message}</h1></body></html>".encode('utf-8')
+    writer.write(encode_head(
+        f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+        [('Content-Type', 'text/html; charset=utf-8'),
+         ('Content-Length', str(len(body))), ('Connection', 'close')]) + body)
+    await writer.drain()
+    return len(body)
+
+def async_forwarded_headers(headers):
+    """Return the end-to-end client headers forwarded upstream."""
+    skip = REQUEST_SKIP_HEADERS | connection_tokens(headers)
+    forwarded = [(header, value) for header, value in headers if header.lower() not in skip]
+    if get_header(headers, 'user-agent') is None:
+        forwarded.append(('User-Agent', PROXY_USER_AGENT))
+    return forwarded
+
+async def serve_cached_async(target_url, version, headers, client_writer, started=None):
+    """Answer a GET from RESPONSE_CACHE.
+
+    Returns whether the client connection stays open, or None if the request
+    must be relayed. Fresh hits are answered on the event loop; fills and
+    revalidations go through cached_get on the default executor. ``started``
+    is the perf_counter() reading the request metrics are timed from.
+    """
+    mode = request_cache_mode(headers)
+    if not RESPONSE_CACHE.enabled:
+        return None
+    if mode == "bypass" or RESPONSE_CACHE.is_pass(target_url):
+        count_cache_lookup("bypass")
+        return None
+
+    forwarded = async_forwarded_headers(headers)
+    entry = None
+    if mode == "normal":
+        _, entry = RESPONSE_CACHE.lookup(target_url, forwarded)
+    if entry is not None and entry.is_fresh():
+        count_cache_lookup("hit")
+    else:
+        entry = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(cached_get, target_url, forwarded,
+                                    revalidate=mode == "revalidate"))
+        if entry is None:
+            return None
+
+    client_keep_alive = 'close' not in connection_tokens(headers) and \
+        (version == "HTTP/1.1" or 'keep-alive' in connection_tokens(headers))
+    not_modified = entry.is_not_modified(headers)
+    status_line = "HTTP/1.1 304 Not Modified" if not_modified else \
+        f"HTTP/1.1 {entry.status} {entry.reason}"
+    out_headers = entry.response_headers(not_modified)
+    out_headers.append(('Connection', 'keep-alive' if client_keep_alive else 'close'))
+    client_writer.write(encode_head(status_line, out_headers))
+    if not not_modified:
+        client_writer.write(entry.body)
+    await client_writer.drain()
+    if METRICS.enabled and started is not None:
+        record_request("cache", 304 if not_modified else entry.status,
+                       0 if not_modified else len(entry.body), started)
+    log_success("✅ CACHED: %s", target_url)
+    return client_keep_alive
+
+def async_upstream_head(method, target_url, headers, framing, length, authority):
+    """Build the request head forwarded upstream by the asyncio engine."""
+    forwarded = [('Host', authority)] + async_forwarded_headers(headers)
+    if framing == "chunked":
+        forwarded.append(('Transfer-Encoding', 'chunked'))
+    elif framing == "length":
+        forwarded.append(('Content-Length', str(length)))
+    return encode_head(f"{method} {upstream_path(target_url)} HTTP/1.1", forwarded)
+
+async def forward_async(method, target_url, version, headers, framing, length,
+                        client_reader, client_writer, key=None, started=None):
+    """Forward one filtered request and relay the response.
+
+    Returns True if the client connection can serve another request. Errors
+    after the response head went out are raised as RelayAborted, since the
+    client can no longer be sent an error page. ``started`` is the
+    perf_counter() reading the request metrics are timed from.
+    """
+    has_body = framing == "chunked" or length > 0
+    retryable = not has_body and method in ("GET", "HEAD")
+    tried = []
+
+    # Send the request; stale pooled connections and backends refusing a
+    # fresh one are retried like in upstream_request
+    while True:
+        backend = BACKENDS.choose(key, exclude=tried)
+        try:
+            up_reader, up_writer, reused = await backend.acquire_async()
+        except (OSError, asyncio.TimeoutError):
+            backend.record(False)
+            tried.append(backend)
+            if not retryable or BACKENDS.choose(key, exclude=tried) is None:
+                raise
+            continue
+        sent_at = time.perf_counter()
+        try:
+            up_writer.write(async_upstream_head(method, target_url, headers, framing, length,
+                                                backend.authority))
+            if framing == "chunked":
+                await relay_chunked(client_reader, up_writer, limit=MAX_BODY_SIZE)
+            elif length:
+                await relay_exact(client_reader, up_writer, length)
+            await up_writer.drain()
+
+            response_head = await asyncio.wait_for(read_http_head(up_reader), UPSTREAM_TIMEOUT)
+            # Skip interim 1xx responses
+            while response_head and response_head[0].split()[1:2] in (["100"], ["102"], ["103"]):
+                response_head = await asyncio.wait_for(read_http_head(up_reader), UPSTREAM_TIMEOUT)
+            if response_head is None:
+                raise ConnectionResetError("Upstream closed the connection")
+            break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            backend.release_async(up_reader, up_writer, reusable=False)
+            if not reused or not retryable:
+                raise
+        except BaseException:
+            backend.release_async(up_reader, up_writer, reusable=False)
+            raise
+    backend.record(True)
+    if METRICS.enabled:
+        UPSTREAM_DURATION.observe(time.perf_counter() - sent_at, backend.authority)
+
+    status_line, response_headers = response_head
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        backend.release_async(up_reader, up_writer, reusable=False)
+        raise ValueError(f"Bad upstream status line: {status_line!r}")
+    status = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else http.HTTPStatus(status).phrase
+
+    upstream_keep_alive = 'close' not in connection_tokens(response_headers) \
+        and parts[0] == "HTTP/1.1"
+    client_keep_alive = 'close' not in connection_tokens(headers) and \
+        (version == "HTTP/1.1" or 'keep-alive' in connection_tokens(headers))
+
+    try:
+        out_framing, out_length = body_framing(response_headers)
+    except ValueError:
+        backend.release_async(up_reader, up_writer, reusable=False)
+        raise
+
+    skip = HOP_BY_HOP_HEADERS | {'content-length'} | connection_tokens(response_headers)
+    out_headers = [(header, value) for header, value in response_headers
+                   if header.lower() not in skip]
+
+    no_body = method == "HEAD" or status in (204, 304)
+    decode_chunks = version != "HTTP/1.1"
+    if no_body:
+        if out_framing == "length":
+            out_headers.append(('Content-Length', str(out_length)))
+    elif out_framing == "chunked":
+        if decode_chunks:
+            client_keep_alive = False
+        else:
+            out_headers.append(('Transfer-Encoding', 'chunked'))
+    elif out_framing == "length":
+        out_headers.append(('Content-Length', str(out_length)))
+    else:
+        # Body ends when the upstream closes
+        client_keep_alive = upstream_keep_alive = False
+
+    out_headers.append(('Connection', 'keep-alive' if client_keep_alive else 'close'))
+    client_writer.write(encode_head(f"HTTP/1.1 {status} {reason}", out_headers))
+
+    try:
+        if no_body:
+            body_bytes = 0
+        elif out_framing == "chunked":
+            body_bytes = await relay_chunked(up_reader, client_writer, decode=decode_chunks)
+        elif out_framing == "length":
+            await relay_exact(up_reader, client_writer, out_length)
+            body_bytes = out_length
+        else:
+            body_bytes = await relay_until_eof(up_reader, client_writer)
+        await client_writer.drain()
+    except Exception as e:
+        backend.release_async(up_reader, up_writer, reusable=False)
+        raise RelayAborted(str(e) or type(e).__name__) from e
+    except BaseException:
+        backend.release_async(up_reader, up_writer, reusable=False)
+        raise
+
+    backend.release_async(up_reader, up_writer, reusable=upstream_keep_alive)
+    if METRICS.enabled and started is not None:
+        record_request("upstream", status, body_bytes, started)
+    return client_keep_alive
+
+async def handle_proxy_connection(client_reader, client_writer):
+    """Serve one client connection of the asyncio engine."""
+    peer = client_writer.get_extra_info('peername')
+    remote = peer[0] if peer else None
+    started = None
+
+    async def send_error(status, message):
+        """send_async_error, counted in the request metrics."""
+        body_bytes = await send_async_error(client_writer, status, message)
+        if METRICS.enabled and started is not None:
+            record_request("upstream", status, body_bytes, started)
+
+    try:
+        while True:
+            response_started = False
+            try:
+                start_line = await asyncio.wait_for(read_start_line(client_reader),
+                                                    KEEPALIVE_TIMEOUT)
+                if start_line is None:
+                    break
+                started = time.perf_counter()
+
+                parts = start_line.split()
+                if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                    raise ProxyRequestError(400, "Bad request")
+                method, path, version = parts
+
+                # Reject before reading the headers
+                target_url, blocked = TARGET_FILTER.check(method, path)
+                if blocked:
+                    client_writer.write(BLOCKED_RESPONSES[blocked])
+                    if METRICS.enabled:
+                        record_request("blocked", 403, BLOCKED_BODY_SIZES[blocked], started)
+                    log_message("🚫 BLOCKED%s %s: %s",
+                                " INVALID" if blocked == BLOCKED_INVALID else "", method, path,
+                                level="warning", remote=remote)
+                    break
+                if method == "CONNECT":
+                    raise ProxyRequestError(501, "CONNECT is not supported")
+                headers = await asyncio.wait_for(read_headers(client_reader), KEEPALIVE_TIMEOUT)
+
+                try:
+                    framing, length = body_framing(headers)
+                except ValueError:
+                    raise ProxyRequestError(400, "Bad request framing")
+                if framing == "length" and length > MAX_BODY_SIZE:
+                    raise ProxyRequestError(413, "Request body too large")
+
+                response_started = True
+                if method == "GET" and framing is None:
+                    keep_alive = await serve_cached_async(target_url, version, headers,
+                                                          client_writer, started)
+                    if keep_alive is not None:
+                        if not keep_alive:
+                            break
+                        continue
+
+                log_success("✅ PROXYING %s: %s", method, target_url, remote=remote)
+                if not await forward_async(method, target_url, version, headers,
+                                           framing, length, client_reader, client_writer,
+                                           key=remote, started=started):
+                    break
+
+            except ProxyRequestError as e:
+                await send_error(e.status, e.message)
+                break
+            except RelayAborted as e:
+                log_message("❌ RELAY ABORTED: %s", e, level="error")
+                break
+            except asyncio.TimeoutError:
+                if response_started:
+                    await send_error(504, "Gateway timeout")
+                    log_message("⏰ TIMEOUT: Request timed out", level="error")
+                break
+            except ValueError as e:
+                await send_error(400 if not response_started else 502,
+                                 "Bad request" if not response_started else "Bad gateway")
+                log_message("❌ PROTOCOL ERROR: %s", e, level="error")
+                break
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                if response_started:
+                    await send_error(502, f"Connection error: {e}")
+                    log_message("❌ CONNECTION ERROR: %s", e, level="error")
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        client_writer.close()
+        try:
+            await client_writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+async def serve_async_proxy():
+    """Run the asyncio proxy engine until cancelled."""
+    server = await asyncio.start_server(handle_proxy_connection, PROXY_HOST or None,
+                                        PROXY_PORT, backlog=1024)
+    print(f"[✅] TorCOIN Proxy started on port {PROXY_PORT} "
+          f"(asyncio engine on {'uvloop' if uvloop else 'asyncio'} event loop)")
+    print("[🛡️ ] STRICT MODE ACTIVE - Only TorCOIN traffic allowed!")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        BACKENDS.close()
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="TorCOIN Self Proxy Server")
+    parser.add_argument("--host", default=PROXY_HOST,
+                        help="address to bind (default: all interfaces)")
+    parser.add_argument("--port", type=int, default=PROXY_PORT,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument("--engine", choices=PROXY_ENGINES, default=DEFAULT_ENGINE,
+                        help="proxy engine (default: %(default)s)")
+    parser.add_argument("--max-inflight", type=int, default=MAX_INFLIGHT,
+                        help="requests handled at once by the threaded engine (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=ADMISSION_QUEUE_SIZE,
+                        help="connections waiting for a worker before 503s (default: %(default)s)")
+    parser.add_argument("--queue-deadline", type=float, default=QUEUE_DEADLINE,
+                        help="seconds a connection may wait for a worker (default: %(default)s)")
+    parser.add_argument("--per-client", type=int, default=PER_CLIENT_LIMIT,
+                        help="connections per client IP queued or in flight (default: %(default)s)")
+    parser.add_argument("--allow", action="append", default=[], metavar="HOST[:PORT]",
+                        help="extra name clients may use for the TorCOIN server, "
+                             "e.g. www.torcoin.cnet (repeatable)")
+    parser.add_argument("--max-body-size", type=int, default=MAX_BODY_SIZE,
+                        help="largest request body forwarded, in bytes (default: %(default)s)")
+    parser.add_argument("--cache-size", type=int, default=RESPONSE_CACHE.max_bytes,
+                        help="response cache budget in bytes, 0 disables it (default: %(default)s)")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser, METRICS_PORT)
+    parser.add_argument("--backend", action="append", default=[], metavar="HOST:PORT",
+                        help="coin_server instance to balance over (repeatable, "
+                             f"default: {ALLOWED_HOST}:{ALLOWED_PORT})")
+    parser.add_argument("--balance", choices=BALANCE_STRATEGIES, default=DEFAULT_BALANCE,
+                        help="load balancing strategy (default: %(default)s)")
+    parser.add_argument("--health-interval", type=float, default=HEALTH_CHECK_INTERVAL,
+                        help="seconds between backend health checks, 0 disables them "
+                             "(default: %(default)s)")
+    parser.add_argument("--pool-size", type=int, default=UPSTREAM_POOL_SIZE,
+                        help="idle keep-alive connections kept per backend (default: %(default)s)")
+    parser.add_argument("--pool-idle-timeout", type=float, default=UPSTREAM_IDLE_TIMEOUT,
+                        help="seconds before an idle upstream connection is dropped (default: %(default)s)")
+    args = parser.parse_args()
+
+    backends = []
+    for backend in args.backend or [f"{ALLOWED_HOST}:{ALLOWED_PORT}"]:
+        host, _, port = backend.rpartition(":")
+        if not host or not port.isdigit():
+            parser.error(f"--backend expects HOST:PORT, got {backend!r}")
+        backends.append((host.strip("[]"), int(port)))
+    args.backend = backends
+    return args
 
 def main():
     """Main proxy server function."""
-    PROXY_PORT = 8080  # Standard proxy port
+    global MAX_BODY_SIZE, TARGET_FILTER, BACKENDS, PROXY_HOST, PROXY_PORT
+    args = parse_args()
+    PROXY_HOST, PROXY_PORT = args.host, args.port
+    configure_logging(args, "torcoin_proxy")
+    TARGET_FILTER = TargetFilter([f"{ALLOWED_HOST}:{ALLOWED_PORT}", *args.allow], ALLOWED_URL)
+    MAX_BODY_SIZE = args.max_body_size
+    RESPONSE_CACHE.max_bytes = args.cache_size
+    BACKENDS = BackendPool(args.backend, args.balance, args.pool_size, args.pool_idle_timeout)
+    if args.health_interval > 0:
+        BACKENDS.start_health_checks(args.health_interval)
+    if args.metrics:
+        try:
+            start_metrics_server(args.metrics_port)
+        except OSError as e:
+            print(f"[❌] Cannot serve metrics on port {args.metrics_port}: {e}")
+            return
 
     print("=" * 60)
     print("         TORCOIN SELF PROXY SERVER")
     print("=" * 60)
     print(f"🛡️  STRICT MODE: Only allowing access to {ALLOWED_URL}")
-    print(f"🌐 Proxy listening on port: {PROXY_PORT}")
+    for alias in args.allow:
+        print(f"🛡️  Also accepted as: {alias}")
+    print(f"🌐 Proxy listening on port: {PROXY_PORT} ({args.engine} engine)")
     print()
     print("🔒 SECURITY FEATURES:")
     print("✅ Blocks all traffic except TorCOIN server")
     print("✅ No external internet access through proxy")
     print("✅ Request/response filtering")
     print("✅ Timeout protection")
+    if args.engine == "threaded":
+        print(f"✅ Admission control ({args.max_inflight} in flight, {args.queue_size} queued, "
+              f"{args.per_client} per client)")
+    print(f"✅ Keep-alive upstream pool ({args.pool_size} connections per backend)")
+    backend_list = ", ".join(backend.authority for backend in BACKENDS.backends)
+    print(f"✅ Backends ({args.balance}): {backend_list}")
+    if RESPONSE_CACHE.enabled:
+        print(f"✅ Response cache ({args.cache_size // (1024 * 1024)} MB)")
+    if args.metrics:
+        print(f"✅ Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
     print()
     print("📋 USAGE:")
     print(f"Set browser proxy to: localhost:{PROXY_PORT}")
@@ -183,7 +1569,16 @@ def main():
     print("=" * 60)
 
     try:
-        with socketserver.ThreadingTCPServer(("", PROXY_PORT), TorCOINProxyHandler) as httpd:
+        if args.engine == "asyncio":
+            if uvloop:
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            asyncio.run(serve_async_proxy())
+            return
+
+        with AdmissionTCPServer((PROXY_HOST, PROXY_PORT), TorCOINProxyHandler,
+                                max_inflight=args.max_inflight, queue_size=args.queue_size,
+                                deadline=args.queue_deadline,
+                                per_client=args.per_client) as httpd:
             print(f"[✅] TorCOIN Proxy started on port {PROXY_PORT}")
             print("[🛡️ ] STRICT MODE ACTIVE - Only TorCOIN traffic allowed!")
             httpd.serve_forever()
@@ -22,6 +22,8 @@ import string
 import hashlib
 from datetime import datetime, timedelta
 
+from torcoin_cards import CardAllocator, CardPool, generate_card_numbers
+
 # Plaid Configuration
 PLAID_CLIENT_ID = "your_plaid_client_id_here"  # Replace with actual Plaid client ID
 PLAID_SECRET = "your_plaid_secret_here"        # Replace with actual Plaid secret
@@ -191,139 +193,49 @@ class VirtualCardAI:
 
     def __init__(self, wallet_instance):
         self.wallet = wallet_instance
-        self.existing_cards = set()
-        self.card_pool = set()  # Pool of pre-generated unique cards
+        # Card numbers come from a keyed permutation of a persisted counter,
+        # so there is no pool to pre-generate
+        self.card_allocator = CardAllocator("card_allocator.bin")
+        self.issued_cards = set()
+        self.retired_pool = None
         self.load_existing_cards()
-        self.initialize_card_pool()
-
-    def initialize_card_pool(self):
-        """Initialize the card pool with pre-generated unique cards."""
-        try:
-            # Load existing pool if available
-            if os.path.exists("card_pool.json"):
-                with open("card_pool.json", 'r') as f:
-                    pool_data = json.load(f)
-                    self.card_pool = set(pool_data.get('cards', []))
-                    last_generation = pool_data.get('last_generation', '')
-
-                    # Check if we need to regenerate (new day)
-                    today = datetime.now().strftime("%Y-%m-%d")
-                    if last_generation != today:
-                        self.regenerate_daily_pool()
-                    elif len(self.card_pool) < 100000:  # Minimum pool size
-                        self.expand_card_pool()
-            else:
-                self.regenerate_daily_pool()
-
-        except Exception as e:
-            print(f"Error initializing card pool: {e}")
-            self.regenerate_daily_pool()
-
-    def regenerate_daily_pool(self):
-        """Regenerate the entire card pool for the day (invisible background process)."""
-        print("🔄 Regenerating daily card pool... (invisible AI process)")
-        self.card_pool.clear()
-
-        # Generate 1,000,000 unique cards
-        target_cards = 1000000
-        generated = 0
-
-        while generated < target_cards:
-            # Generate card number
-            card_number = self.generate_card_number_raw()
+        self.load_retired_card_pool()
 
-            # Ensure uniqueness
-            if card_number not in self.existing_cards and card_number not in self.card_pool:
-                self.card_pool.add(card_number)
-                generated += 1
-
-                # Progress indicator (invisible but logged)
-                if generated % 100000 == 0:
-                    print(f"🎯 Generated {generated}/{target_cards} cards...")
-
-        # Save the pool
-        self.save_card_pool()
-        print("✅ Daily card pool regeneration complete!")
-
-    def expand_card_pool(self):
-        """Expand the card pool if it gets low."""
-        initial_size = len(self.card_pool)
-        target_additional = 100000
-
-        added = 0
-        while added < target_additional:
-            card_number = self.generate_card_number_raw()
-
-            if card_number not in self.existing_cards and card_number not in self.card_pool:
-                self.card_pool.add(card_number)
-                added += 1
-
-        if added > 0:
-            self.save_card_pool()
-            print(f"📈 Expanded card pool by {added} cards (now {len(self.card_pool)} total)")
+    def load_retired_card_pool(self):
+        """Map the card pool left by older wallets so its cards are never reissued."""
+        if os.path.exists("card_pool.json"):  # Only unissued cards; nothing to keep
+            os.remove("card_pool.json")
+        if os.path.exists("card_pool.bin"):
+            try:
+                pool = CardPool()
+                pool.open("card_pool.bin")
+                self.retired_pool = pool
+            except Exception as e:
+                print(f"Error loading retired card pool: {e}")
 
     def generate_card_number_raw(self):
-        """Generate a raw card number without Luhn validation (for pool generation)."""
+        """Generate a random raw card number without Luhn validation."""
         # Format: 8948XXXXXXXX2241
-        middle_digits = ""
-        for _ in range(8):
-            middle_digits += str(random.randint(0, 9))
-
-        return "8948" + middle_digits + "2241"
-
-    def save_card_pool(self):
-        """Save the card pool to disk."""
-        try:
-            pool_data = {
-                'cards': list(self.card_pool),
-                'last_generation': datetime.now().strftime("%Y-%m-%d"),
-                'pool_size': len(self.card_pool)
-            }
-
-            with open("card_pool.json", 'w') as f:
-                json.dump(pool_data, f)
-
-        except Exception as e:
-            print(f"Error saving card pool: {e}")
-
-    def load_existing_cards(self):
-        """Load existing card numbers to ensure uniqueness."""
-        if 'virtual_cards' in self.wallet.wallet_data:
-            for card_data in self.wallet.wallet_data['virtual_cards'].values():
-                self.existing_cards.add(card_data['card_number'])
+        return generate_card_numbers(1).pop()
 
     def load_existing_cards(self):
         """Load existing card numbers to ensure uniqueness."""
         if 'virtual_cards' in self.wallet.wallet_data:
             for card_data in self.wallet.wallet_data['virtual_cards'].values():
-                self.existing_cards.add(card_data['card_number'])
+                self.issued_cards.add(card_data['card_number'])
 
     def generate_unique_card_number(self):
-        """Get a unique card number from the pre-generated pool."""
-        # Ensure pool has cards available
-        if len(self.card_pool) < 1000:  # Emergency expansion
-            print("⚠️  Card pool low, expanding...")
-            self.expand_card_pool()
-
-        if not self.card_pool:
-            print("❌ No cards available in pool!")
+        """Get the next unique card number from the card allocator."""
+        exclude = [self.issued_cards]
+        if self.retired_pool is not None:
+            exclude.append(self.retired_pool)
+
+        card_number = self.card_allocator.take(*exclude)
+        if card_number is None:
+            print("❌ No card numbers left to allocate!")
             return None
 
-        # Get a card from the pool
-        card_number = self.card_pool.pop()
-
-        # Add to existing cards to prevent reuse
-        self.existing_cards.add(card_number)
-
-        # Save updated pool
-        self.save_card_pool()
-
-        # Auto-expand if getting low
-        if len(self.card_pool) < 50000:
-            # Expand in background (invisible)
-            import threading
-            threading.Thread(target=self.expand_card_pool, daemon=True).start()
-
+        self.issued_cards.add(card_number)
         return card_number
 
     def validate_card_format(self, card_number):
@@ -345,7 +257,7 @@ class VirtualCardAI:
         return True
 
     def generate_valid_luhn_prefix(self):
-        """Get card number from pre-generated pool (legacy method for compatibility)."""
+        """Get card number from the card allocator (legacy method for compatibility)."""
         return self.generate_unique_card_number()
 
     def calculate_luhn_check_digit(self, card_number):